@@ -1,16 +1,37 @@
 from .midjourney_imagine_node import MidjourneyImagineNode
-from .midjourney_action_node import MidjourneyActionNode
+from .midjourney_action_node import MidjourneyActionNode, MidjourneyBatchActionNode
 from .midjourney_blend_node import MidjourneyBlendNode
+from .midjourney_pipeline_node import MidjourneyImaginePipelineNode
+from .midjourney_load_image_node import MidjourneyLoadImageNode
+from .gpt_image_generate_node import GPTImageGenerateNode
+from .gpt_image_edit_node import GPTImageEditNode
+
+# 节点模块只依赖标准库，torch / numpy / PIL / aiohttp / openai 与客户端都在首次执行时才导入，
+# 见 import_benchmark.py
+from .warmup import start_warmup
+
+# config.ini 中开启 [WARMUP] 时在后台预热到中转 / CDN 的连接
+start_warmup()
 
 
 NODE_CLASS_MAPPINGS = {
     "MidjourneyImagineNode": MidjourneyImagineNode,
     "MidjourneyActionNode": MidjourneyActionNode,
+    "MidjourneyBatchActionNode": MidjourneyBatchActionNode,
     "MidjourneyBlendNode": MidjourneyBlendNode,
+    "MidjourneyImaginePipelineNode": MidjourneyImaginePipelineNode,
+    "MidjourneyLoadImageNode": MidjourneyLoadImageNode,
+    "GPTImageGenerateNode": GPTImageGenerateNode,
+    "GPTImageEditNode": GPTImageEditNode,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "MidjourneyImagineNode": "MidjourneyImagineNode",
     "MidjourneyActionNode": "Midjourney Upscale/Variation",
+    "MidjourneyBatchActionNode": "Midjourney Batch Upscale/Variation",
     "MidjourneyBlendNode": "Midjourney Blend (Image Mix)",
+    "MidjourneyImaginePipelineNode": "Midjourney Imagine + Batch Upscale/Variation",
+    "MidjourneyLoadImageNode": "Midjourney Load Image",
+    "GPTImageGenerateNode": "GPT Image Generate",
+    "GPTImageEditNode": "GPT Image Edit",
 }
@@ -1,22 +1,88 @@
 import os
+import re
 import json
-import numpy as np
-from PIL import Image
-from io import BytesIO
+import time
+import contextvars
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlparse
 from .utils import init_logger, load_config
+from .cassette import get_recorder
+from .connections import client_session, register_loop
+from .coordination import budget_key, get_coordinator
+from .decode_pool import decode_image, decode_preview, get_decode_pool
+from .endpoint_pool import get_endpoint_pool
+from .image_ref import MJImageRef
+from .output_sink import get_output_sink
+from .pixel_cache import get_pixel_cache
+from .scheduler import get_scheduler, prompt_mode
+from .upload_body import StreamingJSONBody
 import asyncio
 import aiohttp
 import base64
 
+try:
+    # 运行在 ComfyUI 中时，用于感知用户点击的“中断”
+    import comfy.model_management as comfy_mm
+except ImportError:
+    comfy_mm = None
+
 logger = init_logger()
 config = load_config()
 
-logger.info(f"config: {config}")
+# 当前正在下载结果图的任务，供录制模式把下载事件关联到 task_id
+_current_task_id = contextvars.ContextVar("mj_current_task_id", default=None)
+# 当前作业（run_job）中尚未结束的远端任务，取消作业时据此通知后端
+_job_tasks = contextvars.ContextVar("mj_job_tasks", default=None)
+# 当前作业的调度优先级（interactive / normal / bulk），见 scheduler.py
+_job_priority = contextvars.ContextVar("mj_job_priority", default="normal")
+# 当前作业结果图的长边上限（像素），0 表示原图
+_job_max_side = contextvars.ContextVar("mj_job_max_side", default=0)
+
+
+def _processing_interrupted():
+    return comfy_mm is not None and comfy_mm.processing_interrupted()
+
+
+# 结果落盘时最多保留多少个尚未下载的任务的元数据（只查询 buttons、从不下载的任务会被挤出）
+_SINK_PENDING_LIMIT = 1024
+
+# Midjourney 任务 ID（纯数字），用于区分 Blend 输入中的 task_id 与 base64
+_TASK_ID = re.compile(r"^\d{6,}$")
+
+# CDN 主机 -> 实测最快的下载路由（代理地址，空字符串表示直连），由 net_profiler.apply() 写入，进程内所有客户端共享
+cdn_routes = {}
+
+
+def _parse_progress(value):
+    """中转返回的进度形如 "45%"，解析为 0~100 的整数"""
+    try:
+        return int(float(str(value).strip().rstrip('%')))
+    except (TypeError, ValueError):
+        return None
 
 class MJClient:
-    def __init__(self):
-        self.api_url = config['MIDJOURNEY_API']['api_url']
-        self.api_key = ""
+    """
+    Midjourney 中转客户端。api_url / api_key 在创建时绑定且只读，同一实例可以被多个节点
+    并发使用而不会串用密钥；节点应通过 get_client(app_key) 获取共享实例
+    """
+
+    def __init__(self, api_key="", api_url=None):
+        self._api_url = (api_url or config['MIDJOURNEY_API']['api_url']).rstrip('/')
+        self._api_key = api_key
+        # 任务状态轮询间隔（秒），压测时可调小
+        self.poll_interval = config['MIDJOURNEY_API'].getfloat('poll_interval', 10)
+        # 取消远端任务的接口路径（如 /mj/task/{task_id}/cancel），为空表示中转不支持
+        self.cancel_path = config['MIDJOURNEY_API'].get('cancel_path', '')
+        # 中间预览图的最小拉取间隔（秒）
+        self.preview_interval = config['MIDJOURNEY_API'].getfloat('preview_interval', 5)
+        # 中转的 Blend 接口是否接受图片 URL（否则上传原图字节）
+        self.blend_image_urls = config['MIDJOURNEY_API'].getboolean('blend_image_urls', False)
+        # Blend 输入未全部就绪时以 chunked 传输开始上传；中转不接受 chunked 请求体时设为 false，等输入就绪后再发送
+        self.chunked_upload = config['MIDJOURNEY_API'].getboolean('chunked_upload', True)
+        # 支持 width / format 缩放参数的图片主机（Discord 媒体代理），max_side 下载时请求缩小版本
+        self.resize_hosts = [h.strip() for h in config['MIDJOURNEY_API'].get(
+            'resize_hosts', 'cdn.discordapp.com, media.discordapp.net').split(',') if h.strip()]
         # 设置超时配置
         self.timeout = aiohttp.ClientTimeout(
             total=300,        # 总超时时间 5 分钟
@@ -24,14 +90,87 @@ class MJClient:
             sock_read=60      # 读取超时时间 60 秒
         )
         
-        # 检测系统代理设置
-        self.proxy_url = self._detect_system_proxy()
+        # 检测系统代理设置（进程内只探测一次，开启预热时已在后台完成）
+        self.proxy_url = system_proxy()
         if self.proxy_url:
             logger.info(f"检测到系统代理: {self.proxy_url}")
         else:
             logger.info("未检测到系统代理")
 
-    def _detect_system_proxy(self):
+        # CDN 主机 -> 实测最快的下载路由，即模块级的 cdn_routes（预热时的延迟分析或 network_diagnostic 写入）
+        self.cdn_routes = cdn_routes
+
+        # 多端点/多密钥池（config.ini 中配置 [MIDJOURNEY_POOL] 时启用），进程内共享
+        self.pool = get_endpoint_pool(config)
+        # 优先级调度与 fast/relax/turbo 模式选择（config.ini 中配置 [MIDJOURNEY_SCHEDULER] 时启用），进程内共享
+        self.scheduler = get_scheduler(config)
+        # 图片解码 / base64 编码在独立执行器中运行，不占用事件循环（config.ini 中 [DECODE]），进程内共享
+        self.decode_pool = get_decode_pool()
+        # 同一主机多个进程共享任务状态、结果图缓存和并发名额（config.ini 中配置 [COORDINATION] 时启用）
+        self.coord = get_coordinator()
+        # 热点结果图的解码像素缓存（config.ini 中配置 [PIXEL_CACHE] 时启用），进程内共享
+        self.pixels = get_pixel_cache()
+        # 结果落盘（config.ini 中配置 [OUTPUT_SINK] 时启用）：原始字节 + 元数据由后台线程写入，进程内共享
+        self.sink = get_output_sink()
+        # task_id -> 待随结果图保存的元数据（提示词、buttons、各阶段时间），结果图保存后移除
+        self._sink_pending = OrderedDict()
+        self._sink_lock = threading.Lock()
+
+        # 录制模式：把请求时序、状态序列和图片大小写入 cassette，供 replay.py 离线回放
+        self.recorder = None
+        record_path = config['MIDJOURNEY_API'].get('record_cassette', '')
+        if record_path:
+            self.start_recording(record_path)
+
+    @property
+    def api_url(self):
+        return self._api_url
+
+    @property
+    def api_key(self):
+        return self._api_key
+
+    def start_recording(self, path):
+        """开启录制，多个实例录制到同一路径时共享一个文件"""
+        self.recorder = get_recorder(path, api_url=self.api_url)
+        return self.recorder
+
+    def stop_recording(self):
+        self.recorder = None
+
+    def _record(self, event_type, **fields):
+        if self.recorder is not None:
+            self.recorder.record(event_type, **fields)
+
+    def _record_download(self, image_data, started):
+        self._record("download", task_id=_current_task_id.get(), bytes=len(image_data),
+                     latency=round(time.monotonic() - started, 4))
+
+    def _sink_note(self, task_id, **fields):
+        """记录任务结果落盘时的元数据，未启用结果落盘时忽略"""
+        if self.sink is None or not task_id:
+            return
+        with self._sink_lock:
+            entry = self._sink_pending.setdefault(task_id, {"kind": "mj", "task_id": task_id})
+            entry.update((k, v) for k, v in fields.items() if v is not None)
+            self._sink_pending.move_to_end(task_id)
+            while len(self._sink_pending) > _SINK_PENDING_LIMIT:
+                self._sink_pending.popitem(last=False)
+
+    async def _sink_save(self, task_id, image_data, **fields):
+        """把任务结果图的原始字节交给结果写入器；同一任务只保存一次（Blend 复用原图等再次下载时跳过）"""
+        with self._sink_lock:
+            record = self._sink_pending.pop(task_id, None)
+        if record is None:
+            return
+        record.update((k, v) for k, v in fields.items() if v is not None)
+        try:
+            await self.sink.asubmit(image_data, f"mj-{task_id}", record)
+        except Exception as e:
+            logger.warning(f"Failed to queue result of task {task_id} for saving: {e}")
+
+    @staticmethod
+    def _detect_system_proxy():
         """
         检测系统代理设置
         """
@@ -68,13 +207,14 @@ class MJClient:
         common_proxy_ports = [33210]
         for port in common_proxy_ports:
             proxy_url = f"http://127.0.0.1:{port}"
-            if self._test_proxy_connection(proxy_url):
+            if MJClient._test_proxy_connection(proxy_url):
                 logger.info(f"检测到可用的本地代理: {proxy_url}")
                 return proxy_url
         
         return None
 
-    def _test_proxy_connection(self, proxy_url, timeout=3):
+    @staticmethod
+    def _test_proxy_connection(proxy_url, timeout=3):
         """
         测试代理连接是否可用
         """
@@ -95,37 +235,270 @@ class MJClient:
         except Exception:
             return False
 
+    def _headers(self, endpoint=None):
+        api_key = endpoint.api_key if endpoint is not None and endpoint.api_key else self.api_key
+        return {
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json; charset=utf-8'
+        }
+
+    def _base_url(self, endpoint=None):
+        return endpoint.url if endpoint is not None else self.api_url
+
+    def _task_endpoint(self, task_id):
+        """任务所在端点：优先使用创建它的端点，未知任务走池中的首选端点"""
+        if self.pool is None:
+            return None
+        return self.pool.endpoint_for(task_id) or self.pool.primary()
+
+    @staticmethod
+    def _is_endpoint_failure(error):
+        """区分端点故障（应切换端点）与请求本身的错误（如提示词不合法，换端点也没用）"""
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status >= 500 or error.status in (401, 403, 429)
+        return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+    @staticmethod
+    def _apply_mode(payload, mode):
+        """
+        把调度器选择的模式写入提交参数：imagine 追加到提示词（提示词中已显式指定时不覆盖），
+        blend / 放大 / 变体 通过 accountFilter.modes 指定
+        return 实际使用的模式，None 表示账户默认模式
+        """
+        if "prompt" in payload:
+            explicit = prompt_mode(payload["prompt"])
+            if explicit or mode is None:
+                return explicit
+            payload["prompt"] = f"{payload['prompt']} --{mode}"
+            return mode
+        if mode is not None:
+            payload["accountFilter"] = {"modes": [mode.upper()]}
+        return mode
+
+    async def _post_submit(self, path, payload, route, parent=None, session=None, body=None, **record_fields):
+        """
+        提交任务：配置了调度器时先按当前作业优先级排队放行，并为任务选择 fast/relax/turbo 模式
+        payload: 提交参数 dict
+        body: 流式请求体（StreamingJSONBody，引用同一个 payload），为 None 时发送 json.dumps(payload)
+        return task_id
+        """
+        if self.scheduler is None:
+            task_id = await self._submit_to_endpoint(path, body or json.dumps(payload), route, parent, session,
+                                                     **record_fields)
+            self._sink_note(task_id, route=route, parent=parent, prompt=payload.get("prompt"),
+                            index=payload.get("index"), submitted_at=round(time.time(), 3))
+            self._track(task_id)
+            return task_id
+
+        ticket = await self.scheduler.acquire(_job_priority.get())
+        try:
+            mode = self._apply_mode(payload, ticket.mode)
+            task_id = await self._submit_to_endpoint(path, body or json.dumps(payload), route, parent, session,
+                                                     mode=mode, **record_fields)
+        except BaseException:
+            self.scheduler.release(ticket)
+            raise
+        if task_id:
+            self.scheduler.bind(ticket, task_id, mode)
+        else:
+            self.scheduler.release(ticket)
+        self._sink_note(task_id, route=route, parent=parent, prompt=payload.get("prompt"),
+                        index=payload.get("index"), mode=mode, submitted_at=round(time.time(), 3))
+        self._track(task_id)
+        return task_id
+
+    @staticmethod
+    def _track(task_id):
+        """把任务登记到当前作业（run_job）：作业结束时归还其名额，被取消时通知后端取消"""
+        tracked = _job_tasks.get()
+        if task_id and tracked is not None:
+            tracked.add(task_id)
+
+    async def _release_task(self, task_id):
+        """
+        归还任务占用的调度名额、端点并发名额（pin 保留，后续放大/变体仍发往同一端点）
+        与跨进程的 端点+密钥 名额；重复调用无副作用
+        """
+        if self.pool is not None:
+            self.pool.release(task_id)
+        if self.scheduler is not None:
+            self.scheduler.release(task_id=task_id)
+        if self.coord is not None:
+            await self.coord.release_slot(task_id=task_id)
+
+    async def _submit_to_endpoint(self, path, payload, route, parent=None, session=None, **record_fields):
+        """
+        配置了端点池时按健康/延迟/剩余并发选择端点并在端点故障时切换；
+        放大/变体（parent 不为空）固定发往父任务所在端点
+        return task_id
+        """
+        tried = []
+        while True:
+            endpoint = None
+            if self.pool is not None:
+                if parent:
+                    endpoint = await self.pool.reserve_on(self._task_endpoint(parent))
+                else:
+                    endpoint = await self.pool.reserve(exclude=tried)
+                    if endpoint is None:
+                        raise RuntimeError(f"All Midjourney endpoints failed for {route}")
+
+            url = self._base_url(endpoint) + path
+            slot = None
+            started = time.monotonic()
+            try:
+                if self.coord is not None:
+                    # 整台主机上该 端点+密钥 的并发名额（多个 ComfyUI 进程共享）
+                    slot = await self.coord.acquire_slot(
+                        budget_key(self._base_url(endpoint), self._headers(endpoint)['Authorization']),
+                        endpoint.max_concurrency if endpoint is not None else 0)
+                    started = time.monotonic()
+                if session is None:
+                    async with client_session(timeout=self.timeout) as own_session:
+                        status, text = await self._post_text(own_session, url, endpoint, payload)
+                else:
+                    status, text = await self._post_text(session, url, endpoint, payload)
+            except BaseException as e:
+                if slot is not None:
+                    await asyncio.shield(self.coord.release_slot(slot))
+                if self.pool is not None:
+                    self.pool.unreserve(endpoint)
+                if isinstance(payload, StreamingJSONBody) and payload.error is not None:
+                    # 上传中断是因为输入图准备失败，不是端点故障
+                    raise payload.error from e
+                if self.pool is None or not self._is_endpoint_failure(e):
+                    raise
+                self.pool.observe(endpoint, time.monotonic() - started, ok=False)
+                if parent or len(tried) + 1 >= len(self.pool.endpoints):
+                    raise
+                tried.append(endpoint)
+                logger.warning(f"Submit {route} to {endpoint.url} failed ({e}), failing over")
+                continue
+
+            latency = time.monotonic() - started
+            try:
+                # 尝试将文本解析为 JSON
+                result = json.loads(text)
+            except json.JSONDecodeError:
+                # 如果不是 JSON 格式，直接使用文本作为结果
+                logger.debug(f"Response is plain text: {text}")
+                result = {"result": text.strip()}
+            logger.debug(f"{route} response: {result}")
+
+            task_id = result.get("result", None)
+            if self.pool is not None:
+                self.pool.observe(endpoint, latency, ok=True)
+                if task_id:
+                    self.pool.pin(task_id, endpoint)
+                else:
+                    self.pool.unreserve(endpoint)
+            if slot is not None:
+                if task_id:
+                    await self.coord.bind_slot(slot, task_id)
+                else:
+                    await self.coord.release_slot(slot)
+            if isinstance(payload, StreamingJSONBody):
+                record_fields["upload_bytes"] = payload.upload_bytes
+            self._record("submit", route=route, task_id=task_id, parent=parent, http_status=status,
+                         latency=round(latency, 4), **record_fields)
+            return task_id
+
+    async def _post_text(self, session, url, endpoint, payload):
+        headers = self._headers(endpoint)
+        if isinstance(payload, StreamingJSONBody):
+            # 每次发送（含切换端点重试）重新生成请求体；长度未知时 aiohttp 使用 chunked 传输
+            length, payload = payload.open()
+            if length is not None:
+                headers['Content-Length'] = str(length)
+        async with session.post(url, headers=headers, data=payload) as response:
+            response.raise_for_status()
+            # 首先尝试读取原始文本
+            return response.status, await response.text()
+
+    async def run_job(self, coro, deadline=None, check_interval=0.5, priority=None, max_side=0):
+        """
+        运行一个作业协程，ComfyUI 中断或超过 deadline 秒时协作式取消轮询/下载，
+        并对尚未结束的远端任务发送取消请求，尽快释放 fast 任务名额
+        priority: 作业内所有提交使用的调度优先级（interactive / normal / bulk）
+        max_side: 作业内下载的结果图长边上限（像素），0 表示原图
+        """
+        tracked = set()
+        # 节点线程 / batch_runner 的事件循环是长期存在的，作业之间复用连接
+        register_loop()
+
+        async def _tracked_job():
+            _job_tasks.set(tracked)
+            if priority:
+                _job_priority.set(priority)
+            if max_side:
+                _job_max_side.set(max_side)
+            return await coro
+
+        job = asyncio.ensure_future(_tracked_job())
+        expires_at = time.monotonic() + deadline if deadline else None
+        reason = None
+        try:
+            try:
+                while reason is None:
+                    done, _ = await asyncio.wait({job}, timeout=check_interval)
+                    if done:
+                        return job.result()
+                    if _processing_interrupted():
+                        reason = "interrupted"
+                    elif expires_at is not None and time.monotonic() >= expires_at:
+                        reason = "deadline"
+            except asyncio.CancelledError:
+                job.cancel()
+                raise
+
+            logger.warning(f"Cancelling job ({reason}), pending remote tasks: {sorted(tracked)}")
+            job.cancel()
+            try:
+                await job
+            except BaseException:
+                pass
+            await self.cancel_tasks(tracked)
+        finally:
+            # 与远端取消无关：作业以任何方式结束时，未结束的任务都归还本地名额（中转不支持取消时也一样）
+            for task_id in list(tracked):
+                await asyncio.shield(self._release_task(task_id))
+
+        if reason == "interrupted":
+            # 抛出 ComfyUI 自己的 InterruptProcessingException，由执行器按“已中断”处理
+            comfy_mm.throw_exception_if_processing_interrupted()
+        raise TimeoutError(f"Midjourney job exceeded deadline of {deadline}s")
+
+    async def cancel_tasks(self, task_ids):
+        """通知后端取消任务，中转不支持（未配置 cancel_path）时直接忽略"""
+        if not self.cancel_path or not task_ids:
+            return
+        timeout = aiohttp.ClientTimeout(total=10)
+
+        async def _cancel(session, task_id):
+            endpoint = self._task_endpoint(task_id)
+            url = self._base_url(endpoint) + self.cancel_path.format(task_id=task_id)
+            try:
+                async with session.post(url, headers=self._headers(endpoint), data="{}") as response:
+                    logger.info(f"Cancel task {task_id}: HTTP {response.status}")
+                    self._record("cancel", task_id=task_id, http_status=response.status)
+            except Exception as e:
+                logger.warning(f"Failed to cancel task {task_id}: {e}")
+
+        async with client_session(timeout=timeout) as session:
+            await asyncio.gather(*(_cancel(session, task_id) for task_id in task_ids))
+
     async def imagine(self, text_prompt) -> str:
         """
         return task_id
         """
         logger.debug(f"Imagine with prompt: {text_prompt}")
-        url = f"{self.api_url}/v1/api/trigger/imagine" 
-        payload = json.dumps({
+        payload = {
             "prompt": text_prompt,
             "picurl":""
-        })
-        headers = {
-            'Authorization': 'Bearer {}'.format(self.api_key),
-            'Content-Type': 'application/json; charset=utf-8'
         }
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.post(url, headers=headers, data=payload) as response:
-                    response.raise_for_status()
-                    # 首先尝试读取原始文本
-                    text = await response.text()
-                    logger.debug(f"Imagine response: {text}")
-                    try:
-                        # 尝试将文本解析为 JSON
-                        result = json.loads(text)
-                    except json.JSONDecodeError:
-                        # 如果不是 JSON 格式，直接使用文本作为结果
-                        logger.debug(f"Response is plain text: {text}")
-                        result = {"result": text.strip()}
-                    
-                    logger.debug(f"Imagine response: {result}")
-                    return result.get("result", None)
+            return await self._post_submit("/v1/api/trigger/imagine", payload, "imagine",
+                                           prompt_chars=len(text_prompt))
         except Exception as e:
             logger.error(f"Error during Imagine: {e}")
             raise
@@ -140,42 +513,31 @@ class MJClient:
         msg_id = vs[2]
         msg_hash = vs[3]
 
-        url = f"{self.api_url}/v1/api/trigger/upscale"
+        path = "/v1/api/trigger/upscale"
         if action_type == "upscale":
-            url = f"{self.api_url}/v1/api/trigger/upscale"
+            path = "/v1/api/trigger/upscale"
         elif action_type == "vary":
-            url = f"{self.api_url}/v1/api/trigger/variation"
+            path = "/v1/api/trigger/variation"
 
-        payload = json.dumps({
+        payload = {
             "index": int(index),
             "msg_id": msg_id,
             "msg_hash": msg_hash,
             "trigger_id": task_id
-        })
-        
-        headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json; charset=utf-8'
         }
         
-        async with session.post(url, headers=headers, data=payload) as response:
-            response.raise_for_status()
-            text = await response.text()
-            try:
-                result = json.loads(text)
-            except json.JSONDecodeError:
-                logger.debug(f"Response is plain text: {text}")
-                result = {"result": text.strip()}
-            
-            return result.get("result", None)
+        return await self._post_submit(path, payload, path.rsplit("/", 1)[-1], parent=task_id,
+                                       session=session, index=int(index))
 
-    async def upscale_or_vary(self, task_id="", action="U1"):
+    async def upscale_or_vary(self, task_id="", action="U1", on_progress=None, preview=False):
         """
         执行单个放大或变体操作
         return: image
         """
         try:
-            _, _, buttons = await self.sync_mj_status(task_id)
+            self._record("call", call="upscale_or_vary", task_id=task_id, action=action)
+            # 只需要父任务的 buttons，不下载四格主图
+            _, _, buttons = await self.sync_mj_status(task_id, download=False)
             
             # 添加调试信息
             logger.debug(f"Task_id: {task_id}, Buttons received: {buttons}")
@@ -195,105 +557,254 @@ class MJClient:
             
             logger.debug(f"Generated custom_id: {custom_id}")
             
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
+            async with client_session(timeout=self.timeout) as session:
                 subtask_id = await self._submit_upscale_vary_task(task_id, custom_id, session)
                 if not subtask_id:
                     raise ValueError("Failed to get subtask_id")
                 
-                image, _, _ = await self.sync_mj_status(task_id=subtask_id)
+                image, _, _ = await self.sync_mj_status(task_id=subtask_id, on_progress=on_progress,
+                                                        preview=preview)
                 return image
                 
         except Exception as e:
             logger.error(f"Error during Upscale/Vary: {e}")
             raise
 
-    async def sync_mj_status(self, task_id):
+    async def _fetch_preview(self, url):
+        """拉取 IN_PROGRESS 阶段的中间预览图，失败时返回 None（预览不影响主流程）"""
+        timeout = aiohttp.ClientTimeout(total=10, connect=5)
+        resized = self._resized_url(url, 512)
+        for candidate in [resized, url] if resized else [url]:
+            try:
+                async with client_session("cdn", timeout=timeout) as session:
+                    async with session.get(candidate, proxy=self.proxy_url) as response:
+                        response.raise_for_status()
+                        image_data = await response.read()
+                return await self.decode_pool.run(decode_preview, image_data, 512)
+            except Exception as e:
+                logger.debug(f"Failed to fetch preview {candidate}: {e}")
+        return None
+
+    async def sync_mj_status(self, task_id, on_progress=None, preview=False, download=True):
         """
         异步轮询任务状态
+        on_progress: 可选回调 on_progress(task_id, progress, preview_image)，progress 为 0~100
+        preview: 为 True 时拉取 IN_PROGRESS 阶段的中间预览图（按 preview_interval 限流、同一 URL 去重）
+        download: 为 False 时只等待任务完成，不下载结果图（image 返回 None）
         return image, task_id, buttons 
         """
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                while True:
-                    url = f"{self.api_url}/v1/api/trigger/task/{task_id}"
-                    headers = {
-                        'Authorization': f'Bearer {self.api_key}',
-                        'Content-Type': 'application/json; charset=utf-8'
-                    }
-                    
-                    async with session.get(url, headers=headers) as response:
-                        response.raise_for_status()
-                        # 首先读取原始文本
-                        text = await response.text()
-                        logger.debug(f"Response is plain text: {text}")
-                        try:
-                            # 尝试将文本解析为 JSON
-                            data = json.loads(text)
-                        except json.JSONDecodeError:
-                            logger.debug(f"Response is plain text: {text}")
-                            raise ValueError(f"Expected JSON response but got: {text}")
-                        
-                        logger.debug(f"Fetch response: {data}")
-                        
-                        status = data['status']
-                        buttons = {"msg_id": 0, "msg_hash": ""}
-
-                        if status == 'SUCCESS':
-                            img = None
-                            if 'imageUrl' in data:
-                                img = await self.download_image_ultimate(data['imageUrl'])
-                            if 'buttons' in data:
-                                # 确保 buttons 包含正确的 msg_id 和 msg_hash
-                                raw_buttons = data['buttons']
-                                if isinstance(raw_buttons, dict):
-                                    # 如果已经是字典，检查是否包含必要的字段
-                                    if 'msg_id' in raw_buttons and 'msg_hash' in raw_buttons:
-                                        buttons = raw_buttons
-                                    else:
-                                        # 如果是旧格式的按钮，需要从 data 中获取 msg_id 和 msg_hash
-                                        buttons = {
-                                            "msg_id": data.get('msg_id', 0),
-                                            "msg_hash": data.get('msg_hash', ""),
-                                            "buttons": raw_buttons  # 保留原始按钮信息
-                                        }
-                                elif isinstance(raw_buttons, list):
-                                    # 如果是按钮列表，提取 msg_id 和 msg_hash
-                                    buttons = {
-                                        "msg_id": data.get('msg_id', 0),
-                                        "msg_hash": data.get('msg_hash', ""),
-                                        "buttons": raw_buttons
-                                    }
-                                else:
-                                    logger.warning(f"Unexpected buttons format: {type(raw_buttons)}, value: {raw_buttons}")
-                                    buttons = {
-                                        "msg_id": data.get('msg_id', 0),
-                                        "msg_hash": data.get('msg_hash', "")
-                                    }
-                            else:
-                                # 如果没有 buttons 字段，从 data 中获取
-                                buttons = {
-                                    "msg_id": data.get('msg_id', 0),
-                                    "msg_hash": data.get('msg_hash', "")
-                                }
-                            return img, task_id, buttons
-                        
-                        elif status in ['FAILED', 'FAILURE']:
-                            # 统一处理失败与超时 (FAILURE) 状态，将具体 failReason 抛出供上层 (ComfyUI) 捕获
-                            raise Exception(f"Task failed: {data.get('failReason', 'Unknown error')}")
-                        
-                        elif status in ['', 'SUBMITTED', 'IN_PROGRESS', 'NOT_START']:
-                            logger.info(f"Task status: {status}, progress: {data.get('progress', 'Unknown')}")
-                            await asyncio.sleep(10)  # 异步等待3秒
-                        
-                        else:
-                            raise Exception(f"Unknown task status: {data['status']}")
-                        
+            data = await self.wait_for_task(task_id, on_progress=on_progress, preview=preview)
+            img = None
+            if download and 'imageUrl' in data:
+                img = await self.download_task_image(task_id, data['imageUrl'])
+            return img, task_id, self._parse_buttons(data)
         except Exception as e:
             logger.error(f"Error during sync_mj_status: {e}")
             raise
 
-    async def download_image(self, url, max_retries=3):
-        """异步下载图片并转换为numpy数组，支持重试和浏览器模拟"""
+    async def sync_mj_ref(self, task_id, on_progress=None, preview=False, image_mode="lazy"):
+        """
+        等待任务完成并返回结果图的惰性引用
+        image_mode: download 立即下载；lazy 不下载，用到时再下载；prefetch 在后台开始下载，不阻塞返回
+        return image_ref, task_id, buttons
+        """
+        data = await self.wait_for_task(task_id, on_progress=on_progress, preview=preview)
+        url = data.get('imageUrl')
+        image_data = None
+        max_side = _job_max_side.get()
+        if image_mode == "download" and url:
+            image_data = await self.download_task_image(task_id, url, raw=True, max_side=max_side)
+        image_ref = MJImageRef(self, task_id, url, data=image_data, max_side=max_side)
+        if image_mode == "prefetch" and url:
+            image_ref.prefetch()
+        return image_ref, task_id, self._parse_buttons(data)
+
+    async def image_ref(self, task_id):
+        """已完成任务的结果图引用（查询一次状态，不下载）"""
+        image_ref, _, _ = await self.sync_mj_ref(task_id)
+        return image_ref
+
+    async def _fetch_task(self, session, task_id):
+        """请求一次任务状态，return: 中转返回的原始 dict"""
+        endpoint = self._task_endpoint(task_id)
+        url = f"{self._base_url(endpoint)}/v1/api/trigger/task/{task_id}"
+
+        started = time.monotonic()
+        async with session.get(url, headers=self._headers(endpoint)) as response:
+            response.raise_for_status()
+            # 首先读取原始文本
+            text = await response.text()
+        if endpoint is not None:
+            self.pool.observe(endpoint, time.monotonic() - started, ok=True)
+        try:
+            # 尝试将文本解析为 JSON
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            logger.debug(f"Response is plain text: {text}")
+            raise ValueError(f"Expected JSON response but got: {text}")
+
+        logger.debug(f"Fetch response: {data}")
+        self._record("poll", task_id=task_id, status=data['status'], progress=data.get('progress', ''),
+                     latency=round(time.monotonic() - started, 4))
+        return data
+
+    async def wait_for_task(self, task_id, on_progress=None, preview=False):
+        """
+        轮询直到任务结束
+        return: 任务 SUCCESS 时的原始响应 dict（含 imageUrl / buttons）
+        """
+        last_preview_url = None
+        last_preview_at = 0.0
+        tracked = _job_tasks.get()
+        if tracked is not None:
+            tracked.add(task_id)
+        try:
+            async with client_session(timeout=self.timeout) as session:
+                while True:
+                    poll_interval = self.poll_interval
+                    if self.coord is None:
+                        data = await self._fetch_task(session, task_id)
+                    else:
+                        # 同一任务只由一个进程请求中转，其他进程读取共享状态
+                        data, polled = await self.coord.poll_task(task_id,
+                                                                  lambda: self._fetch_task(session, task_id))
+                        if not polled:
+                            poll_interval = min(self.poll_interval, self.coord.follow_interval)
+                        if data is None:
+                            await asyncio.sleep(poll_interval)
+                            continue
+
+                    status = data['status']
+
+                    if status in ['SUCCESS', 'FAILED', 'FAILURE']:
+                        if tracked is not None:
+                            # 远端任务已结束，取消作业时无需再通知后端
+                            tracked.discard(task_id)
+                    elif status == 'IN_PROGRESS' and self.scheduler is not None:
+                        # 排队结束，记录该模式的排队时间
+                        self.scheduler.started(task_id)
+
+                    if status == 'SUCCESS':
+                        # 中转返回的提示词 / 时间戳（字段因中转而异）随结果图一起保存
+                        self._sink_note(task_id, buttons=self._parse_buttons(data), image_url=data.get('imageUrl'),
+                                        finished_at=round(time.time(), 3),
+                                        relay={k: data[k] for k in ("prompt", "promptEn", "description", "submitTime",
+                                                                    "startTime", "finishTime") if k in data} or None)
+                        if on_progress is not None:
+                            on_progress(task_id, 100, None)
+                        return data
+                
+                    elif status in ['FAILED', 'FAILURE']:
+                        # 统一处理失败与超时 (FAILURE) 状态，将具体 failReason 抛出供上层 (ComfyUI) 捕获
+                        raise Exception(f"Task failed: {data.get('failReason', 'Unknown error')}")
+                
+                    elif status in ['', 'SUBMITTED', 'IN_PROGRESS', 'NOT_START']:
+                        logger.info(f"Task status: {status}, progress: {data.get('progress', 'Unknown')}")
+                        if on_progress is not None:
+                            preview_img = None
+                            preview_url = data.get('imageUrl')
+                            if (preview and preview_url and preview_url != last_preview_url
+                                    and time.monotonic() - last_preview_at >= self.preview_interval):
+                                last_preview_url = preview_url
+                                last_preview_at = time.monotonic()
+                                preview_img = await self._fetch_preview(preview_url)
+                            on_progress(task_id, _parse_progress(data.get('progress')), preview_img)
+                        await asyncio.sleep(poll_interval)
+                
+                    else:
+                        raise Exception(f"Unknown task status: {data['status']}")
+        finally:
+            # 任务结束、轮询出错或作业被取消都归还本地名额；远端取消由 run_job 另行通知
+            await asyncio.shield(self._release_task(task_id))
+
+    async def download_task_image(self, task_id, url, raw=False, max_side=None):
+        """
+        下载任务结果图，并把下载事件关联到 task_id（录制模式）；raw 为 True 时返回原始压缩字节
+        max_side: 长边上限，None 时使用当前作业的设置（run_job(max_side=...)）
+        启用结果落盘（[OUTPUT_SINK]）时，下载到的原始字节连同任务元数据排队写入磁盘；
+        启用多进程协调（[COORDINATION]）时，同一主机上同一张图只下载一次；
+        启用像素缓存（[PIXEL_CACHE]）时，热点结果图直接返回内存映射的像素，不下载也不解码
+        """
+        if max_side is None:
+            max_side = _job_max_side.get()
+        key = f"{url}|{max_side}"
+        if not raw and self.pixels is not None:
+            image = self.pixels.lookup(key)
+            if image is not None:
+                return image
+        token = _current_task_id.set(task_id)
+        try:
+            if self.sink is None and self.coord is None and self.pixels is None:
+                return await self.download_image_ultimate(url, raw=raw, max_side=max_side)
+            # 先取原始字节（排队保存，不等待写盘），再解码
+            started = time.monotonic()
+            with self._sink_lock:
+                save = self.sink is not None and task_id in self._sink_pending
+            # 需要落盘时下载原图（落盘保存的必须是原始字节），max_side 只在解码时生效
+            fetch_side = 0 if save else max_side
+            if self.coord is not None:
+                image_data = await self.coord.fetch_image(
+                    f"{url}|{fetch_side}",
+                    lambda: self.download_image_ultimate(url, raw=True, max_side=fetch_side))
+            else:
+                image_data = await self.download_image_ultimate(url, raw=True, max_side=fetch_side)
+            if save:
+                await self._sink_save(task_id, image_data, download_s=round(time.monotonic() - started, 3))
+            if raw:
+                return image_data
+            # 执行器只运行模块级的 decode_image（process 模式下需要可 pickle）
+            image = await self.decode_pool.run(decode_image, image_data, max_side)
+            if self.pixels is not None:
+                # 缓存在本进程中写入（子进程看不到本进程的缓存索引），写文件放到线程中，不占用事件循环
+                await asyncio.get_running_loop().run_in_executor(None, self.pixels.store_if_hot, key, image)
+            return image
+        finally:
+            _current_task_id.reset(token)
+
+    def _decode_cached(self, key, image_data, max_side=0):
+        """同步解码结果图；启用像素缓存且该图被反复解码时写入缓存（MJImageRef 在调用方线程中使用）"""
+        image = decode_image(image_data, max_side)
+        if self.pixels is not None:
+            self.pixels.store_if_hot(key, image)
+        return image
+
+    @staticmethod
+    def _parse_buttons(data):
+        """从任务响应中提取 buttons，确保包含 msg_id 和 msg_hash"""
+        if 'buttons' not in data:
+            # 如果没有 buttons 字段，从 data 中获取
+            return {
+                "msg_id": data.get('msg_id', 0),
+                "msg_hash": data.get('msg_hash', "")
+            }
+
+        raw_buttons = data['buttons']
+        if isinstance(raw_buttons, dict):
+            # 如果已经是字典，检查是否包含必要的字段
+            if 'msg_id' in raw_buttons and 'msg_hash' in raw_buttons:
+                return raw_buttons
+            # 如果是旧格式的按钮，需要从 data 中获取 msg_id 和 msg_hash
+            return {
+                "msg_id": data.get('msg_id', 0),
+                "msg_hash": data.get('msg_hash', ""),
+                "buttons": raw_buttons  # 保留原始按钮信息
+            }
+        if isinstance(raw_buttons, list):
+            # 如果是按钮列表，提取 msg_id 和 msg_hash
+            return {
+                "msg_id": data.get('msg_id', 0),
+                "msg_hash": data.get('msg_hash', ""),
+                "buttons": raw_buttons
+            }
+        logger.warning(f"Unexpected buttons format: {type(raw_buttons)}, value: {raw_buttons}")
+        return {
+            "msg_id": data.get('msg_id', 0),
+            "msg_hash": data.get('msg_hash', "")
+        }
+
+    async def download_image(self, url, max_retries=3, raw=False):
+        """异步下载图片并转换为numpy数组（raw 为 True 时返回原始字节），支持重试和浏览器模拟"""
         logger.debug(f"Downloading image from URL: {url}")
         
         # 为图片下载创建专门的超时配置
@@ -318,20 +829,18 @@ class MJClient:
         
         for attempt in range(max_retries):
             try:
-                # 使用 SSL 验证跳过（有些情况下 Discord CDN 可能有证书问题）
-                connector = aiohttp.TCPConnector(ssl=False)
-                async with aiohttp.ClientSession(
-                    timeout=download_timeout, 
-                    connector=connector,
-                    headers=headers
-                ) as session:
+                # 使用 SSL 验证跳过（有些情况下 Discord CDN 可能有证书问题），长期运行的循环上复用 keep-alive 连接
+                async with client_session("cdn", timeout=download_timeout, headers=headers) as session:
                     logger.debug(f"Attempt {attempt + 1}/{max_retries} to download image")
+                    started = time.monotonic()
                     async with session.get(url) as response:
                         response.raise_for_status()
                         image_data = await response.read()
-                        img = Image.open(BytesIO(image_data))
+                        self._record_download(image_data, started)
+                        if raw:
+                            return image_data
                         logger.debug(f"Successfully downloaded image, size: {len(image_data)} bytes")
-                        return np.array(img)
+                        return await self.decode_pool.run(decode_image, image_data)
                         
             except Exception as e:
                 logger.warning(f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}")
@@ -344,7 +853,7 @@ class MJClient:
                     logger.debug(f"Waiting {wait_time} seconds before retry...")
                     await asyncio.sleep(wait_time)
 
-    async def download_image_fallback(self, url):
+    async def download_image_fallback(self, url, raw=False):
         """备用图片下载方法，使用更宽松的SSL配置"""
         logger.debug(f"Using fallback method to download image from URL: {url}")
         try:
@@ -375,12 +884,15 @@ class MJClient:
                 timeout=download_timeout, 
                 connector=connector
             ) as session:
+                started = time.monotonic()
                 async with session.get(url, headers=headers) as response:
                     response.raise_for_status()
                     image_data = await response.read()
-                    img = Image.open(BytesIO(image_data))
+                    self._record_download(image_data, started)
+                    if raw:
+                        return image_data
                     logger.debug(f"Successfully downloaded image using fallback method, size: {len(image_data)} bytes")
-                    return np.array(img)
+                    return await self.decode_pool.run(decode_image, image_data)
                     
         except Exception as e:
             logger.error(f"Fallback download also failed for URL {url}: {str(e)}")
@@ -422,12 +934,41 @@ class MJClient:
             logger.error(f"Error converting image to base64: {e}")
             raise
 
+    async def _blend_source(self, image):
+        """
+        Blend 的单张输入 → base64Array 中的一项：中转支持图片 URL（blend_image_urls）时直接传 URL（str），
+        否则返回原始压缩字节（上一步的结果图不解码、不重新编码），由 StreamingJSONBody 发送时编码为 data URL
+        """
+        if isinstance(image, (bytes, bytearray)):
+            return image
+        if callable(image):
+            # 节点传入的本地编码函数（如 Tensor → PNG），在线程中执行
+            return await asyncio.get_running_loop().run_in_executor(None, image)
+        if isinstance(image, str):
+            if _TASK_ID.match(image):
+                image = await self.image_ref(image)
+            elif image.startswith(("http://", "https://")):
+                if self.blend_image_urls:
+                    return image
+                return await self.download_image_ultimate(image, raw=True)
+            else:
+                # data URL / base64 原样传递
+                return image
+        if self.blend_image_urls and image.url:
+            return image.url
+        if image.max_side:
+            # 缩小过的引用只用于下游预览 / 缩放，Blend 上传原图
+            return await self.download_task_image(image.task_id, image.url, raw=True, max_side=0)
+        return await image.load_bytes_async()
+
     async def blend(self, base64_images, dimensions="SQUARE", bot_type="MID_JOURNEY", quality=None, notify_hook="", state=""):
         """
         提交 Blend 任务（图片混合）
 
         Args:
-            base64_images (list): 图片base64数组，格式如 ["data:image/png;base64,xxx1", "data:image/png;base64,xxx2"]
+            base64_images (list): 图片数组，每项可以是 base64（如 "data:image/png;base64,xxx1"）、
+                图片 URL、已完成的 Midjourney task_id、MJImageRef、原始图片字节，
+                或返回原始图片字节的函数（在线程中执行，与上传并行）
             dimensions (str): 图片比例，可选值: "PORTRAIT"(2:3), "SQUARE"(1:1), "LANDSCAPE"(3:2)
             bot_type (str): bot类型，可选值: "MID_JOURNEY", "NIJI_JOURNEY"
             quality (str): 图像质量，可选值: "hd"
@@ -438,11 +979,12 @@ class MJClient:
             str: task_id
         """
         logger.debug(f"Blend with {len(base64_images)} images, dimensions: {dimensions}")
-        url = f"{self.api_url}/mj/submit/blend"
-
+        # 各输入同时准备，请求体按顺序流式发送：第一张就绪即开始上传
+        sources = [asyncio.ensure_future(self._blend_source(image)) for image in base64_images]
+        # 让不需要等待的输入（字节、data URL）先完成，全部就绪时请求体可以带 Content-Length
+        await asyncio.sleep(0)
         payload_data = {
             "botType": bot_type,
-            "base64Array": base64_images,
             "dimensions": dimensions,
             "notifyHook": notify_hook,
             "state": state
@@ -452,132 +994,136 @@ class MJClient:
         if quality is not None:
             payload_data["quality"] = quality
 
-        payload = json.dumps(payload_data)
-
-        headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json; charset=utf-8'
-        }
-
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.post(url, headers=headers, data=payload) as response:
-                    response.raise_for_status()
-                    # 首先尝试读取原始文本
-                    text = await response.text()
-                    try:
-                        # 尝试将文本解析为 JSON
-                        result = json.loads(text)
-                    except json.JSONDecodeError:
-                        # 如果不是 JSON 格式，直接使用文本作为结果
-                        logger.debug(f"Response is plain text: {text}")
-                        result = {"result": text.strip()}
-
-                    logger.debug(f"Blend response: {result}")
-                    return result.get("result", None)
+            if not self.chunked_upload:
+                await asyncio.gather(*sources)
+            return await self._post_submit("/mj/submit/blend", payload_data, "blend",
+                                           body=StreamingJSONBody(payload_data, "base64Array", sources),
+                                           images=len(sources))
         except Exception as e:
             logger.error(f"Error during Blend: {e}")
             raise
+        finally:
+            for source in sources:
+                # 未完成的输入不再需要；已失败的取走异常，避免 "exception was never retrieved"
+                if not source.cancel() and not source.cancelled():
+                    source.exception()
 
+    @staticmethod
+    def _custom_id(buttons, action):
+        """取按钮对应的 custom_id，中转未返回时按 msg_id/msg_hash 拼装"""
+        custom_id = buttons.get(action) if isinstance(buttons, dict) else None
+        if isinstance(custom_id, str) and custom_id.count("||") == 3:
+            return custom_id
+        index = int(action.replace("U", "").replace("V", ""))
+        action_type = "upscale" if "U" in action else "vary"
+        return f"{action_type}||{index}||{buttons.get('msg_id', 0)}||{buttons.get('msg_hash', '')}"
 
-    async def batch_upscale_or_vary(self, task_id, actions=["U1", "U2", "U3", "U4"]):
+    async def _run_actions(self, task_id, buttons, actions, on_progress=None, preview=False):
         """
-        批量处理多个放大或变体任务
-        return: List[Image]
+        并发执行多个放大/变体：每个操作提交后立即开始轮询并下载，互不等待
+        return: 与 actions 一一对应的图片列表（提交或执行失败为 None）
         """
-        try:
-            _, _, buttons = await self.sync_mj_status(task_id)
-
-            async def submit_task(action):
-                try:
-                    custom_id = buttons[action]
-                    subtask_id = await self._submit_upscale_vary_task(task_id, custom_id, session)
-                    if subtask_id:
-                        logger.debug(f"Submitted {action} task: {subtask_id}")
-                        return action, subtask_id
-                except Exception as e:
-                    logger.error(f"Error submitting {action} task: {e}")
+        async def run_action(action, session):
+            try:
+                custom_id = self._custom_id(buttons, action)
+                subtask_id = await self._submit_upscale_vary_task(task_id, custom_id, session)
+                if not subtask_id:
+                    logger.error(f"Failed to get subtask_id for {action}")
                     return None
+            except Exception as e:
+                logger.error(f"Error submitting {action} task: {e}")
+                return None
+            logger.debug(f"Submitted {action} task: {subtask_id}")
 
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                tasks = [submit_task(action) for action in actions]
-                results = await asyncio.gather(*tasks)
-                subtask_ids = [r for r in results if r is not None]
+            try:
+                image, _, _ = await self.sync_mj_status(subtask_id, on_progress=on_progress, preview=preview)
+            except Exception as e:
+                logger.error(f"Error processing {action} task {subtask_id}: {e}")
+                return None
+            logger.debug(f"Completed {action} task: {subtask_id}")
+            return image
 
-            tasks = [self.sync_mj_status(subtask_id) for _, subtask_id in subtask_ids]
-            results = []
-            completed_tasks = await asyncio.gather(*tasks, return_exceptions=True)
+        async with client_session(timeout=self.timeout) as session:
+            return await asyncio.gather(*(run_action(action, session) for action in actions))
 
-            for (action, subtask_id), task_result in zip(subtask_ids, completed_tasks):
-                if isinstance(task_result, Exception):
-                    logger.error(f"Error processing {action} task {subtask_id}: {task_result}")
-                    continue
-                image, _, _ = task_result
-                results.append(image)
-                logger.debug(f"Completed {action} task: {subtask_id}")
+    async def batch_upscale_or_vary(self, task_id, actions=["U1", "U2", "U3", "U4"], on_progress=None,
+                                    preview=False):
+        """
+        批量处理多个放大或变体任务
+        return: List[Image]
+        """
+        try:
+            self._record("call", call="batch_upscale_or_vary", task_id=task_id, actions=list(actions))
+            # 只需要父任务的 buttons，不下载四格主图
+            _, _, buttons = await self.sync_mj_status(task_id, download=False)
 
-            return results
+            results = await self._run_actions(task_id, buttons, actions, on_progress=on_progress, preview=preview)
+            return [image for image in results if image is not None]
         except Exception as e:
             logger.error(f"Error during batch upscale/vary: {e}")
             raise
 
-    async def network_diagnostic(self, url):
+    async def imagine_and_act(self, text_prompt, actions=["U1", "U2", "U3", "U4"], download_grid=True,
+                              on_progress=None, preview=False):
         """
-        网络诊断功能
+        Imagine → 批量放大/变体 流水线：父任务 SUCCESS 后立即提交子任务，
+        四格主图与子任务并发下载（download_grid=False 时跳过），省去一次父任务查询和一个轮询间隔
+        return: grid_image, task_id, buttons, List[Image]（与 actions 一一对应，失败为 None）
         """
-        import socket
-        from urllib.parse import urlparse
-        
-        print("=== 网络诊断开始 ===")
-        
-        # 解析URL
-        parsed_url = urlparse(url)
-        host = parsed_url.hostname
-        port = parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
-        
-        print(f"目标地址: {host}:{port}")
-        
-        # 1. DNS解析测试
         try:
-            import socket
-            print("1. DNS解析测试...")
-            ip_address = socket.gethostbyname(host)
-            print(f"   ✓ DNS解析成功: {host} -> {ip_address}")
-        except Exception as e:
-            print(f"   ✗ DNS解析失败: {e}")
-            return False
-        
-        # 2. TCP连接测试
-        try:
-            print("2. TCP连接测试...")
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(10)
-            result = sock.connect_ex((host, port))
-            sock.close()
-            if result == 0:
-                print(f"   ✓ TCP连接成功")
-            else:
-                print(f"   ✗ TCP连接失败: 错误代码 {result}")
-                return False
-        except Exception as e:
-            print(f"   ✗ TCP连接测试失败: {e}")
-            return False
-        
-        # 3. HTTP请求测试
-        try:
-            print("3. HTTP请求测试...")
-            timeout = aiohttp.ClientTimeout(total=30, connect=10)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.head(url) as response:
-                    print(f"   ✓ HTTP请求成功: 状态码 {response.status}")
+            task_id = await self.imagine(text_prompt)
+            if not task_id:
+                raise ValueError("Failed to get task_id from Midjourney API")
+
+            data = await self.wait_for_task(task_id, on_progress=on_progress, preview=preview)
+            buttons = self._parse_buttons(data)
+
+            grid_job = None
+            if download_grid and data.get('imageUrl'):
+                grid_job = asyncio.ensure_future(self.download_task_image(task_id, data['imageUrl']))
+
+            try:
+                images = await self._run_actions(task_id, buttons, actions, on_progress=on_progress,
+                                                 preview=preview)
+                grid = await grid_job if grid_job is not None else None
+            except BaseException:
+                if grid_job is not None:
+                    grid_job.cancel()
+                raise
+
+            return grid, task_id, buttons, list(images)
         except Exception as e:
-            print(f"   ✗ HTTP请求失败: {e}")
-            return False
-        
-        print("=== 网络诊断完成 - 网络连接正常 ===")
-        return True
+            logger.error(f"Error during imagine pipeline: {e}")
+            raise
 
-    async def download_image_with_proxy(self, url, proxy_url=None):
+    async def network_diagnostic(self, url=None, rounds=1, proxies=()):
+        """
+        网络诊断：并发探测中转端点、CDN 主机（及 url）在直连 / 系统代理下的 DNS、TCP、TLS、首字节耗时与吞吐，
+        打印摘要，并把结果用于选路（端点池延迟估计、CDN 下载路由），详见 net_profiler.py
+        return: 分析结果 dict，ok 为 url（未指定时为全部目标）是否至少有一条路由可用
+        """
+        from .net_profiler import LatencyProfiler, apply
+
+        profiler = LatencyProfiler.from_config(config, extra_urls=[url] if url else [], proxies=proxies,
+                                               rounds=rounds, interval=0.5)
+        report = apply(await profiler.run(), pool=self.pool, client=self)
+
+        print("=== 网络诊断 ===")
+        for entry in report["targets"]:
+            name = f"{urlparse(entry['url']).netloc} via {entry['route']}"
+            if not entry["ok"]:
+                print(f"   ✗ {name}: {entry.get('last_error')}")
+                continue
+            phases = ", ".join(f"{metric} {entry[metric]['p50']}" for metric in ("dns_ms", "connect_ms", "proxy_ms",
+                                                                              "tls_ms", "ttfb_ms") if metric in entry)
+            print(f"   ✓ {name}: HTTP {entry['status']}, {phases}")
+        checked = [e for e in report["targets"] if not url or e["url"] == url]
+        urls = {e["url"] for e in checked}
+        report["ok"] = all(any(e["ok"] for e in checked if e["url"] == u) for u in urls)
+        return report
+
+    async def download_image_with_proxy(self, url, proxy_url=None, raw=False):
         """
         使用代理下载图片
         """
@@ -622,42 +1168,86 @@ class MJClient:
                 if proxy_url:
                     get_kwargs['proxy'] = proxy_url
                     
+                started = time.monotonic()
                 async with session.get(url, **get_kwargs) as response:
                     response.raise_for_status()
                     image_data = await response.read()
-                    img = Image.open(BytesIO(image_data))
+                    self._record_download(image_data, started)
+                    if raw:
+                        return image_data
                     logger.debug(f"Successfully downloaded image via proxy, size: {len(image_data)} bytes")
-                    return np.array(img)
+                    return await self.decode_pool.run(decode_image, image_data)
                     
         except Exception as e:
             logger.error(f"Proxy download failed for URL {url}: {str(e)}")
             raise
 
-    async def download_image_ultimate(self, url, max_retries=3):
+    def _resized_url(self, url, max_side):
+        """图片主机支持缩放参数时返回长边约为 max_side 的 webp 版本 URL，否则返回 None"""
+        parsed = urlparse(url)
+        if not max_side or parsed.hostname not in self.resize_hosts:
+            return None
+        netloc = parsed.netloc
+        if parsed.hostname == "cdn.discordapp.com":
+            # cdn 不缩放，同一路径的媒体代理支持 width / format 参数
+            netloc = "media.discordapp.net"
+        # 原图宽高未知，只限定宽度（按比例缩放），竖图解码时再缩到 max_side 以内
+        query = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+                 if k not in ("width", "height", "format")]
+        query += [("width", str(max_side)), ("format", "webp")]
+        return parsed._replace(netloc=netloc, query=urlencode(query)).geturl()
+
+    def _download_proxy(self, url):
+        """下载 url 使用的代理：有实测路由（net_profiler）时按实测结果，否则使用系统代理；None 表示直连"""
+        route = self.cdn_routes.get(urlparse(url).hostname)
+        if route is None:
+            return self.proxy_url
+        return route or None
+
+    async def _download_resized(self, url, max_side, max_retries=3):
+        """先请求 CDN 的缩小版本，不支持或失败时下载原图（解码时仍按 max_side 缩小）"""
+        resized = self._resized_url(url, max_side)
+        if resized:
+            try:
+                proxy_url = self._download_proxy(resized)
+                if proxy_url:
+                    return await self.download_image_with_proxy(resized, proxy_url, raw=True)
+                return await self.download_image(resized, max_retries=1, raw=True)
+            except Exception as e:
+                logger.warning(f"Resized download failed ({e}), falling back to the original image")
+        return await self.download_image_ultimate(url, max_retries, raw=True)
+
+    async def download_image_ultimate(self, url, max_retries=3, raw=False, max_side=0):
         """
         终极图片下载方法，尝试多种策略
+        raw: 为 True 时返回原始压缩字节，不解码
+        max_side: 大于 0 时优先下载 CDN 的缩小版本，并把长边缩小到 max_side 以内解码
         """
+        if max_side:
+            image_data = await self._download_resized(url, max_side, max_retries)
+            return image_data if raw else await self.decode_pool.run(decode_image, image_data, max_side)
         logger.debug(f"Ultimate download attempt for URL: {url}")
         
         strategies = []
         
-        # 如果检测到代理，优先使用代理下载
-        if self.proxy_url:
-            strategies.append(("代理下载", lambda: self.download_image_with_proxy(url, self.proxy_url)))
+        # 如果检测到代理（或实测经代理更快），优先使用代理下载
+        proxy_url = self._download_proxy(url)
+        if proxy_url:
+            strategies.append(("代理下载", lambda: self.download_image_with_proxy(url, proxy_url, raw=raw)))
         
         # 添加其他下载策略
         strategies.extend([
-            ("标准下载", lambda: self.download_image(url, max_retries)),
-            ("备用下载", lambda: self.download_image_fallback(url)),
+            ("标准下载", lambda: self.download_image(url, max_retries, raw=raw)),
+            ("备用下载", lambda: self.download_image_fallback(url, raw=raw)),
         ])
         
         # 如果没有自动检测到代理，尝试常见代理端口
-        if not self.proxy_url:
+        if not proxy_url:
             common_proxies = [
                 "http://127.0.0.1:33210",   # Clash
             ]
             for proxy in common_proxies:
-                strategies.append((f"代理下载({proxy})", lambda p=proxy: self.download_image_with_proxy(url, p)))
+                strategies.append((f"代理下载({proxy})", lambda p=proxy: self.download_image_with_proxy(url, p, raw=raw)))
         
         last_error = None
         for strategy_name, strategy_func in strategies:
@@ -674,6 +1264,36 @@ class MJClient:
         # 所有策略都失败
         raise Exception(f"所有下载策略都失败，最后错误: {last_error}")
 
+_system_proxy = None
+_system_proxy_detected = False
+_system_proxy_lock = threading.Lock()
+
+
+def system_proxy():
+    """系统代理（环境变量 / Windows 设置 / 本地常见端口），结果在进程内缓存"""
+    global _system_proxy, _system_proxy_detected
+    with _system_proxy_lock:
+        if not _system_proxy_detected:
+            _system_proxy = MJClient._detect_system_proxy()
+            _system_proxy_detected = True
+        return _system_proxy
+
+
+# (api_url, api_key) -> MJClient，进程内所有节点共享
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key, api_url=None):
+    """按 (端点, 密钥) 返回进程内共享的 MJClient，不存在时创建"""
+    api_url = (api_url or config['MIDJOURNEY_API']['api_url']).rstrip('/')
+    with _clients_lock:
+        client = _clients.get((api_url, api_key))
+        if client is None:
+            client = _clients[(api_url, api_key)] = MJClient(api_key=api_key, api_url=api_url)
+        return client
+
+
 if __name__ == "__main__":
     import asyncio
     
@@ -688,7 +1308,7 @@ if __name__ == "__main__":
         print("\n=== 开始网络诊断 ===")
         diagnostic_result = await client.network_diagnostic(test_url)
         
-        if not diagnostic_result:
+        if not diagnostic_result["ok"]:
             print("\n⚠️  网络诊断失败，这可能表明需要使用代理")
             print("常见的代理软件端口:")
             print("  - Clash: 7890, 7891")
@@ -0,0 +1,256 @@
+""" 无界面批量运行器：从 JSONL / CSV 流式读取作业，按设定并发驱动 MJClient
+
+每行一个作业（JSONL 字段 / CSV 列名相同）：
+    {"id": "cat-1", "prompt": "cat,cute --ar 1:1 --v 7.0", "actions": ["U1", "U2", "U3", "U4"]}
+    {"id": "up-1", "task_id": "1732...", "action": "U1"}
+    {"id": "mix-1", "images": ["a.png", "b.png"], "dimensions": "SQUARE"}
+CSV 中 actions 用空格/逗号分隔，images 用 | 分隔（本地路径、图片 URL 或已完成的 task_id）；未提供 id 时使用行号。
+可选 priority 字段（interactive / normal / bulk）覆盖 --priority，配置了 [MIDJOURNEY_SCHEDULER] 时生效。
+
+图片与结果清单（manifest.jsonl）随完成随写入输出目录；清单同时作为断点，
+重新运行时已成功的作业会被跳过（--retry-failed 时失败的作业也会重跑）。
+
+    python -m <package>.batch_runner prompts.jsonl -o out/ --concurrency 8 --app-key sk-xxx
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from functools import partial
+
+from .api_client import MJClient, config
+from .connections import close_shared, register_loop
+from .decode_pool import LoopLagMonitor, save_png
+from .warmup import get_warmer
+
+
+def _split(value, sep_pattern):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [v for v in re.split(sep_pattern, str(value).strip()) if v]
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def iter_jobs(path):
+    """流式读取作业文件，不一次性载入内存"""
+    is_csv = path.lower().endswith(".csv")
+    with open(path, encoding="utf-8", newline="" if is_csv else None) as f:
+        rows = csv.DictReader(f) if is_csv else (json.loads(line) for line in f if line.strip())
+        for line_no, row in enumerate(rows, start=1):
+            row = {k: v for k, v in row.items() if v not in (None, "")}
+            job = dict(row)
+            job["id"] = str(row.get("id") or line_no)
+            job["actions"] = _split(row.get("actions"), r"[\s,]+")
+            job["images"] = _split(row.get("images"), r"\|")
+            if job.get("images"):
+                job["kind"] = "blend"
+            elif job.get("task_id"):
+                job["kind"] = "action"
+            elif job.get("prompt"):
+                job["kind"] = "imagine"
+            else:
+                job["kind"] = "invalid"
+            yield job
+
+
+def load_checkpoint(manifest_path, retry_failed=False):
+    """从已有的清单中读取无需重跑的作业 id"""
+    done = set()
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 上次运行中途被杀，最后一行可能不完整
+                continue
+            if record.get("status") == "ok" or not retry_failed:
+                done.add(record["id"])
+    return done
+
+
+def _safe_name(text):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", text)[:80]
+
+
+class BatchRunner:
+    def __init__(self, client, output_dir, concurrency=4, deadline=0, progress_interval=10,
+                 save_grid=True, priority="bulk"):
+        self.client = client
+        self.output_dir = output_dir
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.progress_interval = progress_interval
+        self.save_grid = save_grid
+        self.priority = priority
+        self.stats = Counter()
+        self.manifest_path = os.path.join(output_dir, "manifest.jsonl")
+        self._manifest = None
+        self._started = None
+        self._loop_lag = LoopLagMonitor(interval=0.1)
+
+    async def _save(self, job_id, label, image):
+        """图片编码写盘放到解码执行器池，避免阻塞事件循环上的轮询"""
+        if image is None:
+            return None
+        path = os.path.join(self.output_dir, f"{_safe_name(job_id)}_{label}.png")
+        await self.client.decode_pool.run(save_png, image, path)
+        return os.path.basename(path)
+
+    async def _run_imagine(self, job):
+        prompt = job["prompt"]
+        if job["actions"]:
+            grid, task_id, _, images = await self.client.imagine_and_act(
+                prompt, job["actions"], download_grid=self.save_grid)
+            files = {"grid": await self._save(job["id"], "grid", grid)}
+            for action, image in zip(job["actions"], images):
+                files[action] = await self._save(job["id"], action, image)
+            return {"task_id": task_id, "files": files}
+
+        task_id = await self.client.imagine(prompt)
+        if not task_id:
+            raise ValueError("Failed to get task_id from Midjourney API")
+        image, _, _ = await self.client.sync_mj_status(task_id, download=self.save_grid)
+        return {"task_id": task_id, "files": {"grid": await self._save(job["id"], "grid", image)}}
+
+    async def _run_action(self, job):
+        action = job.get("action", "U1")
+        image = await self.client.upscale_or_vary(job["task_id"], action)
+        return {"task_id": job["task_id"], "files": {action: await self._save(job["id"], action, image)}}
+
+    async def _run_blend(self, job):
+        images = []
+        for src in job["images"]:
+            # 本地文件传入读取函数（MJClient.blend 在线程中读取，上传时分块编码），task_id / URL / data URL 原样传入
+            images.append(partial(_read_bytes, src) if os.path.isfile(src) else src)
+        task_id = await self.client.blend(images, dimensions=job.get("dimensions", "SQUARE"),
+                                          state=job["id"])
+        if not task_id:
+            raise ValueError("Failed to get task_id from Midjourney API (blend)")
+        image, _, _ = await self.client.sync_mj_status(task_id)
+        return {"task_id": task_id, "files": {"blend": await self._save(job["id"], "blend", image)}}
+
+    async def _process(self, job):
+        started = time.monotonic()
+        record = {"id": job["id"], "kind": job["kind"]}
+        self.stats["in_flight"] += 1
+        try:
+            handler = getattr(self, f"_run_{job['kind']}", None)
+            if handler is None:
+                raise ValueError("Job needs one of: prompt, task_id + action, images")
+            record.update(await self.client.run_job(handler(job), deadline=self.deadline,
+                                                    priority=job.get("priority", self.priority)))
+            record["status"] = "ok"
+            self.stats["ok"] += 1
+        except Exception as e:
+            record["status"] = "failed"
+            record["error"] = str(e)
+            self.stats["failed"] += 1
+        finally:
+            self.stats["in_flight"] -= 1
+        record["elapsed_s"] = round(time.monotonic() - started, 3)
+        self._manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._manifest.flush()
+
+    def _print_progress(self):
+        elapsed = time.monotonic() - self._started
+        finished = self.stats["ok"] + self.stats["failed"]
+        rate = finished / elapsed * 60 if elapsed else 0.0
+        lag = self._loop_lag.stats()["max_ms"] or 0.0
+        print(f"[batch] {elapsed:7.0f}s  ok={self.stats['ok']} failed={self.stats['failed']} "
+              f"in_flight={self.stats['in_flight']} skipped={self.stats['skipped']}  {rate:.1f} jobs/min  "
+              f"loop_lag_max={lag:.0f}ms",
+              file=sys.stderr, flush=True)
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self._print_progress()
+
+    async def run(self, jobs, done_ids=()):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._started = time.monotonic()
+        # 有界队列：输入文件再大，内存中最多只有 2 倍并发数的待处理作业
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def producer():
+            for job in jobs:
+                if job["id"] in done_ids:
+                    self.stats["skipped"] += 1
+                    continue
+                await queue.put(job)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def worker():
+            while True:
+                job = await queue.get()
+                if job is None:
+                    return
+                await self._process(job)
+
+        register_loop()
+        reporter = asyncio.ensure_future(self._report_progress())
+        # 开启 [WARMUP] 时在本循环上预热并保持连接，作业直接复用
+        warmer = get_warmer()
+        warming = asyncio.ensure_future(warmer.run()) if warmer is not None else None
+        self._loop_lag.start()
+        with open(self.manifest_path, "a", encoding="utf-8") as self._manifest:
+            try:
+                await asyncio.gather(producer(), *(worker() for _ in range(self.concurrency)))
+            finally:
+                reporter.cancel()
+                if warming is not None:
+                    warming.cancel()
+                await self._loop_lag.stop()
+                await close_shared()
+        self._print_progress()
+        return self.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless Midjourney batch runner")
+    parser.add_argument("input", help="JSONL or CSV job file")
+    parser.add_argument("-o", "--output-dir", required=True)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--app-key", default=os.environ.get("MJ_APP_KEY") or config['MIDJOURNEY_API'].get('api_key', ''))
+    parser.add_argument("--api-url", default=None, help="override api_url from config.ini")
+    parser.add_argument("--poll-interval", type=float, default=None, help="override poll_interval from config.ini")
+    parser.add_argument("--deadline", type=int, default=0, help="per-job deadline in seconds, 0 = unlimited")
+    parser.add_argument("--progress-interval", type=float, default=10)
+    parser.add_argument("--priority", choices=["interactive", "normal", "bulk"], default="bulk",
+                        help="scheduling priority for jobs without their own priority field")
+    parser.add_argument("--skip-grid", action="store_true", help="don't download grids for imagine jobs")
+    parser.add_argument("--no-resume", action="store_true", help="ignore the existing manifest")
+    parser.add_argument("--retry-failed", action="store_true", help="re-run jobs that failed last time")
+    args = parser.parse_args(argv)
+
+    if not args.app_key:
+        parser.error("an app key is required (--app-key, MJ_APP_KEY or config.ini)")
+
+    client = MJClient(api_key=args.app_key, api_url=args.api_url)
+    if args.poll_interval:
+        client.poll_interval = args.poll_interval
+
+    runner = BatchRunner(client, args.output_dir, concurrency=args.concurrency, deadline=args.deadline,
+                         progress_interval=args.progress_interval, save_grid=not args.skip_grid,
+                         priority=args.priority)
+    done_ids = set() if args.no_resume else load_checkpoint(runner.manifest_path, args.retry_failed)
+    stats = asyncio.run(runner.run(iter_jobs(args.input), done_ids))
+    return 0 if stats["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+""" 离线压测：基于 mock_relay 对 MJClient / GPT 节点各条链路进行基准测试
+
+输出 JSON（吞吐、端到端延迟分位数、每个作业的请求数、峰值 RSS、CPU 时间），
+用于版本之间的性能回归对比。
+
+    python -m <package>.benchmark --scenarios imagine,batch --jobs 50 --concurrency 10 \
+        --output bench.json --baseline bench_prev.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from .api_client import MJClient
+from .decode_pool import LoopLagMonitor
+from .mock_relay import add_relay_arguments, relay_from_args
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+SCENARIOS = ("imagine", "action", "batch", "pipeline", "blend", "gpt")
+
+
+def _package_version():
+    path = os.path.join(os.path.dirname(__file__), "pyproject.toml")
+    try:
+        with open(path, encoding="utf-8") as f:
+            match = re.search(r'^version\s*=\s*"([^"]+)"', f.read(), re.M)
+        return match.group(1) if match else "unknown"
+    except OSError:
+        return "unknown"
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    if sys.platform == "darwin":
+        return round(peak / 1024 / 1024, 2)
+    return round(peak / 1024, 2)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    return round(float(np.percentile(values, q)), 4)
+
+
+def _decode_delta(before, after):
+    """解码池统计是进程累计值，只报告本场景内的增量"""
+    delta = dict(after)
+    for key in ("calls", "busy_s"):
+        delta[key] = round(after[key] - before[key], 4)
+    return delta
+
+
+def _sample_data_url(size=(512, 512)):
+    pixels = np.random.default_rng(0).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+class BenchmarkRunner:
+    """针对一个已启动的 MockRelay 运行各链路压测"""
+
+    def __init__(self, relay, jobs=20, concurrency=5, poll_interval=0.2, api_key="bench-key"):
+        self.relay = relay
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.api_key = api_key
+
+    def _client(self):
+        client = MJClient(api_key=self.api_key, api_url=self.relay.url)
+        client.poll_interval = self.poll_interval
+        # 本地模拟器不走系统代理
+        client.proxy_url = None
+        return client
+
+    async def _parent_task(self, client):
+        task_id = await client.imagine("benchmark parent --v 7.0")
+        await client.sync_mj_status(task_id)
+        return task_id
+
+    # ---------- 单个作业 ----------
+    async def _job_imagine(self, client, index, ctx):
+        task_id = await client.imagine(f"benchmark prompt {index} --v 7.0")
+        if not task_id:
+            raise ValueError("Failed to get task_id")
+        await client.sync_mj_status(task_id)
+
+    async def _job_action(self, client, index, ctx):
+        await client.upscale_or_vary(ctx["parent"], f"U{index % 4 + 1}")
+
+    async def _job_batch(self, client, index, ctx):
+        results = await client.batch_upscale_or_vary(ctx["parent"], ["U1", "U2", "U3", "U4"])
+        if len(results) != 4:
+            raise ValueError(f"Batch returned {len(results)}/4 images")
+
+    async def _job_pipeline(self, client, index, ctx):
+        _, _, _, images = await client.imagine_and_act(f"benchmark prompt {index} --v 7.0")
+        if any(image is None for image in images):
+            raise ValueError("Pipeline returned missing upscales")
+
+    async def _job_blend(self, client, index, ctx):
+        task_id = await client.blend(ctx["images"], state=str(index))
+        if not task_id:
+            raise ValueError("Failed to get task_id (blend)")
+        await client.sync_mj_status(task_id)
+
+    async def _job_gpt(self, client, index, ctx):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(ctx["executor"], ctx["node"].generate, f"benchmark {index}")
+
+    # ---------- 场景 ----------
+    async def _prepare(self, name, client):
+        ctx = {}
+        if name in ("action", "batch"):
+            ctx["parent"] = await self._parent_task(client)
+        elif name == "blend":
+            ctx["images"] = [_sample_data_url(), _sample_data_url()]
+        elif name == "gpt":
+            from .gpt_image_generate_node import GPTImageGenerateNode
+
+            node = GPTImageGenerateNode()
+            node.base_url = f"{self.relay.url}/v1"
+            node.api_key = self.api_key
+            # 压测只能请求本地 mock relay，不能带着密钥打到 config.ini 中的真实中转
+            if not str(node.client.base_url).startswith(node.base_url):
+                raise RuntimeError(f"GPT benchmark client points at {node.client.base_url}, not the mock relay")
+            ctx["node"] = node
+            ctx["executor"] = ThreadPoolExecutor(max_workers=self.concurrency)
+        return ctx
+
+    async def run_scenario(self, name):
+        client = self._client()
+        job = getattr(self, f"_job_{name}")
+        ctx = await self._prepare(name, client)
+
+        self.relay.reset_stats()
+        latencies = []
+        errors = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def timed(index):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await job(client, index, ctx)
+                    latencies.append(time.perf_counter() - start)
+                except Exception as e:
+                    errors.append(str(e))
+
+        decode_start = client.decode_pool.stats()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        async with LoopLagMonitor() as loop_lag:
+            await asyncio.gather(*(timed(i) for i in range(self.jobs)))
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+        if "executor" in ctx:
+            ctx["executor"].shutdown(wait=False)
+
+        stats = dict(self.relay.stats)
+        total_requests = stats.pop("total", 0)
+        return {
+            "jobs": self.jobs,
+            "concurrency": self.concurrency,
+            "succeeded": len(latencies),
+            "errors": len(errors),
+            "error_samples": errors[:5],
+            "wall_s": round(wall, 4),
+            "throughput_jobs_per_s": round(len(latencies) / wall, 4) if wall else None,
+            "latency_s": {
+                "p50": _percentile(latencies, 50),
+                "p95": _percentile(latencies, 95),
+                "p99": _percentile(latencies, 99),
+                "mean": round(float(np.mean(latencies)), 4) if latencies else None,
+                "max": round(max(latencies), 4) if latencies else None,
+            },
+            "requests_per_job": round(total_requests / self.jobs, 2),
+            "requests_by_route": stats,
+            "relay_counters": dict(self.relay.counters),
+            # 事件循环被同步代码（解码等）占住的时间，p99 / max 应保持在几十毫秒以内
+            "loop_lag_ms": loop_lag.stats(),
+            "decode_pool": _decode_delta(decode_start, client.decode_pool.stats()),
+            "cpu_s": round(cpu, 4),
+            "cpu_util": round(cpu / wall, 4) if wall else None,
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+
+
+def compare_results(current, baseline):
+    """与基线结果对比，返回 {场景: {指标: 当前/基线}}，>1 表示变大"""
+    report = {}
+    for name, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        ratios = {}
+        for key in ("p50", "p95", "p99"):
+            cur_v, base_v = result["latency_s"][key], base["latency_s"].get(key)
+            if cur_v is not None and base_v:
+                ratios[f"latency_{key}"] = round(cur_v / base_v, 3)
+        for key in ("throughput_jobs_per_s", "requests_per_job", "cpu_s", "peak_rss_mb"):
+            cur_v, base_v = result.get(key), base.get(key)
+            if cur_v is not None and base_v:
+                ratios[key] = round(cur_v / base_v, 3)
+        report[name] = ratios
+    return report
+
+
+async def run_benchmark(args):
+    relay = relay_from_args(args)
+    async with relay:
+        runner = BenchmarkRunner(relay, jobs=args.jobs, concurrency=args.concurrency,
+                                 poll_interval=args.poll_interval)
+        results = {}
+        for name in args.scenarios:
+            print(f"[benchmark] running {name} ({args.jobs} jobs, concurrency {args.concurrency})",
+                  file=sys.stderr)
+            results[name] = await runner.run_scenario(name)
+
+    return {
+        "version": _package_version(),
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "jobs": args.jobs,
+            "concurrency": args.concurrency,
+            "poll_interval": args.poll_interval,
+            "queue_delay": args.queue_delay,
+            "run_time": args.run_time,
+            "error_rate": args.error_rate,
+            "submit_error_rate": args.submit_error_rate,
+            "image_size": list(args.image_size),
+            "upscale_size": list(args.upscale_size),
+            "gpt_image_size": list(args.gpt_image_size),
+            "gpt_latency": args.gpt_latency,
+        },
+        "scenarios": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline MJClient/GPT benchmark against a local mock relay")
+    parser.add_argument("--scenarios", type=lambda s: [x.strip() for x in s.split(",") if x.strip()],
+                        default=list(SCENARIOS), help=f"comma separated, any of {','.join(SCENARIOS)}")
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--output", default=None, help="write JSON results to this file")
+    parser.add_argument("--baseline", default=None, help="previous JSON results to compare against")
+    add_relay_arguments(parser)
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(run_benchmark(args))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["compare"] = compare_results(report, json.load(f))
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
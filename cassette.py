@@ -0,0 +1,137 @@
+""" 中转流量录制（cassette）
+
+录制模式下 MJClient 把每次提交、轮询、图片下载的时序写入 JSONL 文件：
+    {"type": "header", "version": 1, "created": ..., "api_host": ...}
+    {"type": "submit", "t": 0.01, "route": "imagine", "task_id": "...", "latency": 0.31, "http_status": 200}
+    {"type": "poll", "t": 0.35, "task_id": "...", "status": "IN_PROGRESS", "progress": "42%", "latency": 0.12}
+    {"type": "download", "t": 48.2, "task_id": "...", "bytes": 7340032, "latency": 3.4}
+    {"type": "call", "t": 60.0, "call": "batch_upscale_or_vary", "task_id": "...", "actions": [...]}
+
+只记录时序、状态和大小，不记录提示词、密钥和图片内容，可以放心带回本地用 replay.py 回放。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+class CassetteRecorder:
+    """线程安全的 cassette 写入器，每个事件立即追加一行，进程崩溃也不丢已录内容"""
+
+    def __init__(self, path, api_url=""):
+        self.path = path
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._file = open(path, "a", encoding="utf-8")
+        self._write({
+            "type": "header",
+            "version": CASSETTE_VERSION,
+            "created": time.time(),
+            "api_host": urlparse(api_url).hostname or "",
+        })
+        logger.info(f"Recording relay traffic to cassette: {path}")
+
+    def _write(self, event):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def record(self, event_type, **fields):
+        event = {"type": event_type, "t": round(time.monotonic() - self._start, 4)}
+        event.update(fields)
+        self._write(event)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def get_recorder(path, api_url=""):
+    """同一路径在进程内只打开一次，多个 MJClient 实例共享同一个 recorder"""
+    path = os.path.abspath(path)
+    with _recorders_lock:
+        recorder = _recorders.get(path)
+        if recorder is None:
+            recorder = CassetteRecorder(path, api_url=api_url)
+            _recorders[path] = recorder
+        return recorder
+
+
+def load_cassette(path):
+    """读取 cassette，返回事件列表（多段录制按出现顺序拼接，t 以各段 header 为起点累加）"""
+    events = []
+    offset = 0.0
+    last_t = 0.0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            if event.get("type") == "header":
+                offset += last_t
+                last_t = 0.0
+                continue
+            last_t = max(last_t, event.get("t", 0.0))
+            event["t"] = event.get("t", 0.0) + offset
+            events.append(event)
+    return events
+
+
+def build_task_profiles(events):
+    """按 task_id 汇总提交延迟、状态时间线和图片大小
+
+    Returns:
+        dict: task_id -> {
+            "route", "parent", "submitted_at", "submit_latency",
+            "timeline": [(距提交的秒数, status, progress), ...],
+            "poll_latencies", "bytes", "download_latency"
+        }
+    """
+    profiles = {}
+    for event in events:
+        task_id = event.get("task_id")
+        if not task_id:
+            continue
+        kind = event["type"]
+        if kind == "submit":
+            profiles[task_id] = {
+                "route": event.get("route", "imagine"),
+                "parent": event.get("parent"),
+                "submitted_at": event["t"],
+                "submit_latency": event.get("latency", 0.0),
+                "timeline": [],
+                "bytes": None,
+                "download_latency": 0.0,
+                "poll_latencies": [],
+            }
+            continue
+
+        profile = profiles.get(task_id)
+        if profile is None:
+            # 录制开始前就已提交的任务（例如放大操作引用的父任务），没有回放价值
+            continue
+        if kind == "poll":
+            profile["timeline"].append(
+                (event["t"] - profile["submitted_at"], event.get("status", ""), event.get("progress", "")))
+            profile["poll_latencies"].append(event.get("latency", 0.0))
+        elif kind == "download" and event.get("bytes"):
+            profile["bytes"] = event["bytes"]
+            profile["download_latency"] = event.get("latency", 0.0)
+    return profiles
@@ -0,0 +1,163 @@
+""" 跨调用复用的 HTTP 连接：进程内共享的 DNS 缓存 + 长期运行的事件循环上的 keep-alive 连接池
+
+aiohttp 的连接与事件循环绑定，不能跨线程 / 跨循环共享。ComfyUI 节点的作业通过 run_sync() 提交到
+进程内共享的后台循环（io_loop），连接预热（warmup.py）也在这个循环上运行；batch_runner 的主循环
+同样长期存在（run_job 中登记）。这些循环上的提交、轮询、下载复用同一组 TCPConnector，
+不再每次调用都重新做 TCP / TLS 握手；其他临时循环（如 asyncio.run 中的后台下载）仍使用临时连接。
+DNS 解析结果在所有循环之间共享（SharedResolver），预热解析过的主机不再重复解析。
+"""
+import asyncio
+import logging
+import socket
+import threading
+import time
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+from aiohttp.resolver import ThreadedResolver
+
+logger = logging.getLogger(__name__)
+
+# 空闲连接保留时间（秒）。与 aiohttp 默认值一致：中转 / CDN 先于客户端关闭空闲连接时，
+# 复用到已断开的连接会导致请求失败，不宜设得过长
+KEEPALIVE_TIMEOUT = 15
+DNS_TTL = 300
+
+# 连接池类别：api 为中转接口（校验证书），cdn 为结果图下载（与原下载逻辑一致，不校验证书）
+KINDS = ("api", "cdn")
+
+
+class SharedResolver(AbstractResolver):
+    """进程内共享的 DNS 缓存，实际解析交给 ThreadedResolver（getaddrinfo）"""
+
+    def __init__(self, ttl=DNS_TTL):
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        key = (host, port, family)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self.hits += 1
+                return list(entry[0])
+            self.misses += 1
+        result = await ThreadedResolver().resolve(host, port, family)
+        with self._lock:
+            self._cache[key] = (result, time.monotonic())
+        return list(result)
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return {"hosts": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+_resolver = SharedResolver()
+# 事件循环 -> {kind: TCPConnector}，只包含登记过的长期循环
+_connectors = {}
+_lock = threading.Lock()
+
+
+def get_resolver():
+    return _resolver
+
+
+def register_loop(loop=None):
+    """登记当前（长期运行的）事件循环，之后该循环上的请求复用共享连接池"""
+    loop = loop or asyncio.get_running_loop()
+    with _lock:
+        for other in [other for other in _connectors if other.is_closed()]:
+            # 已关闭的循环上的连接随循环一起失效
+            del _connectors[other]
+        _connectors.setdefault(loop, {})
+
+
+_io_loop = None
+_io_thread = None
+
+
+def io_loop():
+    """
+    进程内共享的长期事件循环（守护线程中持续运行），已登记使用共享连接池。
+    循环一直在运行，空闲的 keep-alive 连接被对端关闭时能及时清理，预热建立的连接可以直接被作业复用
+    """
+    global _io_loop, _io_thread
+    with _lock:
+        if _io_loop is None or _io_loop.is_closed():
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def _run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            thread = threading.Thread(target=_run, name="mj-io", daemon=True)
+            thread.start()
+            ready.wait()
+            _connectors.setdefault(loop, {})
+            _io_loop, _io_thread = loop, thread
+        return _io_loop
+
+
+def run_sync(coro):
+    """在共享循环上运行协程并阻塞等待结果，供 ComfyUI 节点线程等同步代码调用（不能在共享循环内调用）"""
+    loop = io_loop()
+    if threading.current_thread() is _io_thread:
+        coro.close()
+        raise RuntimeError("run_sync() cannot be called from the shared I/O loop")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def _new_connector(kind):
+    return aiohttp.TCPConnector(ssl=kind != "cdn", resolver=_resolver, keepalive_timeout=KEEPALIVE_TIMEOUT)
+
+
+def shared_connector(kind="api"):
+    """当前循环的共享连接池，循环未登记时返回 None"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        pool = _connectors.get(loop)
+        if pool is None:
+            return None
+        connector = pool.get(kind)
+        if connector is None or connector.closed:
+            connector = pool[kind] = _new_connector(kind)
+        return connector
+
+
+def client_session(kind="api", **kwargs):
+    """
+    创建 ClientSession：登记过的循环上使用共享连接池（session 关闭时不关闭连接），
+    否则使用临时连接池（仍共享 DNS 缓存）
+    """
+    connector = shared_connector(kind)
+    if connector is None:
+        return aiohttp.ClientSession(connector=_new_connector(kind), **kwargs)
+    return aiohttp.ClientSession(connector=connector, connector_owner=False, **kwargs)
+
+
+async def close_shared(loop=None):
+    """关闭当前循环的共享连接池（batch_runner 等在循环结束前调用）"""
+    loop = loop or asyncio.get_running_loop()
+    with _lock:
+        pool = _connectors.pop(loop, {})
+    for connector in pool.values():
+        await connector.close()
+
+
+def stats():
+    loop = asyncio.get_running_loop()
+    with _lock:
+        pool = dict(_connectors.get(loop, {}))
+    idle = {}
+    for kind, connector in pool.items():
+        # 各主机当前空闲可复用的连接数
+        idle[kind] = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+    return {"resolver": _resolver.stats(), "idle_connections": idle}
@@ -0,0 +1,391 @@
+""" 同一主机上多个 ComfyUI 进程之间的协调：共享任务状态、结果图缓存和每个密钥的并发名额
+
+每张显卡跑一个 ComfyUI 进程时，各进程的 MJClient 互不知情：同一个任务被多个进程分别轮询，
+同一张图被分别下载。在 config.ini 中为所有进程配置同一个目录后，进程之间通过其中的 SQLite 数据库
+（WAL 模式，依赖文件锁，不需要额外的服务）协调：
+
+    [COORDINATION]
+      dir: ~/.cache/comfyui-mj       # 同一主机的所有进程配置同一目录，为空表示不启用
+      lease: 30                      # 轮询 / 下载租约（秒），应大于 poll_interval；持有者退出后由其他进程接手
+      image_cache_mb: 1024           # 共享结果图缓存上限（按最近使用淘汰）
+      max_in_flight_per_key: 0       # 每个 端点+密钥 在整台主机上同时在跑的任务上限，0 表示不限制
+                                     # （配置了 [MIDJOURNEY_POOL] 时使用各端点的最大并发）
+
+- 任务状态：每个 task_id 同一时间只有一个进程（租约持有者）请求中转，结果写入共享表，其他进程读表
+- 结果图：按 URL + max_side 缓存原始字节，同一张图只有一个进程下载，其他进程等待后直接读缓存
+- 并发名额：提交前在共享表中占用名额，任务结束（或取消）时归还；持有名额期间后台线程定期刷新心跳，
+  进程退出后名额随心跳过期回收
+
+数据库只在一个专用线程中访问，事件循环通过 run_in_executor 等待，不会被文件锁阻塞。
+"""
+import asyncio
+import atexit
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import load_config
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("SUCCESS", "FAILED", "FAILURE")
+# 共享表中超过该时间（秒）未更新的任务记录在打开数据库时清理
+_TASK_RETENTION = 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processes (owner TEXT PRIMARY KEY, heartbeat REAL);
+CREATE TABLE IF NOT EXISTS tasks (task_id TEXT PRIMARY KEY, status TEXT, data TEXT, updated REAL,
+                                  poller TEXT, lease_until REAL);
+CREATE TABLE IF NOT EXISTS images (key TEXT PRIMARY KEY, file TEXT, bytes INTEGER, last_used REAL);
+CREATE TABLE IF NOT EXISTS downloads (key TEXT PRIMARY KEY, owner TEXT, lease_until REAL);
+CREATE TABLE IF NOT EXISTS slots (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, owner TEXT, task_id TEXT,
+                                  acquired REAL);
+CREATE INDEX IF NOT EXISTS slots_key ON slots (key);
+CREATE INDEX IF NOT EXISTS slots_task_id ON slots (task_id);
+"""
+
+
+def budget_key(api_url, api_key):
+    """端点 + 密钥对应的名额键（只保存哈希，数据库中不出现密钥）"""
+    return hashlib.sha256(f"{api_url}|{api_key}".encode("utf-8")).hexdigest()[:16]
+
+
+class HostCoordinator:
+    """
+    Args:
+        directory (str): 共享目录（数据库与结果图缓存）
+        lease (float): 轮询 / 下载租约（秒）
+        image_cache_mb (int): 结果图缓存上限
+        max_in_flight_per_key (int): 每个名额键的默认上限，0 表示不限制
+    """
+
+    def __init__(self, directory, lease=30, image_cache_mb=1024, max_in_flight_per_key=0):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.image_dir = os.path.join(self.directory, "images")
+        os.makedirs(self.image_dir, exist_ok=True)
+        self.lease = lease
+        self.image_cache_bytes = image_cache_mb * 1024 * 1024
+        self.max_in_flight_per_key = max_in_flight_per_key
+        # 非轮询进程读取共享表的间隔：读本地数据库很便宜，比 poll_interval 短，结果更快可见
+        self.follow_interval = 1.0
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mj-coord")
+        self._db = None
+        self._last_heartbeat = 0.0
+        self._lock = threading.Lock()
+        # 本进程持有的名额：slot_id -> task_id（尚未关联任务时为 None）
+        self._held = {}
+        self._stats = {"polls": 0, "shared_polls": 0, "image_hits": 0, "image_downloads": 0,
+                       "image_waits": 0, "slot_waits": 0}
+        self._executor.submit(self._open).result()
+        self._stop = threading.Event()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_main, name="mj-coord-heartbeat",
+                                                  daemon=True)
+        self._heartbeat_thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.has_section('COORDINATION') or not config['COORDINATION'].get('dir', '').strip():
+            return None
+        section = config['COORDINATION']
+        return cls(
+            section.get('dir').strip(),
+            lease=section.getfloat('lease', 30),
+            image_cache_mb=section.getint('image_cache_mb', 1024),
+            max_in_flight_per_key=section.getint('max_in_flight_per_key', 0),
+        )
+
+    # ---------- 数据库（只在 mj-coord 线程中访问） ----------
+    def _open(self):
+        self._db = sqlite3.connect(os.path.join(self.directory, "coordination.sqlite"), timeout=30,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.execute("DELETE FROM tasks WHERE updated < ?", (time.time() - _TASK_RETENTION,))
+
+    def _transaction(self, fn, *args):
+        """在写事务中执行 fn(now, *args)（BEGIN IMMEDIATE：事务开始即持有写锁，读-改-写不会交错）"""
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if now - self._last_heartbeat >= 1.0:
+                self._db.execute("INSERT OR REPLACE INTO processes (owner, heartbeat) VALUES (?, ?)",
+                                 (self.owner, now))
+                self._last_heartbeat = now
+            result = fn(now, *args)
+            self._db.execute("COMMIT")
+            return result
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._transaction, fn, *args)
+
+    def _touch(self, now):
+        # 心跳由 _transaction 写入
+        pass
+
+    def _heartbeat_main(self):
+        """
+        持有名额期间每 lease / 3 秒刷新一次心跳：心跳原本只随其他事务顺带写入，上传或轮询间隔超过 lease 时
+        其他进程会把仍在使用的名额当作过期回收
+        """
+        interval = self.lease / 3
+        while not self._stop.wait(interval):
+            with self._lock:
+                held = bool(self._held)
+            if not held or time.time() - self._last_heartbeat < interval:
+                continue
+            try:
+                self._executor.submit(self._transaction, self._touch).result()
+            except Exception as e:
+                logger.warning(f"Coordination heartbeat failed: {e}")
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    # ---------- 任务状态 ----------
+    def _claim_task(self, now, task_id):
+        row = self._db.execute("SELECT status, data, poller, lease_until FROM tasks WHERE task_id = ?",
+                               (task_id,)).fetchone()
+        if row is not None and row[0] in TERMINAL_STATUSES:
+            return False, json.loads(row[1])
+        if row is None or row[2] in (None, self.owner) or row[3] < now:
+            self._db.execute(
+                "INSERT INTO tasks (task_id, updated, poller, lease_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (task_id) DO UPDATE SET poller = excluded.poller, lease_until = excluded.lease_until",
+                (task_id, now, self.owner, now + self.lease))
+            return True, None
+        return False, json.loads(row[1]) if row[1] else None
+
+    def _publish_task(self, now, task_id, data):
+        status = data.get("status", "")
+        terminal = status in TERMINAL_STATUSES
+        self._db.execute(
+            "UPDATE tasks SET status = ?, data = ?, updated = ?, poller = ?, lease_until = ? WHERE task_id = ?",
+            (status, json.dumps(data, ensure_ascii=False), now, None if terminal else self.owner,
+             0 if terminal else now + self.lease, task_id))
+
+    def _release_task(self, now, task_id):
+        self._db.execute("UPDATE tasks SET poller = NULL, lease_until = 0 WHERE task_id = ? AND poller = ?",
+                         (task_id, self.owner))
+
+    async def poll_task(self, task_id, fetch):
+        """
+        取任务的最新状态：本进程持有（或抢到）轮询租约时调用 fetch() 请求中转并写入共享表，
+        否则读取其他进程写入的状态
+        return: (data, polled)，其他进程尚未写入任何状态时 data 为 None
+        """
+        polled, data = await self._call(self._claim_task, task_id)
+        if not polled:
+            self._count("shared_polls")
+            return data, False
+        self._count("polls")
+        try:
+            data = await fetch()
+        except BaseException:
+            # 本进程请求失败或被取消，让出租约，其他等待同一任务的进程立即接手
+            await asyncio.shield(self._call(self._release_task, task_id))
+            raise
+        await self._call(self._publish_task, task_id, data)
+        return data, True
+
+    # ---------- 结果图缓存 ----------
+    def _claim_image(self, now, key):
+        row = self._db.execute("SELECT file FROM images WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            path = os.path.join(self.image_dir, row[0])
+            if os.path.exists(path):
+                self._db.execute("UPDATE images SET last_used = ? WHERE key = ?", (now, key))
+                return "hit", path
+            self._db.execute("DELETE FROM images WHERE key = ?", (key,))
+        row = self._db.execute("SELECT owner, lease_until FROM downloads WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[0] != self.owner and row[1] >= now:
+            return "wait", None
+        self._db.execute("INSERT OR REPLACE INTO downloads (key, owner, lease_until) VALUES (?, ?, ?)",
+                         (key, self.owner, now + self.lease))
+        return "download", None
+
+    def _write_image(self, key, data):
+        """在事务之外把结果图写入临时文件（写盘期间不持有数据库写锁），返回 (文件名, 临时文件路径)"""
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        tmp = os.path.join(self.image_dir, f"{name}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        return name, tmp
+
+    def _store_image(self, now, key, name, tmp, size):
+        """事务内只做改名和记录；返回被淘汰的文件，提交后再删除"""
+        os.replace(tmp, os.path.join(self.image_dir, name))
+        self._db.execute("INSERT OR REPLACE INTO images (key, file, bytes, last_used) VALUES (?, ?, ?, ?)",
+                         (key, name, size, now))
+        self._db.execute("DELETE FROM downloads WHERE key = ?", (key,))
+        evicted = []
+        total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM images").fetchone()[0]
+        if total > self.image_cache_bytes:
+            for old_key, file, size in self._db.execute(
+                    "SELECT key, file, bytes FROM images ORDER BY last_used").fetchall():
+                if total <= self.image_cache_bytes or old_key == key:
+                    break
+                self._db.execute("DELETE FROM images WHERE key = ?", (old_key,))
+                evicted.append(file)
+                total -= size
+        return evicted
+
+    def _release_download(self, now, key):
+        self._db.execute("DELETE FROM downloads WHERE key = ? AND owner = ?", (key, self.owner))
+
+    async def fetch_image(self, key, download):
+        """
+        按 key（URL + max_side）取结果图的原始字节：命中共享缓存时直接读取；
+        其他进程正在下载时等待；否则调用 download() 下载并写入缓存
+        """
+        loop = asyncio.get_running_loop()
+        waited = False
+        while True:
+            state, path = await self._call(self._claim_image, key)
+            if state == "hit":
+                self._count("image_hits")
+                try:
+                    with open(path, "rb") as f:
+                        return await loop.run_in_executor(None, f.read)
+                except OSError:
+                    # 读取前被其他进程淘汰，重新认领
+                    continue
+            if state == "download":
+                break
+            if not waited:
+                self._count("image_waits")
+                waited = True
+            await asyncio.sleep(0.2)
+
+        self._count("image_downloads")
+        try:
+            data = await download()
+            name, tmp = await loop.run_in_executor(None, self._write_image, key, data)
+        except BaseException:
+            await asyncio.shield(self._call(self._release_download, key))
+            raise
+        try:
+            evicted = await self._call(self._store_image, key, name, tmp, len(data))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        for file in evicted:
+            try:
+                os.remove(os.path.join(self.image_dir, file))
+            except OSError:
+                pass
+        return data
+
+    # ---------- 并发名额 ----------
+    def _try_slot(self, now, key, limit):
+        # 心跳过期的进程（已退出或卡死）占用的名额直接回收
+        self._db.execute("DELETE FROM slots WHERE owner NOT IN (SELECT owner FROM processes WHERE heartbeat >= ?)",
+                         (now - self.lease,))
+        self._db.execute("DELETE FROM processes WHERE heartbeat < ?", (now - self.lease,))
+        used = self._db.execute("SELECT COUNT(*) FROM slots WHERE key = ?", (key,)).fetchone()[0]
+        if used >= limit:
+            return None
+        return self._db.execute("INSERT INTO slots (key, owner, acquired) VALUES (?, ?, ?)",
+                                (key, self.owner, now)).lastrowid
+
+    def _bind_slot(self, now, slot_id, task_id):
+        self._db.execute("UPDATE slots SET task_id = ? WHERE id = ?", (task_id, slot_id))
+
+    def _release_slot(self, now, slot_id, task_id):
+        if slot_id is not None:
+            self._db.execute("DELETE FROM slots WHERE id = ?", (slot_id,))
+        else:
+            self._db.execute("DELETE FROM slots WHERE task_id = ? AND owner = ?", (task_id, self.owner))
+
+    async def acquire_slot(self, key, limit=0):
+        """
+        在整台主机范围内占用 key 的一个并发名额，名额用完时等待
+        limit 为 0 时使用 max_in_flight_per_key；都为 0 时不限制，返回 None
+        """
+        limit = limit or self.max_in_flight_per_key
+        if not limit:
+            return None
+        waited = False
+        while True:
+            slot_id = await self._call(self._try_slot, key, limit)
+            if slot_id is not None:
+                with self._lock:
+                    self._held[slot_id] = None
+                return slot_id
+            if not waited:
+                self._count("slot_waits")
+                waited = True
+            await asyncio.sleep(0.5)
+
+    async def bind_slot(self, slot_id, task_id):
+        """名额与远端任务关联，任务结束时按 task_id 归还"""
+        if slot_id is not None:
+            await self._call(self._bind_slot, slot_id, task_id)
+            with self._lock:
+                if slot_id in self._held:
+                    self._held[slot_id] = task_id
+
+    async def release_slot(self, slot_id=None, task_id=None):
+        await self._call(self._release_slot, slot_id, task_id)
+        with self._lock:
+            if slot_id is not None:
+                self._held.pop(slot_id, None)
+            else:
+                for held_id in [i for i, held_task in self._held.items() if held_task == task_id]:
+                    del self._held[held_id]
+
+    # ---------- 其他 ----------
+    def _shutdown(self, now):
+        self._db.execute("DELETE FROM slots WHERE owner = ?", (self.owner,))
+        self._db.execute("UPDATE tasks SET poller = NULL, lease_until = 0 WHERE poller = ?", (self.owner,))
+        self._db.execute("DELETE FROM downloads WHERE owner = ?", (self.owner,))
+        self._db.execute("DELETE FROM processes WHERE owner = ?", (self.owner,))
+
+    def close(self):
+        """归还本进程的名额和租约（进程退出时自动调用）"""
+        if self._db is None:
+            return
+        self._stop.set()
+        with self._lock:
+            self._held.clear()
+        try:
+            self._executor.submit(self._transaction, self._shutdown).result(timeout=10)
+            self._executor.submit(self._db.close).result(timeout=10)
+        except Exception as e:
+            logger.warning(f"Failed to release coordination state: {e}")
+        self._db = None
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, owner=self.owner)
+
+
+_coordinator = None
+_coordinator_loaded = False
+_coordinator_lock = threading.Lock()
+
+
+def get_coordinator():
+    """进程内共享的主机协调器，未配置 [COORDINATION] dir 时返回 None"""
+    global _coordinator, _coordinator_loaded
+    with _coordinator_lock:
+        if not _coordinator_loaded:
+            _coordinator = HostCoordinator.from_config(load_config())
+            _coordinator_loaded = True
+        return _coordinator
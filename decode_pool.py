@@ -0,0 +1,193 @@
+""" 图片解码 / 编码的执行器池，以及事件循环延迟（loop lag）测量
+
+下载协程里直接 Image.open + np.array 会阻塞事件循环：一张 2048×2048 的 PNG 需要数百毫秒，
+期间同一循环上的轮询和其他下载全部停住。这里的函数都放到独立的执行器中运行，
+解码并发数（max_workers）与网络并发数分开限制，在 config.ini 中配置：
+
+    [DECODE]
+      executor: thread     # thread（默认，PIL 解码时会释放 GIL）或 process
+      max_workers: 4       # 同时进行的解码 / 编码数，默认 min(4, CPU 核数)
+
+process 模式下参数和结果需要在进程间复制，只在解码是瓶颈且 CPU 核数较多时使用。
+"""
+import asyncio
+import base64
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from .utils import load_config
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ("thread", "process")
+
+
+# ---------- 在执行器中运行的函数（模块级，process 模式下需要可 pickle） ----------
+def decode_image(data, max_side=0):
+    """
+    原始压缩字节 → np.ndarray（HWC）
+    max_side 大于 0 时长边缩小到 max_side 以内：JPEG 用 draft 在解码阶段直接按 1/2~1/8 缩小，
+    其他格式先按整数倍 reduce 再重采样，不会生成原分辨率的 float 数据
+    """
+    img = Image.open(BytesIO(data))
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+    return np.array(img)
+
+
+def decode_preview(data, max_size=512):
+    """中间预览图：按 max_size 缩小解码（JPEG 走 draft 直接低分辨率解码）"""
+    img = Image.open(BytesIO(data))
+    img.draft("RGB", (max_size, max_size))
+    img = img.convert("RGB")
+    img.thumbnail((max_size, max_size))
+    return img
+
+
+def to_data_url(data):
+    """原始压缩字节 → data URL（只读文件头判断格式，不解码）"""
+    fmt = (Image.open(BytesIO(data)).format or "PNG").lower()
+    return f"data:image/{fmt};base64," + base64.b64encode(data).decode("utf-8")
+
+
+def save_png(pixels, path):
+    """np.ndarray（HWC）编码为 PNG 写入 path"""
+    Image.fromarray(pixels).save(path)
+
+
+class DecodePool:
+    """
+    Args:
+        executor (str): thread / process
+        max_workers (int): 解码并发数上限
+    """
+
+    def __init__(self, executor="thread", max_workers=None):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown decode executor: {executor}")
+        self.kind = executor
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        if executor == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="mj-decode")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.busy_s = 0.0
+        # 提交到开始执行的最长等待：持续偏大说明 max_workers 不够
+        self.max_queue_wait_s = 0.0
+
+    def _timed(self, submitted, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.calls += 1
+                self.busy_s += time.perf_counter() - started
+                self.max_queue_wait_s = max(self.max_queue_wait_s, started - submitted)
+
+    async def run(self, fn, *args):
+        """在执行器中运行 fn(*args)，等待期间不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        if self.kind == "process":
+            # 子进程内无法回写统计，按提交到返回的耗时计（含排队与进程间复制）
+            started = time.perf_counter()
+            try:
+                return await loop.run_in_executor(self._executor, fn, *args)
+            finally:
+                with self._lock:
+                    self.calls += 1
+                    self.busy_s += time.perf_counter() - started
+        return await loop.run_in_executor(self._executor, self._timed, time.perf_counter(), fn, args)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "executor": self.kind,
+                "max_workers": self.max_workers,
+                "calls": self.calls,
+                "busy_s": round(self.busy_s, 4),
+                "max_queue_wait_s": round(self.max_queue_wait_s, 4),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_decode_pool():
+    """进程内共享的解码执行器池"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config = load_config()
+            _pool = DecodePool(
+                executor=config.get('DECODE', 'executor', fallback='thread').strip().lower(),
+                max_workers=config.getint('DECODE', 'max_workers', fallback=0),
+            )
+        return _pool
+
+
+class LoopLagMonitor:
+    """
+    测量事件循环的响应延迟：每 interval 秒醒来一次，实际醒来时间比预期晚多少即为 lag。
+    lag 持续在几十毫秒以上说明有同步代码占住了循环
+
+        async with LoopLagMonitor() as monitor:
+            ...
+        monitor.stats()
+    """
+
+    def __init__(self, interval=0.02, max_samples=10000):
+        self.interval = interval
+        # 长时间运行（batch_runner）只保留最近的样本
+        self.samples = deque(maxlen=max_samples)
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        return self.stats()
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def stats(self):
+        if not self.samples:
+            return {"samples": 0, "mean_ms": None, "p99_ms": None, "max_ms": None}
+        samples = np.array(self.samples) * 1000
+        return {
+            "samples": len(samples),
+            "mean_ms": round(float(samples.mean()), 2),
+            "p99_ms": round(float(np.percentile(samples, 99)), 2),
+            "max_ms": round(float(samples.max()), 2),
+        }
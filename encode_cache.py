@@ -0,0 +1,125 @@
+""" 上传侧编码缓存：输入 Tensor 内容哈希 + 编码方式 → 编码结果（PNG 字节 / base64）
+
+迭代编辑时通常只改提示词，原图和蒙版不变，命中缓存即可省去每张图数百毫秒的 PNG 压缩。
+进程内共享、按字节数做 LRU 淘汰，上限在 config.ini 中配置（默认 256 MB）：
+
+    [CACHE]
+      encode_cache_mb: 256
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    # 可选：xxhash 比 blake2b 快数倍
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from .utils import load_config
+
+logger = logging.getLogger(__name__)
+
+
+def tensor_digest(tensor):
+    """Tensor / ndarray 的内容哈希（含 shape 与 dtype）"""
+    if hasattr(tensor, "detach"):
+        tensor = tensor.detach().cpu().numpy()
+    array = np.ascontiguousarray(tensor)
+    hasher = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    hasher.update(f"{array.shape}|{array.dtype}".encode())
+    hasher.update(array.data)
+    return hasher.hexdigest()
+
+
+class EncodeCache:
+    """
+    Args:
+        max_bytes (int): 缓存结果的总字节数上限，0 表示关闭缓存
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # 命中时省下的编码耗时（按该条目首次编码耗时累计）
+        self.saved_s = 0.0
+
+    def get_or_encode(self, tensor, kind, encode, **options):
+        """
+        kind: 编码方式（如 "png"、"blend-png"、"mask-png"），与 options 一起作为缓存键的一部分
+        encode: 未命中时调用的无参函数，返回 bytes 或 str
+        """
+        if not self.max_bytes:
+            return encode()
+        key = (kind, tensor_digest(tensor), tuple(sorted(options.items())))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_s += entry[1]
+                return entry[0]
+            self.misses += 1
+
+        started = time.perf_counter()
+        value = encode()
+        elapsed = time.perf_counter() - started
+        self._put(key, value, elapsed)
+        return value
+
+    def _put(self, key, value, elapsed):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (value, elapsed)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "saved_s": round(self.saved_s, 4),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_encode_cache():
+    """进程内共享的编码缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = load_config()
+            max_mb = config.getfloat('CACHE', 'encode_cache_mb', fallback=256)
+            _cache = EncodeCache(max_bytes=int(max_mb * 1024 * 1024))
+        return _cache
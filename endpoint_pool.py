@@ -0,0 +1,215 @@
+""" 多端点 / 多密钥池：按健康状态、实测延迟和剩余并发路由，失败自动摘除并切换
+
+在 config.ini 中配置（每行 `api_url | api_key | 最大并发`，api_key 留空则使用节点传入的 app_key）：
+
+    [MIDJOURNEY_POOL]
+      endpoints:
+          https://yunwu.ai | sk-aaa | 3
+          https://backup.example.com | sk-bbb | 10
+      eject_seconds: 30
+
+没有 [MIDJOURNEY_POOL] 时 MJClient 仍然只使用 [MIDJOURNEY_API] 的 api_url。
+任务创建后固定（pin）到创建它的端点，后续轮询、放大/变体和取消都发往该端点。
+"""
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Endpoint:
+    def __init__(self, url, api_key="", max_concurrency=3):
+        self.url = url.rstrip("/")
+        self.api_key = api_key
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.in_flight = 0
+        self.latency_ewma = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def healthy(self, now):
+        return now >= self.ejected_until
+
+    def has_capacity(self):
+        return self.in_flight < self.max_concurrency
+
+    def score(self):
+        """越小越优先：实测延迟按占用率放大，没有样本的端点优先被探测"""
+        latency = self.latency_ewma if self.latency_ewma is not None else 0.0
+        return latency * (1.0 + self.in_flight / self.max_concurrency)
+
+    def snapshot(self, now):
+        return {
+            "url": self.url,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "latency_ewma": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+            "healthy": self.healthy(now),
+            "ejected_for": round(max(self.ejected_until - now, 0.0), 1),
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class EndpointPool:
+    """进程内共享（多个节点线程同时使用），内部状态由 threading.Lock 保护，锁内不 await"""
+
+    def __init__(self, endpoints, eject_seconds=30, max_eject_seconds=600, ewma_alpha=0.3,
+                 pin_ttl=3600, wait_interval=0.5):
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.ewma_alpha = ewma_alpha
+        self.pin_ttl = pin_ttl
+        self.wait_interval = wait_interval
+        self._lock = threading.Lock()
+        # task_id -> (endpoint, 是否占用并发名额, 固定时间)
+        self._pins = {}
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.has_section('MIDJOURNEY_POOL'):
+            return None
+        section = config['MIDJOURNEY_POOL']
+        default_concurrency = section.getint('max_concurrency', 3)
+        endpoints = []
+        for line in section.get('endpoints', '').splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = [p.strip() for p in line.split('|')]
+            url = parts[0]
+            api_key = parts[1] if len(parts) > 1 else ""
+            concurrency = int(parts[2]) if len(parts) > 2 and parts[2] else default_concurrency
+            endpoints.append(Endpoint(url, api_key, concurrency))
+        if not endpoints:
+            return None
+        return cls(
+            endpoints,
+            eject_seconds=section.getfloat('eject_seconds', 30),
+            max_eject_seconds=section.getfloat('max_eject_seconds', 600),
+            pin_ttl=section.getfloat('pin_ttl', 3600),
+        )
+
+    # ---------- 路由 ----------
+    def _expire_pins(self, now):
+        expired = [task_id for task_id, (_, _, pinned_at) in self._pins.items()
+                   if now - pinned_at > self.pin_ttl]
+        for task_id in expired:
+            endpoint, holds_slot, _ = self._pins.pop(task_id)
+            if holds_slot:
+                endpoint.in_flight = max(endpoint.in_flight - 1, 0)
+
+    def try_reserve(self, exclude=()):
+        """选出最优端点并占用一个并发名额；全部满载时返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire_pins(now)
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            healthy = [e for e in candidates if e.healthy(now)]
+            if not healthy:
+                # 全部被摘除时，尝试最早恢复的那个，而不是直接失败
+                healthy = [min(candidates, key=lambda e: e.ejected_until)]
+            available = [e for e in healthy if e.has_capacity()]
+            if not available:
+                return None
+            endpoint = min(available, key=Endpoint.score)
+            endpoint.in_flight += 1
+            return endpoint
+
+    async def reserve(self, exclude=()):
+        """等待直到有端点空出并发名额；exclude 覆盖全部端点时返回 None"""
+        while True:
+            endpoint = self.try_reserve(exclude)
+            if endpoint is not None:
+                return endpoint
+            if all(e in exclude for e in self.endpoints):
+                return None
+            await asyncio.sleep(self.wait_interval)
+
+    async def reserve_on(self, endpoint):
+        """在指定端点上等待并占用名额（放大/变体必须发往父任务所在端点）"""
+        while True:
+            with self._lock:
+                self._expire_pins(time.monotonic())
+                if endpoint.has_capacity():
+                    endpoint.in_flight += 1
+                    return endpoint
+            await asyncio.sleep(self.wait_interval)
+
+    def unreserve(self, endpoint):
+        with self._lock:
+            endpoint.in_flight = max(endpoint.in_flight - 1, 0)
+
+    # ---------- 任务固定 ----------
+    def pin(self, task_id, endpoint, holds_slot=True):
+        with self._lock:
+            self._pins[task_id] = (endpoint, holds_slot, time.monotonic())
+
+    def endpoint_for(self, task_id):
+        with self._lock:
+            pinned = self._pins.get(task_id)
+        return pinned[0] if pinned else None
+
+    def release(self, task_id):
+        """任务结束：归还并发名额，保留 pin 以便后续放大/变体仍发往同一端点"""
+        with self._lock:
+            pinned = self._pins.get(task_id)
+            if pinned is None:
+                return
+            endpoint, holds_slot, pinned_at = pinned
+            if holds_slot:
+                endpoint.in_flight = max(endpoint.in_flight - 1, 0)
+                self._pins[task_id] = (endpoint, False, pinned_at)
+
+    def primary(self):
+        """未知任务（例如上次运行创建的）默认查询的端点"""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.healthy(now)]
+        return (healthy or self.endpoints)[0]
+
+    # ---------- 健康与延迟 ----------
+    def observe(self, endpoint, latency, ok):
+        with self._lock:
+            endpoint.requests += 1
+            if ok:
+                endpoint.failures = 0
+                if endpoint.latency_ewma is None:
+                    endpoint.latency_ewma = latency
+                else:
+                    endpoint.latency_ewma += self.ewma_alpha * (latency - endpoint.latency_ewma)
+                return
+            endpoint.errors += 1
+            endpoint.failures += 1
+            cooldown = min(self.eject_seconds * 2 ** (endpoint.failures - 1), self.max_eject_seconds)
+            endpoint.ejected_until = time.monotonic() + cooldown
+        logger.warning(f"Endpoint {endpoint.url} ejected for {cooldown:.0f}s after {endpoint.failures} failure(s)")
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [e.snapshot(now) for e in self.endpoints]
+
+
+_pool = None
+_pool_loaded = False
+_pool_lock = threading.Lock()
+
+
+def get_endpoint_pool(config):
+    """进程内共享的端点池，未配置 [MIDJOURNEY_POOL] 时返回 None"""
+    global _pool, _pool_loaded
+    with _pool_lock:
+        if not _pool_loaded:
+            _pool = EndpointPool.from_config(config)
+            _pool_loaded = True
+        return _pool
@@ -0,0 +1,188 @@
+""" GPT Image 节点共享的 OpenAI 客户端：按 (base_url, api_key) 进程内复用，连接池参数可配置
+
+每个节点实例各自创建 OpenAI 客户端时，每个客户端都有独立的 httpx 连接池，连续的生成 / 编辑
+（尤其是不同节点交替执行）每次都要重新做 TCP / TLS 握手。这里的客户端由所有 GPT 节点共享，
+配置只在首次使用时读取一次。在 config.ini 的 [GPT_IMAGE_API] 中可选配置：
+
+    [GPT_IMAGE_API]
+      api_url: https://yunwu.ai
+      api_key: sk-xxx
+      max_connections: 20      # 连接数上限（同时进行的请求数）
+      max_keepalive: 10        # 保留的空闲连接数
+      keepalive_expiry: 60     # 空闲连接保留时间（秒）
+      http2: true              # 只在安装了 h2（pip install h2，非必需依赖）时生效，否则使用 HTTP/1.1 keep-alive
+      timeout: 600             # 单次请求超时（秒），gpt-image-1 高质量生成可能需要数分钟
+      connect_timeout: 10      # 建立连接超时（秒）
+      max_retries: 2           # OpenAI SDK 对 429 / 5xx / 连接错误的重试次数
+      connect_retries: 1       # 建立连接失败时在传输层立即重试的次数
+
+连接池通过 openai SDK 自带的 DefaultHttpxClient 创建（这里直接使用 httpx.Limits / HTTPTransport，
+requirements.txt 中单独声明 httpx>=0.23.0）；SDK 版本过旧没有该类或缺少 httpx 时退回 SDK 默认客户端，
+客户端仍然共享，只是连接池参数与统计不生效。
+stats() 返回各客户端的请求数、新建连接数、TLS 握手数和连接复用率，用于确认连接确实被复用。
+"""
+import importlib.util
+import logging
+import threading
+
+from .utils import init_logger, load_config
+
+logger = logging.getLogger(__name__)
+
+_TRACE_EVENTS = {
+    "connection.connect_tcp.complete": "connections",
+    "connection.start_tls.complete": "tls_handshakes",
+}
+
+
+class GPTSettings:
+    """[GPT_IMAGE_API] 配置（api_key 缺失时 from_config 抛出 ValueError）"""
+
+    def __init__(self, api_key, api_url="https://yunwu.ai", max_connections=20, max_keepalive=10,
+                 keepalive_expiry=60.0, http2=True, timeout=600.0, connect_timeout=10.0, max_retries=2,
+                 connect_retries=1):
+        self.api_key = api_key
+        # GPT-Image-1 端点位于 /v1
+        self.base_url = f"{api_url.rstrip('/')}/v1"
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.connect_retries = connect_retries
+
+    @classmethod
+    def from_config(cls, config):
+        section = config['GPT_IMAGE_API'] if config.has_section('GPT_IMAGE_API') else None
+        api_key = section.get('api_key') if section is not None else None
+        if not api_key:
+            raise ValueError("API key not found in config.ini under [GPT_IMAGE_API] section")
+        return cls(
+            api_key,
+            api_url=section.get('api_url', 'https://yunwu.ai'),
+            max_connections=section.getint('max_connections', 20),
+            max_keepalive=section.getint('max_keepalive', 10),
+            keepalive_expiry=section.getfloat('keepalive_expiry', 60),
+            http2=section.getboolean('http2', True),
+            timeout=section.getfloat('timeout', 600),
+            connect_timeout=section.getfloat('connect_timeout', 10),
+            max_retries=section.getint('max_retries', 2),
+            connect_retries=section.getint('connect_retries', 1),
+        )
+
+
+class ConnectionStats:
+    """
+    统计一个客户端的请求数与新建连接数：作为 httpx 的请求事件钩子，为每个请求挂上 httpcore 的 trace 回调，
+    只有新建连接时才会出现 connect_tcp / start_tls 事件
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 退回 SDK 默认客户端时为 False（无法挂钩子，不统计）
+        self.pooled = True
+        self._counts = {"requests": 0, "connections": 0, "tls_handshakes": 0, "http2_responses": 0,
+                        "server_errors": 0}
+
+    def _trace(self, event_name, info):
+        field = _TRACE_EVENTS.get(event_name)
+        if field is not None:
+            with self._lock:
+                self._counts[field] += 1
+
+    def on_request(self, request):
+        request.extensions["trace"] = self._trace
+        with self._lock:
+            self._counts["requests"] += 1
+
+    def on_response(self, response):
+        with self._lock:
+            if response.http_version == "HTTP/2":
+                self._counts["http2_responses"] += 1
+            if response.status_code >= 500:
+                self._counts["server_errors"] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts, pooled=self.pooled)
+        requests = counts["requests"]
+        counts["reuse_rate"] = round(1 - counts["connections"] / requests, 3) if requests else None
+        return counts
+
+
+def _http2_available():
+    return importlib.util.find_spec("h2") is not None
+
+
+def _build_client(settings, base_url, api_key, connection_stats):
+    # 首次使用时才导入 openai（不拖慢 ComfyUI 启动）
+    from openai import OpenAI
+
+    try:
+        # SDK 自带的 httpx 客户端（保留 SDK 的默认设置），只调整连接池参数
+        import httpx
+        from openai import DefaultHttpxClient
+    except ImportError as e:
+        # 旧版 SDK 没有 DefaultHttpxClient：使用 SDK 默认的 HTTP 客户端（仍由所有节点共享，但不统计连接复用）
+        logger.warning(f"Pooled GPT HTTP client unavailable ({e}), using the openai SDK default client")
+        connection_stats.pooled = False
+        return OpenAI(base_url=base_url, api_key=api_key, timeout=settings.timeout,
+                      max_retries=settings.max_retries)
+
+    http2 = settings.http2 and _http2_available()
+    limits = httpx.Limits(max_connections=settings.max_connections,
+                          max_keepalive_connections=settings.max_keepalive,
+                          keepalive_expiry=settings.keepalive_expiry)
+    timeout = httpx.Timeout(settings.timeout, connect=settings.connect_timeout)
+    http_client = DefaultHttpxClient(
+        # 代理（环境变量）的传输层也使用这组 limits / http2
+        limits=limits,
+        http2=http2,
+        timeout=timeout,
+        transport=httpx.HTTPTransport(limits=limits, http2=http2, retries=settings.connect_retries),
+        event_hooks={"request": [connection_stats.on_request], "response": [connection_stats.on_response]},
+    )
+    logger.debug(f"GPT client for {base_url}: http2={http2}, max_connections={settings.max_connections}")
+    return OpenAI(base_url=base_url, api_key=api_key, http_client=http_client, timeout=timeout,
+                  max_retries=settings.max_retries)
+
+
+_settings = None
+_settings_lock = threading.Lock()
+# (base_url, api_key) -> (OpenAI, ConnectionStats)，进程内所有 GPT 节点共享
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_gpt_settings():
+    """进程内共享的 [GPT_IMAGE_API] 配置，首次调用时读取（同时初始化日志）"""
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            init_logger()
+            _settings = GPTSettings.from_config(load_config())
+        return _settings
+
+
+def get_gpt_client(api_key=None, base_url=None):
+    """按 (base_url, api_key) 返回进程内共享的 OpenAI 客户端，不存在时创建；参数为空时使用配置中的值"""
+    settings = get_gpt_settings()
+    api_key = api_key or settings.api_key
+    base_url = (base_url or settings.base_url).rstrip('/')
+    with _clients_lock:
+        entry = _clients.get((base_url, api_key))
+        if entry is None:
+            connection_stats = ConnectionStats()
+            entry = _clients[(base_url, api_key)] = (
+                _build_client(settings, base_url, api_key, connection_stats), connection_stats)
+        return entry[0]
+
+
+def stats():
+    """各共享客户端的连接复用统计（密钥只保留末 4 位）"""
+    with _clients_lock:
+        entries = list(_clients.items())
+    return [dict(base_url=base_url, api_key=f"...{api_key[-4:]}", **connection_stats.stats())
+            for (base_url, api_key), (_, connection_stats) in entries]
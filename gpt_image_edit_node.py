@@ -1,12 +1,10 @@
-import torch
-import base64
-import numpy as np
-from PIL import Image
-from io import BytesIO
+from __future__ import annotations
 
-from openai import OpenAI
+import logging
+import math
+from io import BytesIO
 
-from .utils import load_config, init_logger
+from .progress import ComfyProgressReporter
 
 
 class GPTImageEditNode:
@@ -17,32 +15,38 @@ class GPTImageEditNode:
         image1 (IMAGE):  必需的参考图片。
         image2-4 (IMAGE): 可选的额外参考图片。
 
+    可选：
+        crop_to_mask: 只上传蒙版所在区域（按 crop_padding 外扩并对齐到模型支持的宽高比），
+                      编辑结果按 feather 羽化后贴回原图，蒙版外的像素保持不变；
+                      蒙版与 image1 分辨率不同时整图上传，image1 为多张的批次时报错
+
     输出：
         IMAGE: 生成的图片（Tensor, 0~1, BxHxWxC）。
     """
 
-    def __init__(self):
-        self.logger = init_logger()
-        config = load_config()
-        # 优先读取 GPT_IMAGE_API
-        if config.has_section('GPT_IMAGE_API'):
-            api_section = config['GPT_IMAGE_API']
-        else:
-            api_section = {}
+    # 各模型支持的输出尺寸 (W, H)
+    SUPPORTED_SIZES = {
+        "gpt-image-1": [(1024, 1024), (1536, 1024), (1024, 1536)],
+        "dall-e-2": [(1024, 1024), (512, 512), (256, 256)],
+    }
+    # 裁剪区域超过原图面积的该比例时直接整图上传
+    MAX_CROP_FRACTION = 0.6
 
-        self.api_key = api_section.get('api_key')
-        base_url_root = api_section.get('api_url', 'https://yunwu.ai').rstrip('/')
-        self.base_url = f"{base_url_root}/v1"
-        if not self.api_key:
-            raise ValueError("API key not found in config.ini under [GPT_IMAGE_API] section")
+    def __init__(self):
+        from .gpt_client import get_gpt_settings
 
-        self._client = None
+        # 配置在进程内只读取一次（缺少 api_key 时在这里报错）；客户端由所有 GPT 节点共享
+        get_gpt_settings()
+        self.logger = logging.getLogger(__name__)
+        # 为 None 时使用 config.ini 中的端点 / 密钥；benchmark 等把节点指向 mock relay 时覆盖
+        self.base_url = None
+        self.api_key = None
 
     @property
     def client(self):
-        if self._client is None:
-            self._client = OpenAI(base_url=self.base_url, api_key=self.api_key)
-        return self._client
+        from .gpt_client import get_gpt_client
+
+        return get_gpt_client(self.api_key, self.base_url)
 
     # ---------- ComfyUI 接口定义 ----------
     @classmethod
@@ -64,6 +68,11 @@ class GPTImageEditNode:
                 "output_compression": ("INT", {"default": 100, "min": 0, "max": 100, "step": 1}),
                 "quality": (["auto", "high", "medium", "low"], {"default": "auto"}),
                 "size": (["auto", "1024x1024", "1536x1024", "1024x1536"], {"default": "auto"}),
+                "response_format": (["b64_json", "url"], {"default": "b64_json"}),
+                "partial_images": ("INT", {"default": 0, "min": 0, "max": 3, "step": 1}),
+                "crop_to_mask": ("BOOLEAN", {"default": False}),
+                "crop_padding": ("INT", {"default": 64, "min": 0, "max": 1024, "step": 8}),
+                "feather": ("INT", {"default": 16, "min": 0, "max": 256, "step": 1}),
             }
         }
 
@@ -74,17 +83,23 @@ class GPTImageEditNode:
     # ---------- 辅助函数 ----------
     @staticmethod
     def _tensor_to_bytesio(tensor: torch.Tensor) -> BytesIO:
-        """将 ComfyUI 的图像 Tensor 转换为 PNG 格式的 BytesIO 对象。"""
+        """将 ComfyUI 的图像 Tensor 转换为 PNG 格式的 BytesIO 对象，相同内容命中编码缓存。"""
+        import numpy as np
+        from PIL import Image
+        from .encode_cache import get_encode_cache
+
         if tensor.ndim == 4:
             tensor = tensor[0]
-        
-        img_np = (tensor.cpu().numpy() * 255.0).clip(0, 255).astype(np.uint8)
-        img_pil = Image.fromarray(img_np)
-        
-        buffer = BytesIO()
-        img_pil.save(buffer, format="PNG")
-        buffer.seek(0)
-        return buffer
+
+        def _encode():
+            img_np = (tensor.cpu().numpy() * 255.0).clip(0, 255).astype(np.uint8)
+            img_pil = Image.fromarray(img_np)
+
+            buffer = BytesIO()
+            img_pil.save(buffer, format="PNG")
+            return buffer.getvalue()
+
+        return BytesIO(get_encode_cache().get_or_encode(tensor, "png", _encode))
 
     @staticmethod
     def _mask_tensor_to_bytesio(tensor: torch.Tensor) -> BytesIO:
@@ -93,38 +108,145 @@ class GPTImageEditNode:
         API 要求编辑区域为透明 (alpha=0)。ComfyUI 蒙版中值为 1.0 的区域是要编辑的区域。
         因此，我们将蒙版中值为 1.0 的区域映射为 alpha 0。
         """
+        import numpy as np
+        from PIL import Image
+        from .encode_cache import get_encode_cache
+
         if tensor.ndim == 3:  # (B, H, W)
             tensor = tensor.squeeze(0)  # (H, W)
 
-        # 反转蒙版: 1.0 (编辑) -> 0.0 (透明), 0.0 (不编辑) -> 1.0 (不透明)
-        # API 通过 alpha=0 的区域来识别要编辑的位置
-        alpha_channel = (1.0 - tensor.cpu().numpy()) * 255.0
-        alpha_channel = np.clip(alpha_channel, 0, 255).astype(np.uint8)
+        def _encode():
+            # 反转蒙版: 1.0 (编辑) -> 0.0 (透明), 0.0 (不编辑) -> 1.0 (不透明)
+            # API 通过 alpha=0 的区域来识别要编辑的位置
+            alpha_channel = (1.0 - tensor.cpu().numpy()) * 255.0
+            alpha_channel = np.clip(alpha_channel, 0, 255).astype(np.uint8)
+
+            # 创建一个带有此 alpha 通道的 RGBA 图像
+            pil_image = Image.fromarray(alpha_channel, mode='L').convert('RGBA')
+
+            # 将原始的 alpha 通道数据放入
+            pil_image.putalpha(Image.fromarray(alpha_channel, mode='L'))
 
-        # 创建一个带有此 alpha 通道的 RGBA 图像
-        pil_image = Image.fromarray(alpha_channel, mode='L').convert('RGBA')
-        
-        # 将原始的 alpha 通道数据放入
-        pil_image.putalpha(Image.fromarray(alpha_channel, mode='L'))
+            buffer = BytesIO()
+            pil_image.save(buffer, format="PNG")
+            return buffer.getvalue()
 
-        buffer = BytesIO()
-        pil_image.save(buffer, format="PNG")
-        buffer.seek(0)
-        return buffer
+        return BytesIO(get_encode_cache().get_or_encode(tensor, "mask-png", _encode))
+
+    @classmethod
+    def _mask_crop_box(cls, mask_np, padding, model):
+        """
+        蒙版包围盒外扩 padding 后，按最接近的支持尺寸的宽高比补齐，贴边时平移回原图内
+        return: ((left, top, right, bottom), (W, H)) 或 None（蒙版为空、补齐后放不进原图、或裁剪区域接近整图）
+        """
+        import numpy as np
+
+        height, width = mask_np.shape
+        ys, xs = np.nonzero(mask_np > 0)
+        if len(xs) == 0:
+            return None
+        x0, x1 = max(xs.min() - padding, 0), min(xs.max() + 1 + padding, width)
+        y0, y1 = max(ys.min() - padding, 0), min(ys.max() + 1 + padding, height)
+        box_w, box_h = x1 - x0, y1 - y0
+
+        sizes = cls.SUPPORTED_SIZES.get(model, cls.SUPPORTED_SIZES["gpt-image-1"])
+        # 从宽高比最接近的尺寸开始，取补齐后仍能放进原图的第一个（裁剪框不截断，宽高比保持不变）
+        for target in sorted(sizes, key=lambda s: abs(math.log((s[0] / s[1]) / (box_w / box_h)))):
+            aspect = target[0] / target[1]
+            if box_w / box_h < aspect:
+                crop_w, crop_h = math.ceil(box_h * aspect), box_h
+            else:
+                crop_w, crop_h = box_w, math.ceil(box_w / aspect)
+            if crop_w <= width and crop_h <= height:
+                break
+        else:
+            return None
+        if crop_w * crop_h > cls.MAX_CROP_FRACTION * width * height:
+            return None
+
+        # 以包围盒中心为中心放置裁剪框，越界时整体平移回原图内（仍完整包含包围盒）
+        left = min(max((x0 + x1) // 2 - crop_w // 2, 0), width - crop_w)
+        top = min(max((y0 + y1) // 2 - crop_h // 2, 0), height - crop_h)
+        return (left, top, left + crop_w, top + crop_h), target
+
+    @classmethod
+    def _crop_for(cls, image1, mask, padding, model, logger=None):
+        """
+        裁剪模式下 image1 / mask 对应的裁剪框：蒙版与 image1 分辨率不同时不裁剪（整图上传），
+        image1 为多张的批次时报错（只上传、贴回第一张会静默丢弃其余图片）
+        return: 同 _mask_crop_box
+        """
+        if image1.ndim == 4 and image1.shape[0] > 1:
+            raise ValueError(f"crop_to_mask edits a single image, but image1 is a batch of {image1.shape[0]}")
+        mask_np = (mask[0] if mask.ndim == 3 else mask).cpu().numpy()
+        if mask_np.shape != tuple(image1.shape[-3:-1]):
+            if logger is not None:
+                logger.warning(f"Crop-to-mask skipped: mask is {mask_np.shape[1]}x{mask_np.shape[0]}, "
+                               f"image1 is {image1.shape[-2]}x{image1.shape[-3]}")
+            return None
+        return cls._mask_crop_box(mask_np, padding, model)
+
+    @staticmethod
+    def _feather_alpha(mask_crop, feather):
+        """蒙版向外扩展 feather 像素后做高斯模糊，得到贴回时的混合权重（蒙版外远处为 0）"""
+        import numpy as np
+        from PIL import Image, ImageFilter
+
+        alpha = Image.fromarray((np.clip(mask_crop, 0, 1) * 255).astype(np.uint8), mode="L")
+        if feather > 0:
+            alpha = alpha.filter(ImageFilter.MaxFilter(feather // 2 * 2 + 1))
+            alpha = alpha.filter(ImageFilter.GaussianBlur(feather / 2))
+        return np.asarray(alpha, dtype=np.float32)[..., None] / 255.0
+
+    @staticmethod
+    def _composite(frame, edited, box, alpha):
+        """把裁剪区域的编辑结果缩放回原尺寸并按 alpha 贴回，alpha 为 0 的像素与原图逐位一致"""
+        import numpy as np
+        from PIL import Image
+
+        left, top, right, bottom = box
+        edited = Image.fromarray(edited).resize((right - left, bottom - top), Image.LANCZOS)
+        patch = np.asarray(edited, dtype=np.float32) / 255.0
+        result = frame.copy()
+        region = result[top:bottom, left:right]
+        blended = region * (1.0 - alpha) + patch * alpha
+        result[top:bottom, left:right] = np.where(alpha > 0, blended, region)
+        return result
 
     # ---------- 主功能 ----------
     def edit(self, prompt: str, image1: torch.Tensor, image2: torch.Tensor = None, 
              image3: torch.Tensor = None, image4: torch.Tensor = None, mask: torch.Tensor = None,
              model: str = "gpt-image-1", background: str = "auto", n: int = 1,
              output_format: str = "png", output_compression: int = 100,
-             quality: str = "auto", size: str = "auto"):
+             quality: str = "auto", size: str = "auto", crop_to_mask: bool = False,
+             crop_padding: int = 64, feather: int = 16, response_format: str = "b64_json",
+             partial_images: int = 0):
         """根据 prompt 和参考图片调用 API 生成新图片。"""
+        # torch / openai / 解码依赖在首次执行时才导入，注册节点时不加载
+        import torch
+        from .gpt_images import call_with_format, collect_stream, decode_items, sink_saver
+
         try:
             # 收集所有有效的图像输入
             images = [img for img in [image1, image2, image3, image4] if img is not None]
             if not images:
                 raise ValueError("At least one image must be provided.")
 
+            # 裁剪模式：与 image1 同尺寸的图片和蒙版只上传蒙版所在区域
+            crop = None
+            if crop_to_mask and mask is not None:
+                crop = self._crop_for(image1, mask, max(crop_padding, feather), model, self.logger)
+            if crop is not None:
+                (left, top, right, bottom), target = crop
+                frame_hw = tuple(image1.shape[-3:-1])
+                images = [img[..., top:bottom, left:right, :] if tuple(img.shape[-3:-1]) == frame_hw else img
+                          for img in images]
+                mask = mask[..., top:bottom, left:right]
+                if model == "gpt-image-1" and size == "auto":
+                    size = f"{target[0]}x{target[1]}"
+                self.logger.info(f"Crop-to-mask: uploading {right - left}x{bottom - top} of "
+                                 f"{frame_hw[1]}x{frame_hw[0]}, size={size}")
+
             # 将 Tensor 转换为 BytesIO 对象列表
             image_files = [self._tensor_to_bytesio(img) for img in images]
 
@@ -149,22 +271,32 @@ class GPTImageEditNode:
                     "size": size,
                 })
 
+            # 启用 [OUTPUT_SINK] 时原始返回字节（不重新编码）连同参数在后台写入磁盘
+            on_bytes = sink_saver("edit", prompt=prompt, model=model, size=size, quality=quality,
+                                  output_format=output_format, crop=list(crop[0]) if crop is not None else None)
+
             # 调用 API
-            response = self.client.images.edit(**kwargs)
+            if partial_images > 0:
+                stream = self.client.images.edit(stream=True, partial_images=partial_images, **kwargs)
+                images = collect_stream(stream, partial_images, on_progress=ComfyProgressReporter(),
+                                        on_bytes=on_bytes)
+            else:
+                response = call_with_format(self.client.images.edit, kwargs, response_format, self.logger)
+                if not response or not response.data:
+                    raise RuntimeError("Empty response from the image editing API")
+                images = decode_items(response.data, on_bytes=on_bytes)
 
-            if not response or not response.data:
-                raise RuntimeError("Empty response from the image editing API")
+            if crop is not None:
+                frame = image1[0, ..., :3].cpu().numpy()
+                alpha = self._feather_alpha((mask[0] if mask.ndim == 3 else mask).cpu().numpy(), feather)
 
-            # 处理返回的 base64 数据
+            # 解码返回的图片（URL 并发下载 / base64）
             tensors = []
-            for item in response.data:
-                b64_data = item.b64_json
-                if not b64_data:
-                    raise RuntimeError("No base64 image data in response")
-
-                image_bytes = base64.b64decode(b64_data)
-                img = Image.open(BytesIO(image_bytes)).convert("RGB")
-                img_np = np.array(img)
+            for img_np in images:
+                if crop is not None:
+                    # 羽化贴回原始分辨率的 image1
+                    tensors.append(torch.from_numpy(self._composite(frame, img_np, crop[0], alpha)))
+                    continue
 
                 # 转换为 ComfyUI 需要的 Tensor 格式
                 tensor = torch.from_numpy(img_np).float() / 255.0
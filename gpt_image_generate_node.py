@@ -1,12 +1,6 @@
-import torch
-import base64
-import numpy as np
-from PIL import Image
-from io import BytesIO
+import logging
 
-from openai import OpenAI
-
-from .utils import load_config, init_logger
+from .progress import ComfyProgressReporter
 
 
 class GPTImageGenerateNode:
@@ -19,30 +13,20 @@ class GPTImageGenerateNode:
     """
 
     def __init__(self):
-        self.logger = init_logger()
-        config = load_config()
-        # 优先读取 GPT_IMAGE_API
-        if config.has_section('GPT_IMAGE_API'):
-            api_section = config['GPT_IMAGE_API']
-        else:
-            api_section = {}
-
-        self.api_key = api_section.get('api_key')
-        base_url_root = api_section.get('api_url', 'https://yunwu.ai').rstrip('/')
-        # GPT-Image-1 端点位于 /v1
-        self.base_url = f"{base_url_root}/v1"
-        if not self.api_key:
-            raise ValueError("API key not found in config.ini under [GPT_IMAGE_API] section")
-
-        # 延迟初始化，避免在导入阶段占用资源
-        self._client = None
+        from .gpt_client import get_gpt_settings
+
+        # 配置在进程内只读取一次（缺少 api_key 时在这里报错）；客户端由所有 GPT 节点共享
+        get_gpt_settings()
+        self.logger = logging.getLogger(__name__)
+        # 为 None 时使用 config.ini 中的端点 / 密钥；benchmark 等把节点指向 mock relay 时覆盖
+        self.base_url = None
+        self.api_key = None
 
     @property
     def client(self):
-        if self._client is None:
-            # 在首次调用时创建 OpenAI 客户端
-            self._client = OpenAI(base_url=self.base_url, api_key=self.api_key)
-        return self._client
+        from .gpt_client import get_gpt_client
+
+        return get_gpt_client(self.api_key, self.base_url)
 
     # ---------- ComfyUI 接口定义 ----------
     @classmethod
@@ -60,6 +44,10 @@ class GPTImageGenerateNode:
                 "output_compression": ("INT", {"default": 100, "min": 0, "max": 100, "step": 1}),
                 "quality": (["auto", "high", "medium", "low"], {"default": "auto"}),
                 "size": (["auto", "1024x1024", "1536x1024", "1024x1536"], {"default": "auto"}),
+                # url: 请求图片 URL 并并发流式下载（中转支持时，传输量更小）；不支持时自动退回 b64_json
+                "response_format": (["b64_json", "url"], {"default": "b64_json"}),
+                # 流式返回的中间图数量（0 表示不使用流式），中间图实时显示在节点上，可尽早中断
+                "partial_images": ("INT", {"default": 0, "min": 0, "max": 3, "step": 1}),
             }
         }
 
@@ -69,8 +57,12 @@ class GPTImageGenerateNode:
 
     # ---------- 主功能 ----------
     def generate(self, prompt: str, model="gpt-image-1", background="auto", moderation="auto", n: int = 1,
-                output_format="png", output_compression: int = 100, quality="auto", size="auto"):
+                output_format="png", output_compression: int = 100, quality="auto", size="auto",
+                response_format="b64_json", partial_images: int = 0):
         """根据 prompt 调用 GPT-Image-1 生成图片。"""
+        import torch
+        from .gpt_images import call_with_format, collect_stream, decode_items, sink_saver
+
         try:
             # 组装调用参数（只传递用户显式设置或与默认不同的参数）
             kwargs = {
@@ -90,20 +82,21 @@ class GPTImageGenerateNode:
                     "size": size,
                 })
 
-            response = self.client.images.generate(**kwargs)
-            if not response or not response.data:
-                raise RuntimeError("Empty response from GPT-Image-1 API")
+            # 启用 [OUTPUT_SINK] 时原始返回字节（不重新编码）连同参数在后台写入磁盘
+            on_bytes = sink_saver("generate", prompt=prompt, model=model, size=size, quality=quality,
+                                  output_format=output_format)
+            if partial_images > 0:
+                stream = self.client.images.generate(stream=True, partial_images=partial_images, **kwargs)
+                images = collect_stream(stream, partial_images, on_progress=ComfyProgressReporter(),
+                                        on_bytes=on_bytes)
+            else:
+                response = call_with_format(self.client.images.generate, kwargs, response_format, self.logger)
+                if not response or not response.data:
+                    raise RuntimeError("Empty response from GPT-Image-1 API")
+                images = decode_items(response.data, on_bytes=on_bytes)
 
             tensors = []
-            for item in response.data:
-                b64_data = item.b64_json
-                if not b64_data:
-                    raise RuntimeError("Missing base64 image in response item")
-
-                image_bytes = base64.b64decode(b64_data)
-                img = Image.open(BytesIO(image_bytes)).convert("RGB")
-                img_np = np.array(img)
-
+            for img_np in images:
                 tensor = torch.from_numpy(img_np).float() / 255.0  # HWC
                 tensors.append(tensor)
 
@@ -0,0 +1,165 @@
+""" GPT-Image 响应解码：URL 结果经共享连接池并发下载、下载完一张即在解码池中解码（与其余下载重叠），
+b64_json 作为后备；流式（SSE）中间图预览 """
+import asyncio
+import base64
+import logging
+import time
+import uuid
+from io import BytesIO
+
+import aiohttp
+import numpy as np
+from PIL import Image
+
+from .connections import client_session, run_sync
+from .decode_pool import get_decode_pool
+
+try:
+    # 运行在 ComfyUI 中时，用于感知用户点击的“中断”
+    import comfy.model_management as comfy_mm
+except ImportError:
+    comfy_mm = None
+
+logger = logging.getLogger(__name__)
+
+# 同一次调用中同时进行的下载数上限（连接来自共享的 api 连接池，跨调用复用）
+MAX_DOWNLOADS = 8
+
+
+def decode_rgb(image_bytes):
+    """原始压缩字节 → np.ndarray（HWC, uint8, RGB），在解码池中运行"""
+    return np.array(Image.open(BytesIO(image_bytes)).convert("RGB"))
+
+
+def decode_b64(b64_data):
+    return decode_rgb(base64.b64decode(b64_data))
+
+
+async def _fetch(session, url):
+    """下载一张图的原始字节"""
+    async with session.get(url) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+async def _decode_items_async(items, on_bytes=None):
+    timeout = aiohttp.ClientTimeout(total=300, connect=30, sock_read=60)
+    semaphore = asyncio.Semaphore(MAX_DOWNLOADS)
+    decode_pool = get_decode_pool()
+    # 结果图 URL 可能来自任意中转主机：使用校验证书的 api 连接池（只有 Discord CDN 的下载不校验）
+    async with client_session("api", timeout=timeout) as session:
+
+        async def _decode(index, item):
+            url = getattr(item, "url", None)
+            if url:
+                async with semaphore:
+                    data = await _fetch(session, url)
+                if on_bytes is not None:
+                    # 结果写入器队列满时 on_bytes 会阻塞，放到线程中等待，不占用事件循环
+                    await asyncio.get_running_loop().run_in_executor(None, on_bytes, index, data)
+                # 解码不占用事件循环，其他图片的下载继续进行
+                return await decode_pool.run(decode_rgb, data)
+            if on_bytes is not None:
+                await asyncio.get_running_loop().run_in_executor(None, on_bytes, index,
+                                                                 base64.b64decode(item.b64_json))
+            return await decode_pool.run(decode_b64, item.b64_json)
+
+        return await asyncio.gather(*(_decode(index, item) for index, item in enumerate(items)))
+
+
+def decode_items(items, on_bytes=None):
+    """
+    按原顺序把响应中的图片解码为 np.ndarray（HWC, uint8, RGB）
+    有 url 的项并发下载（中转返回 URL 时），其余使用 b64_json
+    on_bytes: 可选回调 on_bytes(index, data)，data 为图片的原始压缩字节（用于结果落盘）
+    """
+    for item in items:
+        if not getattr(item, "url", None) and not getattr(item, "b64_json", None):
+            raise RuntimeError("Missing image (url / b64_json) in response item")
+    if not any(getattr(item, "url", None) for item in items):
+        images = []
+        for index, item in enumerate(items):
+            if on_bytes is not None:
+                on_bytes(index, base64.b64decode(item.b64_json))
+            images.append(decode_b64(item.b64_json))
+        return images
+    # 在共享循环上运行：不创建 / 关闭节点线程的事件循环，也可以在已有运行中循环的线程里调用
+    return list(run_sync(_decode_items_async(items, on_bytes)))
+
+
+def sink_saver(route, **fields):
+    """
+    启用结果落盘（[OUTPUT_SINK]）时返回 on_bytes 回调：每张图的原始字节连同 fields（提示词、参数）排队写入，
+    未启用时返回 None
+    """
+    from .output_sink import get_output_sink
+
+    sink = get_output_sink()
+    if sink is None:
+        return None
+    started = time.time()
+    batch = f"gpt-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+    def on_bytes(index, data):
+        record = {"kind": "gpt", "route": route, "index": index, "submitted_at": round(started, 3),
+                  "elapsed_s": round(time.time() - started, 3)}
+        record.update((k, v) for k, v in fields.items() if v is not None)
+        sink.submit(data, f"{batch}-{index}", record)
+
+    return on_bytes
+
+
+def call_with_format(api_call, kwargs, response_format, logger=logger):
+    """
+    response_format 为 url 时请求 URL 结果；中转不支持该参数（HTTP 400 且错误指向 response_format）时
+    退回 b64_json 重新请求。其他 400（内容审核、提示词无效等）直接抛出，不重复发起计费请求
+    """
+    if response_format != "url":
+        return api_call(**kwargs)
+    from openai import BadRequestError
+
+    try:
+        return api_call(response_format="url", **kwargs)
+    except BadRequestError as e:
+        if getattr(e, "param", None) != "response_format" and "response_format" not in str(e):
+            raise
+        logger.warning(f"response_format=url not supported by the relay ({e}), falling back to b64_json")
+        for value in kwargs.values():
+            # 上传的 BytesIO 已被读取过，重试前复位
+            for f in value if isinstance(value, list) else [value]:
+                if isinstance(f, BytesIO):
+                    f.seek(0)
+        return api_call(**kwargs)
+
+
+def collect_stream(stream, partial_images=0, on_progress=None, on_bytes=None):
+    """
+    消费流式响应（stream=True, partial_images>0）：partial_image 事件解码后作为预览推送给
+    on_progress(task_id, progress, preview)，completed 事件收集为最终结果
+    on_bytes: 同 decode_items，completed 图片的原始压缩字节
+    ComfyUI 中断时关闭连接并抛出中断异常
+    return: List[np.ndarray]
+    """
+    images = []
+    try:
+        for event in stream:
+            if comfy_mm is not None and comfy_mm.processing_interrupted():
+                stream.close()
+                comfy_mm.throw_exception_if_processing_interrupted()
+            event_type = getattr(event, "type", "")
+            if event_type.endswith(".partial_image"):
+                if on_progress is not None:
+                    preview = Image.open(BytesIO(base64.b64decode(event.b64_json))).convert("RGB")
+                    progress = int((event.partial_image_index + 1) * 100 / (partial_images + 1))
+                    on_progress("gpt-image", progress, preview)
+            elif event_type.endswith(".completed"):
+                if on_bytes is not None:
+                    on_bytes(len(images), base64.b64decode(event.b64_json))
+                images.append(decode_b64(event.b64_json))
+                if on_progress is not None:
+                    on_progress("gpt-image", 100, None)
+    finally:
+        stream.close()
+    if not images:
+        raise RuntimeError("Image stream ended without a completed image")
+    return images
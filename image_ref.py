@@ -0,0 +1,141 @@
+""" Midjourney 结果图的惰性引用（ComfyUI 类型 MJ_IMAGE_REF）
+
+节点只返回 task_id + 图片 URL，下游真正需要像素时（Midjourney Load Image 节点）才下载解码；
+prefetch 模式在共享事件循环（connections.io_loop）上提前开始下载，不阻塞节点返回，
+下载复用节点作业与预热建立的连接池。
+引用同时缓存原始压缩字节，Blend 复用上一步结果时直接上传原图，不必解码再重新编码。
+"""
+import asyncio
+import threading
+
+# 结果图获取方式：download 立即下载（原行为）、lazy 用到时再下载、prefetch 后台预取
+IMAGE_MODES = ["download", "lazy", "prefetch"]
+
+# 未下载结果图时 IMAGE 输出的占位图边长（下游节点总能拿到 [B, H, W, C] 张量）
+PLACEHOLDER_SIDE = 64
+
+
+def to_image_tensor(image):
+    """
+    HWC uint8 数组转为 ComfyUI 的 IMAGE 张量（[1, H, W, C]，0~1）
+    image 为 None（lazy / prefetch / 不下载）时返回 64x64 的黑色占位图，保持 IMAGE 输出的类型约定
+    """
+    import torch
+
+    if image is None:
+        return torch.zeros((1, PLACEHOLDER_SIDE, PLACEHOLDER_SIDE, 3), dtype=torch.float32)
+    return (torch.from_numpy(image).float() / 255.0).unsqueeze(0)
+
+
+class MJImageRef:
+    """
+    Args:
+        client (MJClient): 用于下载的客户端（沿用其代理与下载策略）
+        task_id (str): 产生该图片的任务
+        url (str): 结果图 URL
+        data (bytes): 已下载的原始压缩字节，没有时为 None
+        max_side (int): 大于 0 时按该长边上限下载（CDN 支持时取缩小版本）与解码，0 表示原图
+    """
+
+    def __init__(self, client, task_id, url, data=None, max_side=0):
+        self.client = client
+        self.task_id = task_id
+        self.url = url
+        self.max_side = max_side
+        self._data = data
+        self._image = None
+        self._future = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        if self._image is not None or self._data is not None:
+            state = "loaded"
+        else:
+            state = "fetching" if self._future else "lazy"
+        return f"MJImageRef(task_id={self.task_id!r}, {state})"
+
+    @property
+    def image(self):
+        """已解码的图像，尚未下载时为 None（不会触发下载）"""
+        with self._lock:
+            if self._image is None and self._data is not None:
+                pixels = getattr(self.client, "pixels", None)
+                key = f"{self.url}|{self.max_side}"
+                if pixels is not None:
+                    # 像素缓存命中时内存映射打开，不解码
+                    self._image = pixels.lookup(key)
+                if self._image is None:
+                    self._image = self.client._decode_cached(key, self._data, self.max_side)
+            return self._image
+
+    @property
+    def data(self):
+        """已下载的压缩字节（max_side 大于 0 时可能是缩小版本），尚未下载时为 None"""
+        return self._data
+
+    def _start(self):
+        # 调用方持有 self._lock；下载在共享循环上运行（aiohttp 在首次下载时才导入）
+        if self._future is None:
+            if not self.url:
+                raise ValueError(f"Task {self.task_id} has no image URL")
+            from .connections import io_loop
+
+            self._future = asyncio.run_coroutine_threadsafe(
+                self.client.download_task_image(self.task_id, self.url, raw=True, max_side=self.max_side),
+                io_loop())
+        return self._future
+
+    def prefetch(self):
+        """在后台开始下载，立即返回"""
+        with self._lock:
+            if self._data is None:
+                self._start()
+        return self
+
+    def _failed(self, future):
+        with self._lock:
+            # 下载失败或被取消时允许下一次调用重试
+            if self._future is future:
+                self._future = None
+
+    def _store(self, data):
+        with self._lock:
+            self._data = data
+        return data
+
+    def load_bytes(self):
+        """返回原始压缩字节，多次调用只下载一次（不能在共享循环内调用，协程中使用 load_bytes_async）"""
+        from .connections import io_loop
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is io_loop():
+            raise RuntimeError("MJImageRef.load_bytes() would block the shared I/O loop, use load_bytes_async()")
+        with self._lock:
+            if self._data is not None:
+                return self._data
+            future = self._start()
+        try:
+            return self._store(future.result())
+        except BaseException:
+            self._failed(future)
+            raise
+
+    async def load_bytes_async(self):
+        """load_bytes 的协程版本，等待下载时不阻塞事件循环"""
+        with self._lock:
+            if self._data is not None:
+                return self._data
+            future = self._start()
+        try:
+            return self._store(await asyncio.wrap_future(future))
+        except BaseException:
+            self._failed(future)
+            raise
+
+    def load(self):
+        """返回解码后的图像（np.ndarray, HWC），多次调用只下载一次"""
+        self.load_bytes()
+        return self.image
@@ -0,0 +1,91 @@
+""" 导入耗时检查：按 ComfyUI 加载自定义节点的方式（spec_from_file_location）在子进程中导入本包，
+用 python -X importtime 统计耗时，超出预算或加载了重量级依赖时返回非 0
+
+注册节点不应加载 torch / numpy / PIL / aiohttp / openai，也不应读取配置、创建客户端，
+这些都放到节点首次执行时。
+
+    python -m <package>.import_benchmark --budget-ms 100 --runs 5
+    python -m <package>.import_benchmark --preload asyncio   # 模拟 ComfyUI 已导入的模块
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ("torch", "numpy", "PIL", "aiohttp", "openai")
+# 子进程在预加载完成后输出该标记，之后的 importtime 记录才属于本包
+_MARKER = "-- package import --"
+
+_LOADER = """
+import importlib.util, sys, time
+for name in {preload!r}:
+    __import__(name)
+sys.stderr.write({marker!r} + "\\n")
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location({name!r}, {init!r}, submodule_search_locations=[{path!r}])
+module = importlib.util.module_from_spec(spec)
+sys.modules[{name!r}] = module
+spec.loader.exec_module(module)
+print(int((time.perf_counter() - started) * 1e6), len(module.NODE_CLASS_MAPPINGS))
+"""
+
+
+def _parse_importtime(stderr):
+    """解析 -X importtime 输出，返回 [(模块名, self_us, cumulative_us)]"""
+    rows = []
+    if _MARKER in stderr:
+        stderr = stderr.split(_MARKER, 1)[1]
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure(package_dir, name="mj_nodes", preload=()):
+    """在新的解释器中导入一次，返回 (总耗时 us, 导入的重量级模块, 最慢的模块, 注册的节点数)
+    总耗时含 -X importtime 自身的开销，比实际略大"""
+    code = _LOADER.format(preload=list(preload), marker=_MARKER, name=name, init=os.path.join(package_dir, "__init__.py"),
+                          path=package_dir)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, check=True)
+    rows = _parse_importtime(proc.stderr)
+    total_us, nodes = (int(v) for v in proc.stdout.split())
+    heavy = sorted({row[0].split(".")[0] for row in rows if row[0].split(".")[0] in HEAVY_MODULES})
+    slowest = sorted(rows, key=lambda row: row[1], reverse=True)[:10]
+    return total_us, heavy, slowest, nodes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the import time of this ComfyUI node package")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="median import time budget")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--preload", default="",
+                        help="comma separated modules imported before the package (what the host already loaded)")
+    args = parser.parse_args(argv)
+
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    preload = [m.strip() for m in args.preload.split(",") if m.strip()]
+    results = [measure(package_dir, preload=preload) for _ in range(args.runs)]
+    median_ms = statistics.median(r[0] for r in results) / 1000
+    heavy = sorted({m for r in results for m in r[1]})
+    report = {
+        "median_ms": round(median_ms, 2),
+        "budget_ms": args.budget_ms,
+        "nodes": results[0][3],
+        "heavy_modules": heavy,
+        "slowest_self_ms": {row[0]: round(row[1] / 1000, 2) for row in results[-1][2]},
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if heavy:
+        print(f"[import] heavy modules imported at registration: {', '.join(heavy)}", file=sys.stderr)
+    if median_ms > args.budget_ms:
+        print(f"[import] {median_ms:.1f} ms exceeds the budget of {args.budget_ms:.1f} ms", file=sys.stderr)
+    return 1 if heavy or median_ms > args.budget_ms else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,7 @@
-import torch
-import asyncio
-from .api_client import MJClient
+from .progress import ComfyProgressReporter
 
 
 class MidjourneyActionNode:
-    def __init__(self):
-        self.api_client = MJClient()
-
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -15,6 +10,14 @@ class MidjourneyActionNode:
                 "action": (["U1", "U2", "U3", "U4", "V1", "V2", "V3", "V4"], {"default": "U1"}),
                 "app_key": ("STRING", {"default": "input your app key"}),   
 
+            },
+            "optional": {
+                # 作业超时（秒），0 表示不限制
+                "deadline": ("INT", {"default": 0, "min": 0, "max": 3600, "step": 10}),
+                # 生成过程中拉取中间预览图并显示在节点上
+                "live_preview": ("BOOLEAN", {"default": False}),
+                "priority": (["interactive", "normal", "bulk"], {"default": "interactive"}),
+                "max_side": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64}),
             }
         }
 
@@ -22,19 +25,24 @@ class MidjourneyActionNode:
     FUNCTION = "upscale_or_vary"
     CATEGORY = "image"
 
-    def upscale_or_vary(self, task_id, action, app_key):
-        try:
-            self.api_client.api_key = app_key
+    def upscale_or_vary(self, task_id, action, app_key, deadline=0, live_preview=False, priority="interactive",
+                        max_side=0):
+        import torch
+        from .api_client import get_client
+        from .connections import run_sync
 
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
+        try:
+            api_client = get_client(app_key)
 
             # 直接获取结果图片
-            result_image = loop.run_until_complete(
-                self.api_client.upscale_or_vary(task_id, action)
+            result_image = run_sync(
+                api_client.run_job(
+                    api_client.upscale_or_vary(task_id, action, on_progress=ComfyProgressReporter(),
+                                                    preview=live_preview),
+                    deadline=deadline,
+                    priority=priority,
+                    max_side=max_side,
+                )
             )
 
             # 转换图像格式
@@ -49,15 +57,20 @@ class MidjourneyActionNode:
 
 
 class MidjourneyBatchActionNode:
-    def __init__(self):
-        self.api_client = MJClient()
-    
     @classmethod
     def INPUT_TYPES(cls):
         return {
             "required": {
                 "task_id": ("STRING", {"multiline": False}),
                 "batch_actions": (["U1-U4", "V1-V4"], {"default": "U1-U4"}),
+                "app_key": ("STRING", {"default": "input your app key"}),
+            },
+            "optional": {
+                # 作业超时（秒），0 表示不限制
+                "deadline": ("INT", {"default": 0, "min": 0, "max": 3600, "step": 10}),
+                "live_preview": ("BOOLEAN", {"default": False}),
+                "priority": (["interactive", "normal", "bulk"], {"default": "interactive"}),
+                "max_side": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64}),
             }
         }
     
@@ -66,14 +79,14 @@ class MidjourneyBatchActionNode:
     FUNCTION = "batch_process"
     CATEGORY = "MidjourneyHub"
 
-    def batch_process(self, task_id, batch_actions):
+    def batch_process(self, task_id, batch_actions, app_key, deadline=0, live_preview=False,
+                      priority="interactive", max_side=0):
+        import torch
+        from .api_client import get_client
+        from .connections import run_sync
+
         try:
-            # 获取或创建事件循环
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop()
+            api_client = get_client(app_key)
 
             # 确定要执行的操作
             if batch_actions == "U1-U4":
@@ -82,8 +95,15 @@ class MidjourneyBatchActionNode:
                 actions = ["V1", "V2", "V3", "V4"]
 
             # 异步调用
-            results = loop.run_until_complete(
-                self.api_client.batch_upscale_or_vary(task_id, actions)
+            results = run_sync(
+                api_client.run_job(
+                    api_client.batch_upscale_or_vary(
+                        task_id, actions, on_progress=ComfyProgressReporter(expected_tasks=len(actions)),
+                        preview=live_preview),
+                    deadline=deadline,
+                    priority=priority,
+                    max_side=max_side,
+                )
             )
             
             # 处理结果(如果返回的数量不足 actions 的长度，用 None 补足)
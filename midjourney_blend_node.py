@@ -1,121 +1,163 @@
-import torch
-import asyncio
-import base64
+from functools import partial
 from io import BytesIO
-from PIL import Image
-import numpy as np
 import time
 
-from .api_client import MJClient
+from .image_ref import IMAGE_MODES, to_image_tensor
+from .midjourney_imagine_node import MidjourneyImagineNode
+from .progress import ComfyProgressReporter
 
 
 class MidjourneyBlendNode:
     """ComfyUI 自定义节点：将两张图片上传至 Midjourney Blend 接口进行融合。
 
-    输入：
-        image1, image2: IMAGE 类型（Tensor），数值范围 0~1，shape 支持 (B,H,W,C) / (H,W,C) / (C,H,W)。
-
     可选：
+        image1, image2: IMAGE 类型（Tensor），数值范围 0~1，shape 支持 (B,H,W,C) / (H,W,C) / (C,H,W)；
+                     接了 image_ref 或填写了 source 的一侧可以不接
         dimensions: 图片比例，PORTRAIT / SQUARE / LANDSCAPE
         bot_type:    机器人类型，MID_JOURNEY / NIJI_JOURNEY
         quality:     画质，可传 "hd" 或留空
         seed:        随机种子，用于避免缓存
+        deadline:    作业超时（秒），0 表示不限制；超时或中断时停止轮询并取消远端任务
+        live_preview: 生成过程中拉取中间预览图并显示在节点上
+        priority:    调度优先级，interactive / normal / bulk
+        image_mode:  download 立即下载结果图；lazy / prefetch 只输出 image_ref（prefetch 在后台预取），
+                     接 Midjourney Load Image 时才下载
+        max_side:    结果图长边上限（像素），0 为原图
+        image_ref1, image_ref2: 上游 Imagine / Blend 节点输出的 image_ref，接入时代替对应的 image，
+                     直接复用原图，不解码再编码
+        source1, source2: 已完成的 Midjourney task_id 或图片 URL，填写时代替对应的 image
+        （每张图的优先级 image_ref > source > image，三者都没有时报错）
+        app_key:     中转密钥，与其他 Midjourney 节点相同；留空时与旧版一样不带密钥请求
 
     输出：
-        融合后的图片、任务 ID、操作按钮字典。
+        融合后的图片（lazy / prefetch 时为 64x64 占位图）、任务 ID、操作按钮字典、结果图引用。
     """
 
-    def __init__(self):
-        self.api_client = MJClient()
-
     # ---------- ComfyUI 接口定义 ----------
     @classmethod
     def INPUT_TYPES(cls):
         return {
-            "required": {
+            "required": {},
+            "optional": {
+                # IMAGE 是连线输入而非控件，改为可选不影响已保存工作流的控件值顺序
                 "image1": ("IMAGE",),
                 "image2": ("IMAGE",),
-            },
-            "optional": {
                 "dimensions": (["PORTRAIT", "SQUARE", "LANDSCAPE"], {"default": "SQUARE"}),
                 "bot_type": (["MID_JOURNEY", "NIJI_JOURNEY"], {"default": "MID_JOURNEY"}),
                 "quality": ("STRING", {"default": ""}),
                 "seed": ("INT", {"default": -1, "min": -1, "max": 2**31-1, "step": 1}),
+                "deadline": ("INT", {"default": 0, "min": 0, "max": 3600, "step": 10}),
+                "live_preview": ("BOOLEAN", {"default": False}),
+                "priority": (["interactive", "normal", "bulk"], {"default": "interactive"}),
+                "max_side": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64}),
+                "image_mode": (IMAGE_MODES, {"default": "download"}),
+                # 新增输入放在最后，已保存工作流的控件值顺序不变
+                "image_ref1": ("MJ_IMAGE_REF",),
+                "image_ref2": ("MJ_IMAGE_REF",),
+                "source1": ("STRING", {"default": ""}),
+                "source2": ("STRING", {"default": ""}),
+                "app_key": ("STRING", {"default": ""}),
             },
         }
 
-    RETURN_TYPES = ("IMAGE", "STRING", "DICT")
-    RETURN_NAMES = ("image", "task_id", "buttons")
+    RETURN_TYPES = ("IMAGE", "STRING", "DICT", "MJ_IMAGE_REF")
+    RETURN_NAMES = ("image", "task_id", "buttons", "image_ref")
     FUNCTION = "blend_images"
     CATEGORY = "image"
 
     # ---------- 辅助函数 ----------
     @staticmethod
-    def _tensor_to_base64(img_tensor):
-        """将 ComfyUI 的图像 Tensor 转换为 base64 字符串 (data:image/png;base64,XXX)"""
+    def _tensor_to_png(img_tensor):
+        """将 ComfyUI 的图像 Tensor 编码为 PNG 字节（base64 在上传时分块编码），相同内容命中编码缓存"""
+        import numpy as np
+        from PIL import Image
+        from .encode_cache import get_encode_cache
+
         # 移除 batch 维
         if img_tensor.ndim == 4:
             img_tensor = img_tensor[0]
 
-        # 处理 CHW -> HWC
-        if img_tensor.shape[0] in (1, 3) and img_tensor.shape[0] < 10:  # 简单判断 C 在前
-            img_tensor = img_tensor.permute(1, 2, 0)
+        def _encode():
+            tensor = img_tensor
+            # 处理 CHW -> HWC
+            if tensor.shape[0] in (1, 3) and tensor.shape[0] < 10:  # 简单判断 C 在前
+                tensor = tensor.permute(1, 2, 0)
 
-        # 转换为 numpy，并将 0~1 float 转换成 0~255 uint8
-        img_np = (img_tensor.cpu().numpy() * 255.0).clip(0, 255).astype(np.uint8)
-        img_pil = Image.fromarray(img_np)
+            # 转换为 numpy，并将 0~1 float 转换成 0~255 uint8
+            img_np = (tensor.cpu().numpy() * 255.0).clip(0, 255).astype(np.uint8)
+            img_pil = Image.fromarray(img_np)
 
-        buffer = BytesIO()
-        img_pil.save(buffer, format="PNG")
-        base64_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-        return f"data:image/png;base64,{base64_str}"
+            buffer = BytesIO()
+            img_pil.save(buffer, format="PNG")
+            return buffer.getvalue()
+
+        return get_encode_cache().get_or_encode(img_tensor, "blend-png", _encode)
+
+    @classmethod
+    def _blend_input(cls, image, image_ref, source, index):
+        """
+        按 image_ref > source > image 的顺序选择一张输入。Tensor 返回编码函数，由 MJClient.blend 在线程中执行，
+        第一张编码完成即开始上传，第二张同时编码
+        """
+        if image_ref is not None:
+            return image_ref
+        if source and source.strip():
+            return source.strip()
+        if image is not None:
+            return partial(cls._tensor_to_png, image)
+        raise ValueError(f"Blend input {index} is missing: connect image{index}, image_ref{index} or set source{index}")
 
     # ---------- 主功能 ----------
-    def blend_images(self, image1, image2, dimensions="SQUARE", bot_type="MID_JOURNEY", quality="", seed=-1):
+    def blend_images(self, image1=None, image2=None, dimensions="SQUARE", bot_type="MID_JOURNEY", quality="",
+                     seed=-1, deadline=0, live_preview=False, priority="interactive", image_mode="download",
+                     max_side=0, image_ref1=None, image_ref2=None, source1="", source2="", app_key=""):
+        from .api_client import get_client
+        from .connections import run_sync
+
         try:
+            app_key = app_key.strip()
+            if app_key:
+                MidjourneyImagineNode.check_app_key(app_key)
+            api_client = get_client(app_key)
+
             # 计算唯一 state，以避免后端将相同参数视为重复任务
             if seed == -1:
                 state_val = str(int(time.time() * 1000))  # 毫秒时间戳
             else:
                 state_val = str(seed)
 
-            # 准备 base64 输入
+            # 准备输入：Tensor 的 PNG 编码、引用 / task_id / URL 的处理都交给 MJClient.blend
             base64_images = [
-                self._tensor_to_base64(image1),
-                self._tensor_to_base64(image2),
+                self._blend_input(image1, image_ref1, source1, 1),
+                self._blend_input(image2, image_ref2, source2, 2),
             ]
 
-            # 获取或创建事件循环（在 ComfyUI 环境中经常已存在）
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
+            reporter = ComfyProgressReporter()
 
-            # 异步调用 blend 接口
-            task_id = loop.run_until_complete(
-                self.api_client.blend(
+            async def _blend_job():
+                # 异步调用 blend 接口
+                task_id = await api_client.blend(
                     base64_images=base64_images,
                     dimensions=dimensions,
                     bot_type=bot_type,
                     quality=quality if quality else None,
                     state=state_val,
                 )
-            )
-            
-            if not task_id:
-                raise ValueError("Failed to get task_id from Midjourney API (blend)")
 
-            # 轮询等待结果
-            image, task_id_fetched, buttons = loop.run_until_complete(
-                self.api_client.sync_mj_status(task_id=task_id)
-            )
+                if not task_id:
+                    raise ValueError("Failed to get task_id from Midjourney API (blend)")
+
+                # 轮询等待结果
+                return await api_client.sync_mj_ref(task_id=task_id, on_progress=reporter,
+                                                    preview=live_preview, image_mode=image_mode)
 
-            # 转换为 ComfyUI 需要的 Tensor 格式
-            img_tensor = torch.from_numpy(image).float() / 255.0  # HWC -> 0~1
-            img_tensor = img_tensor.unsqueeze(0)  # 添加 batch 维
+            image_ref, task_id_fetched, buttons = run_sync(
+                api_client.run_job(_blend_job(), deadline=deadline, priority=priority,
+                                   max_side=max_side)
+            )
 
-            return (img_tensor, task_id_fetched, buttons)
+            # 转换为 ComfyUI 需要的 Tensor 格式（lazy / prefetch 时为占位图）
+            return (to_image_tensor(image_ref.image), task_id_fetched, buttons, image_ref)
 
         except Exception as e:
             print(f"Error in MidjourneyBlendNode: {str(e)}")
@@ -1,12 +1,8 @@
-import torch
-from .api_client import MJClient
-import asyncio
+from .image_ref import IMAGE_MODES, to_image_tensor
+from .progress import ComfyProgressReporter
 
 
 class MidjourneyImagineNode:
-    def __init__(self):
-        self.api_client = MJClient()
-
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -28,6 +24,17 @@ class MidjourneyImagineNode:
                 "sw": ("INT", {"default": 30, "min": 0, "max": 100, "step": 1}),
                 "oref": ("STRING", {"default": ""}),
                 "ow": ("INT", {"default": 100, "min": 0, "max": 1000, "step": 10}), 
+                # 作业超时（秒），0 表示不限制；超时或中断时停止轮询并取消远端任务
+                "deadline": ("INT", {"default": 0, "min": 0, "max": 3600, "step": 10}),
+                # 生成过程中拉取中间预览图并显示在节点上
+                "live_preview": ("BOOLEAN", {"default": False}),
+                # 调度优先级：interactive 优先放行并使用 fast/turbo，bulk 使用 relax（需配置 [MIDJOURNEY_SCHEDULER]）
+                "priority": (["interactive", "normal", "bulk"], {"default": "interactive"}),
+                # 结果图长边上限（像素），0 为原图：下游只需要小图时优先下载 CDN 的缩小版本并缩小解码，
+                # 减少下载量、解码时间和 IMAGE 占用的内存
+                "max_side": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64}),
+                # 结果图获取方式：download 立即下载；lazy / prefetch 只输出 image_ref，接 Midjourney Load Image 时才下载
+                "image_mode": (IMAGE_MODES, {"default": "download"}),
                            
                 #"repeat": ("INT", {"default": 1, "min": 1, "max": 40, "step": 1}),
                 #"seed": ("INT", {"default": -1}),
@@ -35,69 +42,79 @@ class MidjourneyImagineNode:
             }
         }
 
-    RETURN_TYPES = ("IMAGE", "STRING", "DICT")
-    RETURN_NAMES = ("image", "task_id", "buttons")
+    RETURN_TYPES = ("IMAGE", "STRING", "DICT", "MJ_IMAGE_REF")
+    RETURN_NAMES = ("image", "task_id", "buttons", "image_ref")
     FUNCTION = "generate"
     CATEGORY = "image"
 
-    def generate(self, prompt, app_key, image_ratio="1:1",
-                stylize=100, chaos=0, weird=0, sref1="", sref2="", sw=30, oref="", ow=100):
-        try:
-            # 构建完整提示词
-            params = prompt
-            params += f" --ar {image_ratio} --s {stylize} "
+    @staticmethod
+    def build_prompt(prompt, image_ratio="1:1", stylize=100, chaos=0, weird=0,
+                     sref1="", sref2="", sw=30, oref="", ow=100):
+        """构建完整提示词"""
+        params = prompt
+        params += f" --ar {image_ratio} --s {stylize} "
 
-            if chaos > 0:
-                params += f" --c {chaos}"
+        if chaos > 0:
+            params += f" --c {chaos}"
 
-            if weird > 0:
-                params += f" --weird {weird}"
+        if weird > 0:
+            params += f" --weird {weird}"
 
-            if sref1 and len(sref1) > 1:
-                params += f" --sref {sref1}"
+        if sref1 and len(sref1) > 1:
+            params += f" --sref {sref1}"
 
-                if sref2 and len(sref2) > 1:
-                    params += f"  {sref2}"
+            if sref2 and len(sref2) > 1:
+                params += f"  {sref2}"
 
-                if sw > 0:
-                    params += f" --sw {sw}"
+            if sw > 0:
+                params += f" --sw {sw}"
 
-            if oref and len(oref) > 1:
-                params += f" --oref {oref}"
-                if ow > 0:
-                    params += f" --ow {ow}"
+        if oref and len(oref) > 1:
+            params += f" --oref {oref}"
+            if ow > 0:
+                params += f" --ow {ow}"
 
-            params += f" --v 7.0"
+        params += f" --v 7.0"
+        return params
 
-            if len(app_key) < 3 or  app_key == "input your app key":
-                raise ValueError("Invalid app key")
-            
-            self.api_client.api_key = app_key
+    @staticmethod
+    def check_app_key(app_key):
+        if len(app_key) < 3 or  app_key == "input your app key":
+            raise ValueError("Invalid app key")
+
+    def generate(self, prompt, app_key, image_ratio="1:1",
+                stylize=100, chaos=0, weird=0, sref1="", sref2="", sw=30, oref="", ow=100, deadline=0,
+                live_preview=False, priority="interactive", image_mode="download", max_side=0):
+        # 客户端在首次执行时才导入，注册节点时不加载（torch 由 to_image_tensor 按需导入）
+        from .api_client import get_client
+        from .connections import run_sync
+
+        try:
+            # 构建完整提示词
+            params = self.build_prompt(prompt, image_ratio, stylize, chaos, weird, sref1, sref2, sw, oref, ow)
+            self.check_app_key(app_key)
             
-            # 获取或创建事件循环
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-
-            # 异步执行 imagine
-            imagine_task_id = loop.run_until_complete(
-                self.api_client.imagine(text_prompt=params)
-            )
-            if not imagine_task_id:
-                raise ValueError("Failed to get task_id from Midjourney API")
+            # 按密钥取进程内共享的客户端，并发作业之间不会串用密钥
+            api_client = get_client(app_key)
 
-            # 异步等待结果
-            image, task_id, buttons = loop.run_until_complete(
-                self.api_client.sync_mj_status(task_id=imagine_task_id)
-            )
+            reporter = ComfyProgressReporter()
 
-            # 转换图像格式
-            img_tensor = torch.from_numpy(image).float() / 255.0
-            img_tensor = img_tensor.unsqueeze(0)  # Add batch dimension
+            async def _imagine_job():
+                # 异步执行 imagine
+                imagine_task_id = await api_client.imagine(text_prompt=params)
+                if not imagine_task_id:
+                    raise ValueError("Failed to get task_id from Midjourney API")
+
+                # 异步等待结果
+                return await api_client.sync_mj_ref(task_id=imagine_task_id, on_progress=reporter,
+                                                    preview=live_preview, image_mode=image_mode)
+
+            image_ref, task_id, buttons = run_sync(
+                api_client.run_job(_imagine_job(), deadline=deadline, priority=priority, max_side=max_side)
+            )
 
-            return (img_tensor, task_id, buttons)
+            # 转换图像格式（lazy / prefetch 模式下 image 输出为占位图）
+            return (to_image_tensor(image_ref.image), task_id, buttons, image_ref)
 
         except Exception as e:
             print(f"Error in MidjourneyImagineNode: {str(e)}")
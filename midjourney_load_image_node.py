@@ -0,0 +1,32 @@
+class MidjourneyLoadImageNode:
+    """ComfyUI 自定义节点：把 Imagine / Blend 节点输出的 image_ref 下载解码为 IMAGE。
+
+    Imagine / Blend 的 image_mode 选 lazy 或 prefetch 时不在节点内下载结果图，
+    只有接了本节点（下游确实需要像素）才会下载；prefetch 已在后台下载完成时直接返回。
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image_ref": ("MJ_IMAGE_REF",),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE",)
+    FUNCTION = "load_image"
+    CATEGORY = "image"
+
+    def load_image(self, image_ref):
+        import torch
+
+        try:
+            image = image_ref.load()
+
+            img_tensor = torch.from_numpy(image).float() / 255.0
+            img_tensor = img_tensor.unsqueeze(0)
+
+            return (img_tensor,)
+        except Exception as e:
+            print(f"Error in MidjourneyLoadImageNode: {str(e)}")
+            raise
@@ -0,0 +1,66 @@
+
+from .image_ref import to_image_tensor
+from .midjourney_imagine_node import MidjourneyImagineNode
+from .progress import ComfyProgressReporter
+
+
+class MidjourneyImaginePipelineNode(MidjourneyImagineNode):
+    """ComfyUI 自定义节点：Imagine + 批量放大/变体 一体化流水线。
+
+    等价于 MidjourneyImagineNode → Midjourney Batch Upscale/Variation，但父任务 SUCCESS 后
+    立即提交 U1-U4 / V1-V4，四格主图与子任务并发下载（grid 选 skip 时不下载），
+    省去一次父任务查询和至少一个轮询间隔。
+
+    输出：
+        四格主图（skip 时为占位图）、四张子图（失败的为占位图）、任务 ID、操作按钮字典。
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        inputs = super().INPUT_TYPES()
+        # 流水线用 grid 控制是否下载四格主图
+        inputs["optional"].pop("image_mode")
+        inputs["required"]["batch_actions"] = (["U1-U4", "V1-V4"], {"default": "U1-U4"})
+        inputs["optional"]["grid"] = (["download", "skip"], {"default": "download"})
+        return inputs
+
+    RETURN_TYPES = ("IMAGE", "IMAGE", "IMAGE", "IMAGE", "IMAGE", "STRING", "DICT")
+    RETURN_NAMES = ("grid", "image1", "image2", "image3", "image4", "task_id", "buttons")
+    FUNCTION = "run_pipeline"
+    CATEGORY = "image"
+
+    def run_pipeline(self, prompt, app_key, batch_actions="U1-U4", grid="download", deadline=0,
+                     live_preview=False, priority="interactive", max_side=0, **prompt_options):
+        from .api_client import get_client
+        from .connections import run_sync
+
+        try:
+            params = self.build_prompt(prompt, **prompt_options)
+            self.check_app_key(app_key)
+
+            api_client = get_client(app_key)
+
+            if batch_actions == "U1-U4":
+                actions = ["U1", "U2", "U3", "U4"]
+            else:  # V1-V4
+                actions = ["V1", "V2", "V3", "V4"]
+
+            # 父任务 + 四个子任务
+            reporter = ComfyProgressReporter(expected_tasks=len(actions) + 1)
+            grid_image, task_id, buttons, images = run_sync(
+                api_client.run_job(
+                    api_client.imagine_and_act(params, actions, download_grid=(grid == "download"),
+                                                    on_progress=reporter, preview=live_preview),
+                    deadline=deadline,
+                    priority=priority,
+                    max_side=max_side,
+                )
+            )
+
+            # 未下载的网格图 / 缺失的子任务结果输出占位图
+            outputs = [to_image_tensor(img) for img in [grid_image] + images]
+            return tuple(outputs) + (task_id, buttons)
+
+        except Exception as e:
+            print(f"Error in MidjourneyImaginePipelineNode: {str(e)}")
+            raise
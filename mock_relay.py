@@ -0,0 +1,446 @@
+""" 本地 Midjourney / GPT-Image 中转服务模拟器（离线压测用）
+
+实现与云雾中转一致的接口：
+    POST /v1/api/trigger/imagine | upscale | variation
+    GET  /v1/api/trigger/task/{task_id}
+    POST /mj/submit/blend
+    POST /mj/task/{task_id}/cancel
+    POST /v1/images/generations | edits （stream=true 时以 SSE 返回 partial_image / completed 事件）
+    GET  /images/{task_id}.png          （模拟 Discord CDN，支持 ?width=&format=webp 缩小版本）
+    GET  /previews/{task_id}/{step}.png （IN_PROGRESS 中间预览图）
+    GET  /gpt-images/{index}.png        （GPT-Image response_format=url 时的图片地址）
+    GET  /_stats                        （请求计数）
+
+排队时长、进度曲线、失败率、图片尺寸均可配置，不消耗任何额度。
+
+单独启动：
+    python -m <package>.mock_relay --port 8086 --queue-delay 2 --run-time 8
+"""
+import asyncio
+import base64
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from io import BytesIO
+
+import numpy as np
+from aiohttp import web
+from PIL import Image
+
+
+# 默认进度曲线：(时间比例, 进度百分比)，按分段线性插值
+LINEAR_CURVE = [(0.0, 0), (1.0, 100)]
+
+# 各模式排队时长相对 queue_delay 的倍数（未指定模式按 fast 处理）
+MODE_QUEUE_FACTOR = {"fast": 1.0, "relax": 4.0, "turbo": 0.25}
+
+
+class MockRelay:
+    """可配置的本地中转服务。
+
+    Args:
+        queue_delay (float): 任务提交后处于 SUBMITTED 状态的秒数（relax / turbo 按 MODE_QUEUE_FACTOR 缩放）
+        run_time (float): IN_PROGRESS 阶段持续的秒数
+        progress_curve (list): [(时间比例, 进度)] 曲线，时间比例 0~1
+        error_rate (float): 任务最终 FAILURE 的概率
+        submit_error_rate (float): 提交接口直接返回 HTTP 500 的概率
+        image_size (tuple): 四格主图 / Blend 结果尺寸 (W, H)
+        upscale_size (tuple): 放大/变体结果尺寸 (W, H)
+        gpt_image_size (tuple): GPT-Image 返回图片尺寸 (W, H)
+        gpt_latency (float): GPT-Image 接口响应耗时（秒）
+        preview_size (tuple): IN_PROGRESS 阶段返回的中间预览图尺寸，None 表示不返回
+        seed (int): 随机种子，保证多次压测可复现
+    """
+
+    def __init__(self, queue_delay=0.5, run_time=2.0, progress_curve=None,
+                 error_rate=0.0, submit_error_rate=0.0,
+                 image_size=(1024, 1024), upscale_size=(1024, 1024),
+                 gpt_image_size=(1024, 1024), gpt_latency=1.0, preview_size=None,
+                 host="127.0.0.1", port=0, seed=None):
+        self.queue_delay = queue_delay
+        self.run_time = run_time
+        self.progress_curve = progress_curve or LINEAR_CURVE
+        self.error_rate = error_rate
+        self.submit_error_rate = submit_error_rate
+        self.image_size = tuple(image_size)
+        self.upscale_size = tuple(upscale_size)
+        self.gpt_image_size = tuple(gpt_image_size)
+        self.gpt_latency = gpt_latency
+        self.preview_size = tuple(preview_size) if preview_size else None
+        self.host = host
+        self.port = port
+
+        self._random = random.Random(seed)
+        self._np_random = np.random.default_rng(seed)
+        self._image_cache = {}
+        self.tasks = {}
+        # stats: 按路由统计的请求数；counters: 任务数、图片字节数、注入的错误等
+        self.stats = Counter()
+        self.counters = Counter()
+        self._runner = None
+
+    # ---------- 生命周期 ----------
+    def build_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/api/trigger/imagine", self._handle_imagine)
+        app.router.add_post("/v1/api/trigger/upscale", self._handle_action)
+        app.router.add_post("/v1/api/trigger/variation", self._handle_action)
+        app.router.add_get("/v1/api/trigger/task/{task_id}", self._handle_task)
+        app.router.add_post("/mj/submit/blend", self._handle_blend)
+        app.router.add_post("/mj/task/{task_id}/cancel", self._handle_cancel)
+        app.router.add_post("/v1/images/generations", self._handle_gpt_generate)
+        app.router.add_post("/v1/images/edits", self._handle_gpt_edit)
+        app.router.add_get("/images/{task_id}.png", self._handle_image)
+        app.router.add_get("/previews/{task_id}/{step}.png", self._handle_preview)
+        app.router.add_get("/gpt-images/{index}.png", self._handle_gpt_image)
+        app.router.add_get("/_stats", self._handle_stats)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # port=0 时由系统分配端口，这里回填真实端口
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def reset_stats(self):
+        self.stats.clear()
+        self.counters.clear()
+
+    # ---------- 内部工具 ----------
+    def _count(self, route):
+        self.stats["total"] += 1
+        self.stats[route] += 1
+
+    def _maybe_submit_error(self):
+        if self.submit_error_rate and self._random.random() < self.submit_error_rate:
+            self.counters["injected_submit_errors"] += 1
+            raise web.HTTPInternalServerError(text="mock relay: injected submit error")
+
+    def _png_bytes(self, size, fmt="PNG"):
+        """按尺寸缓存一张随机噪声 PNG（噪声图压缩率接近真实出图，字节数更有代表性）"""
+        if (size, fmt) not in self._image_cache:
+            w, h = size
+            pixels = self._np_random.integers(0, 256, (h, w, 3), dtype=np.uint8)
+            buffer = BytesIO()
+            Image.fromarray(pixels).save(buffer, format=fmt)
+            self._image_cache[(size, fmt)] = buffer.getvalue()
+        return self._image_cache[(size, fmt)]
+
+    def _progress_at(self, fraction):
+        curve = self.progress_curve
+        for (t0, p0), (t1, p1) in zip(curve, curve[1:]):
+            if t0 <= fraction <= t1:
+                if t1 == t0:
+                    return int(p1)
+                return int(p0 + (p1 - p0) * (fraction - t0) / (t1 - t0))
+        return int(curve[-1][1])
+
+    @staticmethod
+    def _submit_mode(body):
+        """提示词中的 --fast/--relax/--turbo 或 accountFilter.modes"""
+        match = re.search(r"--(fast|relax|turbo)\b", body.get("prompt") or "")
+        if match:
+            return match.group(1)
+        modes = (body.get("accountFilter") or {}).get("modes") or []
+        return modes[0].lower() if modes else None
+
+    def _new_task(self, kind, size, parent=None, mode=None):
+        task_id = str(int(time.time() * 1000)) + str(self._random.randint(1000, 9999))
+        self.tasks[task_id] = {
+            "kind": kind,
+            "size": size,
+            "parent": parent,
+            "mode": mode,
+            "created": time.monotonic(),
+            "failed": self._random.random() < self.error_rate,
+            "msg_id": str(uuid.uuid4().int)[:19],
+            "msg_hash": uuid.uuid4().hex,
+            "polls": 0,
+        }
+        self.counters[f"tasks_{kind}"] += 1
+        self.counters[f"mode_{mode or 'default'}"] += 1
+        return task_id
+
+    def _lookup_task(self, task_id):
+        return self.tasks.get(task_id)
+
+    async def _delay(self, route, task=None):
+        """接口耗时注入点，回放模式（replay.ReplayRelay）按录制的耗时覆盖"""
+
+    def _task_state(self, task):
+        """返回 (status, progress)"""
+        elapsed = time.monotonic() - task["created"]
+        queue_delay = self.queue_delay * MODE_QUEUE_FACTOR.get(task.get("mode") or "fast", 1.0)
+        if elapsed < queue_delay:
+            return "SUBMITTED", "0%"
+        if elapsed < queue_delay + self.run_time:
+            fraction = (elapsed - queue_delay) / max(self.run_time, 1e-6)
+            return "IN_PROGRESS", f"{self._progress_at(fraction)}%"
+        if task.get("cancelled"):
+            return "FAILURE", "0%"
+        if task["failed"]:
+            return "FAILURE", "100%"
+        return "SUCCESS", "100%"
+
+    def _task_view(self, task_id, task):
+        status, progress = self._task_state(task)
+        data = {"id": task_id, "action": task["kind"].upper(), "progress": progress,
+                "status": status, "imageUrl": "", "failReason": ""}
+
+        if status == "FAILURE":
+            data["failReason"] = "cancelled" if task.get("cancelled") else "mock relay: injected task failure"
+        if status == "IN_PROGRESS" and self.preview_size:
+            # 与真实中转一样，进度每推进一段更新一次预览地址
+            digits = progress.rstrip("%")
+            step = int(digits) // 25 * 25 if digits.isdigit() else 0
+            if step > 0:
+                data["imageUrl"] = f"{self.url}/previews/{task_id}/{step}.png"
+        if status != "SUCCESS":
+            return data
+
+        msg_id, msg_hash = task["msg_id"], task["msg_hash"]
+        buttons = {"msg_id": msg_id, "msg_hash": msg_hash}
+        for i in range(1, 5):
+            buttons[f"U{i}"] = f"upscale||{i}||{msg_id}||{msg_hash}"
+            buttons[f"V{i}"] = f"vary||{i}||{msg_id}||{msg_hash}"
+
+        data.update({
+            "imageUrl": f"{self.url}/images/{task_id}.png",
+            "buttons": buttons,
+            "msg_id": msg_id,
+            "msg_hash": msg_hash,
+        })
+        return data
+
+    @staticmethod
+    def _submit_response(task_id):
+        return web.json_response({"code": 1, "description": "提交成功", "result": task_id})
+
+    # ---------- Midjourney 接口 ----------
+    async def _handle_imagine(self, request):
+        self._count("imagine")
+        self._maybe_submit_error()
+        body = await request.json()
+        task_id = self._new_task("imagine", self.image_size, mode=self._submit_mode(body))
+        await self._delay("imagine", self.tasks[task_id])
+        return self._submit_response(task_id)
+
+    async def _handle_action(self, request):
+        route = request.path.rsplit("/", 1)[-1]
+        self._count(route)
+        self._maybe_submit_error()
+        body = await request.json()
+        parent = body.get("trigger_id")
+        if self._lookup_task(parent) is None:
+            raise web.HTTPNotFound(text=f"mock relay: unknown trigger_id {parent}")
+        task_id = self._new_task(route, self.upscale_size, parent=parent, mode=self._submit_mode(body))
+        await self._delay(route, self.tasks[task_id])
+        return self._submit_response(task_id)
+
+    async def _handle_blend(self, request):
+        self._count("blend")
+        self._maybe_submit_error()
+        body = await request.json()
+        if len(body.get("base64Array") or []) < 2:
+            return web.json_response({"code": 4, "description": "base64Array 至少两张图片"})
+        task_id = self._new_task("blend", self.image_size, mode=self._submit_mode(body))
+        await self._delay("blend", self.tasks[task_id])
+        return self._submit_response(task_id)
+
+    async def _handle_task(self, request):
+        self._count("task")
+        task_id = request.match_info["task_id"]
+        task = self._lookup_task(task_id)
+        if task is None:
+            raise web.HTTPNotFound(text=f"mock relay: unknown task {task_id}")
+        task["polls"] += 1
+        await self._delay("task", task)
+        return web.json_response(self._task_view(task_id, task))
+
+    async def _handle_cancel(self, request):
+        self._count("cancel")
+        task = self._lookup_task(request.match_info["task_id"])
+        if task is None:
+            raise web.HTTPNotFound()
+        task["cancelled"] = True
+        self.counters["cancelled"] += 1
+        return web.json_response({"code": 1, "description": "取消成功"})
+
+    async def _handle_image(self, request):
+        self._count("image")
+        task = self._lookup_task(request.match_info["task_id"])
+        if task is None:
+            raise web.HTTPNotFound()
+        await self._delay("image", task)
+        width = int(request.query.get("width", 0))
+        if width and width < task["size"][0]:
+            # 模拟 Discord 媒体代理：按 width 等比缩小，format=webp 时返回 webp
+            w, h = task["size"]
+            fmt = "WEBP" if request.query.get("format") == "webp" else "PNG"
+            body = self._png_bytes((width, round(h * width / w)), fmt)
+            self.counters["resized_images"] += 1
+            self.counters["image_bytes"] += len(body)
+            return web.Response(body=body, content_type=f"image/{fmt.lower()}")
+        body = self._png_bytes(task["size"])
+        self.counters["image_bytes"] += len(body)
+        return web.Response(body=body, content_type="image/png")
+
+    async def _handle_preview(self, request):
+        self._count("preview")
+        if self._lookup_task(request.match_info["task_id"]) is None or not self.preview_size:
+            raise web.HTTPNotFound()
+        body = self._png_bytes(self.preview_size)
+        self.counters["preview_bytes"] += len(body)
+        return web.Response(body=body, content_type="image/png")
+
+    async def _handle_stats(self, request):
+        return web.json_response({"requests": dict(self.stats), "counters": dict(self.counters)})
+
+    # ---------- GPT-Image 接口 ----------
+    def _gpt_response(self, n, response_format="b64_json"):
+        if response_format == "url":
+            data = [{"url": f"{self.url}/gpt-images/{i}.png"} for i in range(n)]
+        else:
+            b64 = base64.b64encode(self._png_bytes(self.gpt_image_size)).decode("utf-8")
+            data = [{"b64_json": b64} for _ in range(n)]
+        return web.json_response({"created": int(time.time()), "data": data})
+
+    async def _handle_gpt_image(self, request):
+        self._count("gpt_image")
+        body = self._png_bytes(self.gpt_image_size)
+        self.counters["image_bytes"] += len(body)
+        return web.Response(body=body, content_type="image/png")
+
+    async def _gpt_common(self, route, n, response_format="b64_json"):
+        self._count(route)
+        self._maybe_submit_error()
+        await asyncio.sleep(self.gpt_latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.counters["injected_task_errors"] += 1
+            return web.json_response(
+                {"error": {"message": "mock relay: injected generation failure"}}, status=500)
+        return self._gpt_response(n, response_format)
+
+    async def _gpt_stream(self, request, route, n, partial_images):
+        """按 OpenAI 流式图片接口的格式发送 SSE：partial_images 张中间图，最后 n 个 completed 事件"""
+        self._count(route)
+        self._maybe_submit_error()
+        prefix = "image_generation" if route == "generations" else "image_edit"
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        common = {"created_at": int(time.time()), "size": "x".join(map(str, self.gpt_image_size)),
+                  "quality": "auto", "background": "auto", "output_format": "png"}
+
+        async def send(event):
+            await response.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode())
+
+        steps = partial_images + 1
+        for index in range(partial_images):
+            await asyncio.sleep(self.gpt_latency / steps)
+            size = self.preview_size or self.gpt_image_size
+            b64 = base64.b64encode(self._png_bytes(size)).decode("utf-8")
+            self.counters["partial_images"] += 1
+            await send({"type": f"{prefix}.partial_image", "b64_json": b64, "partial_image_index": index, **common})
+        await asyncio.sleep(self.gpt_latency / steps)
+        b64 = base64.b64encode(self._png_bytes(self.gpt_image_size)).decode("utf-8")
+        usage = {"input_tokens": 10, "output_tokens": 100, "total_tokens": 110,
+                 "input_tokens_details": {"image_tokens": 0, "text_tokens": 10}}
+        for _ in range(n):
+            await send({"type": f"{prefix}.completed", "b64_json": b64, "usage": usage, **common})
+        await response.write_eof()
+        return response
+
+    async def _handle_gpt_generate(self, request):
+        body = await request.json()
+        if body.get("stream"):
+            return await self._gpt_stream(request, "generations", int(body.get("n", 1)),
+                                          int(body.get("partial_images", 0)))
+        return await self._gpt_common("generations", int(body.get("n", 1)), body.get("response_format", "b64_json"))
+
+    async def _handle_gpt_edit(self, request):
+        form = await request.post()
+        if str(form.get("stream", "")).lower() == "true":
+            return await self._gpt_stream(request, "edits", int(form.get("n", 1)),
+                                          int(form.get("partial_images", 0)))
+        return await self._gpt_common("edits", int(form.get("n", 1)), form.get("response_format", "b64_json"))
+
+
+def _parse_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def _parse_curve(text):
+    """ "0:0,0.2:50,1:100" -> [(0.0, 0), (0.2, 50), (1.0, 100)] """
+    points = []
+    for item in text.split(","):
+        t, p = item.split(":")
+        points.append((float(t), int(p)))
+    return points
+
+
+def add_relay_arguments(parser):
+    """注册模拟器相关的命令行参数（benchmark 复用）"""
+    parser.add_argument("--queue-delay", type=float, default=0.5)
+    parser.add_argument("--run-time", type=float, default=2.0)
+    parser.add_argument("--progress-curve", type=_parse_curve, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--submit-error-rate", type=float, default=0.0)
+    parser.add_argument("--image-size", type=_parse_size, default=(1024, 1024))
+    parser.add_argument("--upscale-size", type=_parse_size, default=(1024, 1024))
+    parser.add_argument("--gpt-image-size", type=_parse_size, default=(1024, 1024))
+    parser.add_argument("--gpt-latency", type=float, default=1.0)
+    parser.add_argument("--preview-size", type=_parse_size, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def relay_from_args(args, **kwargs):
+    return MockRelay(
+        queue_delay=args.queue_delay,
+        run_time=args.run_time,
+        progress_curve=args.progress_curve,
+        error_rate=args.error_rate,
+        submit_error_rate=args.submit_error_rate,
+        image_size=args.image_size,
+        upscale_size=args.upscale_size,
+        gpt_image_size=args.gpt_image_size,
+        gpt_latency=args.gpt_latency,
+        preview_size=args.preview_size,
+        seed=args.seed,
+        **kwargs,
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local mock Midjourney/GPT relay")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8086)
+    add_relay_arguments(parser)
+    args = parser.parse_args()
+
+    relay = relay_from_args(args, host=args.host, port=args.port)
+    print(f"Mock relay listening on http://{args.host}:{args.port}")
+    web.run_app(relay.build_app(), host=args.host, port=args.port, access_log=None, print=None)
@@ -0,0 +1,275 @@
+""" 端点延迟分析：并发、多轮探测各中转端点与 CDN 主机（直连 / 经代理），按阶段统计耗时分布
+
+每次探测新建一条连接，分别计时：
+    dns_ms        解析目标主机（经代理时解析代理主机）
+    connect_ms    TCP 连接
+    proxy_ms      HTTPS 经代理时 CONNECT 隧道建立
+    tls_ms        TLS 握手
+    ttfb_ms       发出 GET 到收到响应首行
+    throughput    响应体读取速度（Mbit/s，只在响应体不小于 64KB 时统计，测 CDN 时用 --url 指定一张图片）
+    total_ms      从解析到读完响应体的总耗时，CDN 路由按它的中位数选择
+
+    python -m <package>.net_profiler --rounds 5 --interval 1 --url https://cdn.discordapp.com/attachments/.../a.png
+    python -m <package>.net_profiler --proxy http://127.0.0.1:7890 --output net.json
+
+目标默认取配置中的 api_url、[MIDJOURNEY_POOL] 端点和 [WARMUP] hosts，路由为直连和检测到的系统代理。
+apply() 把结果用于选路：端点池按实测 TTFB 初始化延迟估计（全部失败的端点摘除），
+按 CDN 主机记录最快的路由（直连或某个代理），所有 MJClient 下载时优先使用。
+ComfyUI 中在 [WARMUP] 开启 profile 后，预热线程在首轮预热后运行一次分析并应用到进程内共享的端点池与路由表。
+"""
+import argparse
+import asyncio
+import json
+import socket
+import ssl
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+# 响应体至少这么大时才统计吞吐，太小的响应只反映延迟
+THROUGHPUT_MIN_BYTES = 64 * 1024
+MAX_BODY_BYTES = 32 * 1024 * 1024
+METRICS = ("dns_ms", "connect_ms", "proxy_ms", "tls_ms", "ttfb_ms", "throughput_mbps", "total_ms")
+DIRECT = "direct"
+
+
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+async def _read_head(loop, sock):
+    """在原始 socket 上读取代理 CONNECT 的响应头"""
+    head = b""
+    while b"\r\n\r\n" not in head:
+        chunk = await loop.sock_recv(sock, 4096)
+        if not chunk:
+            raise ConnectionError("proxy closed the connection during CONNECT")
+        head += chunk
+    return head
+
+
+async def _probe(sample, url, kind, proxy):
+    loop = asyncio.get_running_loop()
+    parsed = urlparse(url)
+    https = parsed.scheme == "https"
+    port = parsed.port or (443 if https else 80)
+    path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+    via = urlparse(proxy) if proxy else None
+    connect_host, connect_port = (via.hostname, via.port or 80) if via else (parsed.hostname, port)
+
+    probe_started = started = time.perf_counter()
+    infos = await loop.getaddrinfo(connect_host, connect_port, type=socket.SOCK_STREAM)
+    sample["dns_ms"] = _ms(started)
+
+    family, sock_type, proto, _, address = infos[0]
+    sock = socket.socket(family, sock_type, proto)
+    sock.setblocking(False)
+    writer = None
+    try:
+        started = time.perf_counter()
+        await loop.sock_connect(sock, address)
+        sample["connect_ms"] = _ms(started)
+
+        if via and https:
+            started = time.perf_counter()
+            target = f"{parsed.hostname}:{port}"
+            await loop.sock_sendall(sock, f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+            status = int((await _read_head(loop, sock)).split()[1])
+            if status != 200:
+                raise ConnectionError(f"proxy CONNECT returned HTTP {status}")
+            sample["proxy_ms"] = _ms(started)
+
+        context = None
+        if https:
+            context = ssl.create_default_context()
+            if kind == "cdn":
+                # 与 connections.py 的 cdn 连接池一致：不校验证书
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+        started = time.perf_counter()
+        reader, writer = await asyncio.open_connection(sock=sock, ssl=context,
+                                                       server_hostname=parsed.hostname if context else None)
+        if context is not None:
+            sample["tls_ms"] = _ms(started)
+
+        # 经 HTTP 代理访问 http 地址时请求行使用完整 URL
+        request_target = url if via and not https else path
+        writer.write((f"GET {request_target} HTTP/1.1\r\nHost: {parsed.netloc}\r\n"
+                      "User-Agent: Mozilla/5.0\r\nAccept: */*\r\nConnection: close\r\n\r\n").encode())
+        started = time.perf_counter()
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed before the response")
+        sample["ttfb_ms"] = _ms(started)
+        sample["status"] = int(status_line.split()[1])
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        started = time.perf_counter()
+        received = 0
+        while received < MAX_BODY_BYTES:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            received += len(chunk)
+        elapsed = time.perf_counter() - started
+        sample["bytes"] = received
+        sample["total_ms"] = _ms(probe_started)
+        if received >= THROUGHPUT_MIN_BYTES and elapsed > 0:
+            sample["throughput_mbps"] = round(received * 8 / elapsed / 1e6, 2)
+    finally:
+        if writer is not None:
+            writer.close()
+        else:
+            sock.close()
+
+
+async def probe(url, kind="api", proxy=None, timeout=15):
+    """
+    探测一次 url（proxy 为 None 时直连），返回各阶段耗时
+    return: {url, kind, route, dns_ms, connect_ms, proxy_ms, tls_ms, ttfb_ms, status, bytes, throughput_mbps, error}
+    """
+    sample = {"url": url, "kind": kind, "route": proxy or DIRECT}
+    try:
+        await asyncio.wait_for(_probe(sample, url, kind, proxy), timeout)
+    except Exception as e:
+        sample["error"] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+    return sample
+
+
+def _distribution(values):
+    if not values:
+        return None
+    values = np.asarray(values, dtype=float)
+    return {
+        "n": int(values.size),
+        "min": round(float(values.min()), 2),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p90": round(float(np.percentile(values, 90)), 2),
+        "max": round(float(values.max()), 2),
+        "mean": round(float(values.mean()), 2),
+    }
+
+
+def summarize(samples):
+    """按 (url, route) 汇总各阶段耗时分布，并为每个 CDN 主机选出总耗时中位数最小的可用路由"""
+    groups = {}
+    for sample in samples:
+        groups.setdefault((sample["url"], sample["route"]), []).append(sample)
+    targets = []
+    for (url, route), group in groups.items():
+        ok = [s for s in group if "error" not in s]
+        entry = {"url": url, "kind": group[0]["kind"], "route": route, "probes": len(group), "ok": len(ok),
+                 "errors": len(group) - len(ok)}
+        if len(ok) < len(group):
+            entry["last_error"] = [s["error"] for s in group if "error" in s][-1]
+        if ok:
+            entry["status"] = ok[-1].get("status")
+        for metric in METRICS:
+            distribution = _distribution([s[metric] for s in ok if metric in s])
+            if distribution is not None:
+                entry[metric] = distribution
+        targets.append(entry)
+
+    best_routes = {}
+    for entry in targets:
+        if entry["kind"] != "cdn" or not entry["ok"]:
+            continue
+        host = urlparse(entry["url"]).hostname
+        best = best_routes.get(host)
+        if best is None or entry["total_ms"]["p50"] < best[1]:
+            best_routes[host] = (entry["route"], entry["total_ms"]["p50"])
+    return {"targets": targets, "best_routes": {host: route for host, (route, _) in best_routes.items()}}
+
+
+class LatencyProfiler:
+    """
+    Args:
+        targets (list): [(url, kind)]，kind 为 api / cdn
+        routes (list): 路由列表，None 表示直连，其余为 HTTP 代理地址
+        rounds (int): 探测轮数，每轮所有 目标×路由 并发探测
+        interval (float): 轮间隔（秒）
+    """
+
+    def __init__(self, targets, routes=(None,), rounds=3, interval=1.0, timeout=15):
+        self.targets = list(targets)
+        self.routes = list(dict.fromkeys(routes))
+        self.rounds = rounds
+        self.interval = interval
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, config, extra_urls=(), proxies=(), **kwargs):
+        """目标取配置中的端点与 CDN 主机（extra_urls 作为 CDN 目标追加），路由为直连、系统代理与 proxies"""
+        from .api_client import system_proxy
+        from .warmup import config_targets
+
+        targets = config_targets(config) + [(url, "cdn") for url in extra_urls]
+        return cls(targets, routes=[None, system_proxy(), *proxies], **kwargs)
+
+    async def run(self):
+        samples = []
+        started = time.time()
+        for index in range(self.rounds):
+            if index:
+                await asyncio.sleep(self.interval)
+            samples += await asyncio.gather(*(probe(url, kind, route, self.timeout)
+                                              for url, kind in self.targets for route in self.routes))
+        report = summarize(samples)
+        report.update(rounds=self.rounds, started=round(started, 3), duration_s=round(time.time() - started, 2))
+        return report
+
+
+def apply(report, pool=None, client=None, routes=None):
+    """
+    把分析结果用于选路：
+    pool   端点池中各端点的延迟估计按直连 TTFB 中位数初始化，全部探测失败的端点摘除
+    client MJClient 按 CDN 主机记录最快的下载路由（cdn_routes）
+    routes 直接写入的路由表（如 api_client.cdn_routes），没有客户端实例时使用
+    """
+    if pool is not None:
+        for entry in report["targets"]:
+            if entry["kind"] != "api" or entry["route"] != DIRECT:
+                continue
+            for endpoint in pool.endpoints:
+                if endpoint.url == entry["url"].rstrip("/"):
+                    if entry["ok"]:
+                        pool.observe(endpoint, entry["ttfb_ms"]["p50"] / 1000, ok=True)
+                    else:
+                        pool.observe(endpoint, 0.0, ok=False)
+    if routes is None and client is not None:
+        routes = client.cdn_routes
+    if routes is not None:
+        for host, route in report["best_routes"].items():
+            routes[host] = "" if route == DIRECT else route
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile latency of relay endpoints, CDN hosts and proxy routes")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between rounds")
+    parser.add_argument("--timeout", type=float, default=15)
+    parser.add_argument("--url", action="append", default=[],
+                        help="extra CDN URL to probe (an image URL also measures throughput), repeatable")
+    parser.add_argument("--proxy", action="append", default=[], help="extra HTTP proxy route, repeatable")
+    parser.add_argument("--output", default=None, help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    from .utils import load_config
+
+    profiler = LatencyProfiler.from_config(load_config(), extra_urls=args.url, proxies=args.proxy,
+                                           rounds=args.rounds, interval=args.interval, timeout=args.timeout)
+    report = asyncio.run(profiler.run())
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+""" 结果落盘：把下载到的原始图片字节（不重新编码）和元数据交给后台线程写入，节点不等待磁盘 I/O
+
+在 config.ini 中配置后，MJClient 下载的每张结果图、GPT Image 节点返回的每张图都会保存：
+
+    [OUTPUT_SINK]
+      dir: output/mj_results     # 保存目录（相对路径以本包目录为基准），为空表示不启用
+      metadata: jsonl            # jsonl（dir/metadata.jsonl）或 sqlite（dir/metadata.sqlite）
+      max_backlog: 64            # 待写队列上限，写满时提交方等待（背压），不丢结果
+      batch_size: 16             # 一批最多写入的图片数，同一批只做一轮 fsync
+      fsync: true                # false 时不调用 fsync，交给操作系统回写（断电可能丢最近的结果）
+
+图片写入 <dir>/<name>.<png|jpg|webp>，元数据在图片落盘后追加，因此记录指向的文件一定完整。
+元数据包含 kind（mj / gpt）、task_id、prompt、buttons、各阶段时间等，字段因来源而异。
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from .utils import load_config
+
+logger = logging.getLogger(__name__)
+
+METADATA_FORMATS = ("jsonl", "sqlite")
+
+
+def image_extension(data):
+    """按文件头判断图片格式的扩展名（只看前几个字节，不解码）"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return "bin"
+
+
+class OutputSink:
+    """
+    Args:
+        directory (str): 保存目录
+        metadata (str): jsonl / sqlite
+        max_backlog (int): 待写队列上限
+        batch_size (int): 每批最多写入的图片数
+        fsync (bool): 每批写完后是否 fsync
+    """
+
+    def __init__(self, directory, metadata="jsonl", max_backlog=64, batch_size=16, fsync=True):
+        if metadata not in METADATA_FORMATS:
+            raise ValueError(f"Unknown metadata format: {metadata}")
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.metadata = metadata
+        self.batch_size = max(1, batch_size)
+        self.fsync = fsync
+        self._queue = queue.Queue(maxsize=max(1, max_backlog))
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "written": 0, "bytes": 0, "batches": 0, "errors": 0,
+                       "blocked": 0, "blocked_s": 0.0}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="mj-output-sink", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.has_section('OUTPUT_SINK') or not config['OUTPUT_SINK'].get('dir', '').strip():
+            return None
+        section = config['OUTPUT_SINK']
+        directory = section.get('dir').strip()
+        if not os.path.isabs(directory):
+            directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
+        return cls(
+            directory,
+            metadata=section.get('metadata', 'jsonl').strip().lower(),
+            max_backlog=section.getint('max_backlog', 64),
+            batch_size=section.getint('batch_size', 16),
+            fsync=section.getboolean('fsync', True),
+        )
+
+    # ---------- 提交（节点线程 / 事件循环） ----------
+    def submit(self, data, name, record=None):
+        """
+        排队保存一张图片，立即返回；队列满时阻塞等待写入线程腾出位置
+        data: 原始压缩字节；name: 文件名（不含扩展名）；record: 随图片保存的元数据 dict
+        """
+        if self._closed:
+            raise RuntimeError("Output sink is closed")
+        item = (data, name, dict(record or {}))
+        with self._lock:
+            self._stats["submitted"] += 1
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            started = time.perf_counter()
+            self._queue.put(item)
+            with self._lock:
+                self._stats["blocked"] += 1
+                self._stats["blocked_s"] += time.perf_counter() - started
+
+    async def asubmit(self, data, name, record=None):
+        """事件循环中使用：队列未满时直接入队，满时在线程中等待，不阻塞循环；关闭后提交与 submit 一样报错"""
+        import asyncio
+
+        if self._closed:
+            # 关闭后入队的图片排在结束标记之后，写入线程不会再处理
+            raise RuntimeError("Output sink is closed")
+        try:
+            self._queue.put_nowait((data, name, dict(record or {})))
+            with self._lock:
+                self._stats["submitted"] += 1
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(None, self.submit, data, name, record)
+
+    def flush(self, timeout=None):
+        """等待已提交的图片全部写完，返回是否在 timeout 内完成"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=30):
+        """写完队列中剩余的图片后停止写入线程（进程退出时自动调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["blocked_s"] = round(stats["blocked_s"], 4)
+        stats["backlog"] = self._queue.qsize()
+        return stats
+
+    # ---------- 写入线程 ----------
+    def _run(self):
+        db = None
+        if self.metadata == "sqlite":
+            # 连接只在写入线程中使用
+            db = sqlite3.connect(os.path.join(self.directory, "metadata.sqlite"))
+            db.execute("CREATE TABLE IF NOT EXISTS outputs (id INTEGER PRIMARY KEY, name TEXT, file TEXT, "
+                       "kind TEXT, task_id TEXT, prompt TEXT, created REAL, record TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS outputs_task_id ON outputs (task_id)")
+            db.execute(f"PRAGMA synchronous={'FULL' if self.fsync else 'OFF'}")
+            db.commit()
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            items = [item for item in batch if item is not None]
+            stop = len(items) < len(batch)
+            try:
+                if items:
+                    self._write_batch(items, db)
+            except Exception as e:
+                logger.error(f"Output sink failed to write {len(items)} result(s): {e}")
+                with self._lock:
+                    self._stats["errors"] += len(items)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        if db is not None:
+            db.close()
+
+    def _write_batch(self, items, db):
+        records = []
+        files = []
+        try:
+            for data, name, record in items:
+                path = os.path.join(self.directory, f"{name}.{image_extension(data)}")
+                f = open(path + ".tmp", "wb")
+                files.append((f, path))
+                f.write(data)
+                record.update(name=name, file=os.path.basename(path), bytes=len(data),
+                              saved_at=round(time.time(), 3))
+                records.append(record)
+            # 整批写完后统一 fsync，再改名为正式文件名：中途崩溃只会留下 .tmp
+            for f, path in files:
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                f.close()
+                os.replace(path + ".tmp", path)
+        finally:
+            for f, _ in files:
+                f.close()
+        if self.fsync and hasattr(os, "O_DIRECTORY"):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._write_metadata(records, db)
+        with self._lock:
+            self._stats["written"] += len(records)
+            self._stats["bytes"] += sum(record["bytes"] for record in records)
+            self._stats["batches"] += 1
+
+    def _write_metadata(self, records, db):
+        if db is not None:
+            db.executemany(
+                "INSERT INTO outputs (name, file, kind, task_id, prompt, created, record) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(r["name"], r["file"], r.get("kind"), r.get("task_id"), r.get("prompt"), r["saved_at"],
+                  json.dumps(r, ensure_ascii=False)) for r in records])
+            db.commit()
+            return
+        with open(os.path.join(self.directory, "metadata.jsonl"), "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+
+_sink = None
+_sink_loaded = False
+_sink_lock = threading.Lock()
+
+
+def get_output_sink():
+    """进程内共享的结果写入器，未配置 [OUTPUT_SINK] dir 时返回 None"""
+    global _sink, _sink_loaded
+    with _sink_lock:
+        if not _sink_loaded:
+            _sink = OutputSink.from_config(load_config())
+            _sink_loaded = True
+        return _sink
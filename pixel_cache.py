@@ -0,0 +1,149 @@
+""" 解码后像素的磁盘缓存：热点结果图以 .npy 保存，命中时内存映射打开，不再解码
+
+压缩字节缓存（image_ref、[COORDINATION] 的共享缓存）命中后仍要付出 PNG 解码。反复执行同一工作流
+（调下游节点参数时很常见）时，同一张结果图被解码多次。在 config.ini 中配置后启用：
+
+    [PIXEL_CACHE]
+      dir: ~/.cache/comfyui-mj/pixels   # 为空表示不启用；多个进程可以共用同一目录
+      max_mb: 4096                      # 缓存上限（按最近使用淘汰），与压缩字节缓存分开计算
+      promote_after: 2                  # 同一张图第几次从压缩字节解码时写入本缓存
+
+缓存键为 URL + max_side。命中时用 np.load(mmap_mode="c") 打开：只读取文件头，像素在节点转换为
+Tensor 时才按页读入（copy-on-write，节点内原地修改不会写回文件）。
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .utils import load_config
+
+logger = logging.getLogger(__name__)
+
+# 进程内最多记录多少个键的解码次数（只用于判断是否写入缓存）
+_ACCESS_LIMIT = 4096
+
+
+class PixelCache:
+    """
+    Args:
+        directory (str): 缓存目录
+        max_mb (int): 缓存上限（MB）
+        promote_after (int): 同一键解码多少次后写入缓存
+    """
+
+    def __init__(self, directory, max_mb=4096, promote_after=2):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.promote_after = max(1, promote_after)
+        self._lock = threading.Lock()
+        # 文件名 -> 字节数，按最近使用排序（启动时按文件修改时间恢复）
+        self._index = OrderedDict()
+        self._total = 0
+        self._access = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.promotions = 0
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._total += size
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.has_section('PIXEL_CACHE') or not config['PIXEL_CACHE'].get('dir', '').strip():
+            return None
+        section = config['PIXEL_CACHE']
+        return cls(section.get('dir').strip(), max_mb=section.getint('max_mb', 4096),
+                   promote_after=section.getint('promote_after', 2))
+
+    @staticmethod
+    def _name(key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy"
+
+    def lookup(self, key):
+        """命中时返回内存映射的 np.ndarray（HWC, uint8），否则返回 None 并记一次访问"""
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        try:
+            pixels = np.load(path, mmap_mode="c")
+        except (OSError, ValueError):
+            # 未缓存，或已被其他进程淘汰
+            with self._lock:
+                self.misses += 1
+                self._total -= self._index.pop(name, 0)
+                self._access[key] = self._access.pop(key, 0) + 1
+                while len(self._access) > _ACCESS_LIMIT:
+                    self._access.popitem(last=False)
+            return None
+        with self._lock:
+            self.hits += 1
+            if name not in self._index:
+                # 其他进程写入的
+                self._index[name] = os.path.getsize(path)
+                self._total += self._index[name]
+            self._index.move_to_end(name)
+        try:
+            # 让其他进程 / 下次启动也能看到最近使用时间
+            os.utime(path)
+        except OSError:
+            pass
+        return pixels
+
+    def store_if_hot(self, key, pixels):
+        """该键已解码 promote_after 次时写入缓存（在线程中调用，写文件不占用事件循环）"""
+        with self._lock:
+            if self._access.get(key, 0) < self.promote_after:
+                return False
+            self._access.pop(key, None)
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(pixels, dtype=np.uint8))
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
+        evict = []
+        with self._lock:
+            self.promotions += 1
+            self._total += size - self._index.pop(name, 0)
+            self._index[name] = size
+            while self._total > self.max_bytes and len(self._index) > 1:
+                old, old_size = self._index.popitem(last=False)
+                self._total -= old_size
+                evict.append(old)
+        for old in evict:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                # Windows 上仍被映射的文件不能删除，下次淘汰时再试
+                pass
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._index), "mb": round(self._total / 1024 / 1024, 1), "hits": self.hits,
+                    "misses": self.misses, "promotions": self.promotions}
+
+
+_cache = None
+_cache_loaded = False
+_cache_lock = threading.Lock()
+
+
+def get_pixel_cache():
+    """进程内共享的像素缓存，未配置 [PIXEL_CACHE] dir 时返回 None"""
+    global _cache, _cache_loaded
+    with _cache_lock:
+        if not _cache_loaded:
+            _cache = PixelCache.from_config(load_config())
+            _cache_loaded = True
+        return _cache
@@ -0,0 +1,34 @@
+""" ComfyUI 进度条与实时预览上报 """
+try:
+    import comfy.utils as comfy_utils
+except ImportError:
+    # 不在 ComfyUI 中运行（benchmark / 命令行）时静默忽略
+    comfy_utils = None
+
+
+class ComfyProgressReporter:
+    """
+    作为 MJClient.sync_mj_status 的 on_progress 回调：汇总一个或多个远端任务的进度，
+    推送到 ComfyUI 进度条，并把中间预览图显示在节点上
+    """
+
+    PREVIEW_MAX_SIZE = 512
+
+    def __init__(self, expected_tasks=1):
+        self.expected_tasks = max(expected_tasks, 1)
+        self._progress = {}
+        self._bar = comfy_utils.ProgressBar(100) if comfy_utils is not None else None
+
+    @property
+    def value(self):
+        total = sum(self._progress.values())
+        return int(total / max(self.expected_tasks, len(self._progress)))
+
+    def __call__(self, task_id, progress, preview=None):
+        if progress is not None:
+            # 中转偶尔会返回回退的进度，进度条只前进不后退
+            self._progress[task_id] = max(progress, self._progress.get(task_id, 0))
+        if self._bar is None:
+            return
+        preview_tuple = ("JPEG", preview, self.PREVIEW_MAX_SIZE) if preview is not None else None
+        self._bar.update_absolute(self.value, 100, preview_tuple)
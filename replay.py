@@ -0,0 +1,260 @@
+""" 回放录制的中转流量（cassette），在本地复现生产环境的负载形态
+
+ReplayRelay 在 MockRelay 基础上按 cassette 中每个任务的真实时序返回状态序列、
+接口耗时和图片大小；replay_cassette 按原始到达时间重新发起作业，可加速（speed）
+或按倍数放大并发（scale）。
+
+    python -m <package>.replay cassette.jsonl --speed 10 --scale 4 --output replay.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from .api_client import MJClient, config
+from .benchmark import _peak_rss_mb, _percentile
+from .cassette import build_task_profiles, load_cassette
+from .mock_relay import MockRelay
+
+# 回放时按录制字节数生成噪声图；尺寸取整到 64，避免缓存太多不同尺寸
+_SIZE_STEP = 64
+
+
+def _size_for_bytes(num_bytes):
+    # 噪声 PNG 每像素约 3 字节
+    side = int(math.sqrt(max(num_bytes, 3) / 3))
+    side = max(_SIZE_STEP, int(round(side / _SIZE_STEP)) * _SIZE_STEP)
+    return side, side
+
+
+class ReplayRelay(MockRelay):
+    """按 cassette 任务时序回放的本地中转服务
+
+    Args:
+        profiles (dict): cassette.build_task_profiles 的结果
+        speed (float): 时间加速倍数，2 表示所有时序缩短一半
+    """
+
+    def __init__(self, profiles, speed=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.speed = max(speed, 1e-6)
+        self._pools = defaultdict(list)
+        for profile in profiles.values():
+            if profile["timeline"]:
+                self._pools[profile["route"]].append(profile)
+        self._cursor = Counter()
+
+    def _next_profile(self, route):
+        pool = self._pools.get(route)
+        if not pool:
+            # 该类任务没有录到，用任意一类代替
+            pool = next((p for p in self._pools.values() if p), None)
+            if not pool:
+                return None
+        profile = pool[self._cursor[route] % len(pool)]
+        self._cursor[route] += 1
+        return profile
+
+    def _new_task(self, kind, size, parent=None, mode=None):
+        task_id = super()._new_task(kind, size, parent=parent, mode=mode)
+        task = self.tasks[task_id]
+        profile = self._next_profile(kind)
+        task["profile"] = profile
+        if profile is not None and profile["bytes"]:
+            task["size"] = _size_for_bytes(profile["bytes"])
+        return task_id
+
+    def _lookup_task(self, task_id):
+        task = self.tasks.get(task_id)
+        if task is None and task_id:
+            # 录制前就已完成的父任务（放大/变体操作引用），视为已成功
+            task = {
+                "kind": "imagine", "size": self.image_size, "parent": None,
+                "created": time.monotonic() - 1e9, "failed": False,
+                "msg_id": str(abs(hash(task_id)))[:19], "msg_hash": f"replay{abs(hash(task_id)):x}",
+                "polls": 0, "profile": None,
+            }
+            self.tasks[task_id] = task
+        return task
+
+    def _task_state(self, task):
+        profile = task.get("profile")
+        if profile is None:
+            return super()._task_state(task)
+        if task.get("cancelled"):
+            return "FAILURE", "0%"
+        elapsed = (time.monotonic() - task["created"]) * self.speed
+        status, progress = "SUBMITTED", "0%"
+        for offset, rec_status, rec_progress in profile["timeline"]:
+            if offset > elapsed:
+                break
+            status, progress = rec_status, rec_progress
+        if status in ("FAILED", "FAILURE"):
+            return "FAILURE", progress
+        return status, progress
+
+    async def _delay(self, route, task=None):
+        profile = task.get("profile") if task else None
+        if profile is None:
+            return
+        if route == "task":
+            latency = statistics.median(profile["poll_latencies"]) if profile["poll_latencies"] else 0.0
+        elif route == "image":
+            latency = profile["download_latency"]
+        else:
+            latency = profile["submit_latency"]
+        if latency:
+            await asyncio.sleep(latency / self.speed)
+
+
+def _data_url(num_bytes):
+    w, h = _size_for_bytes(num_bytes)
+    pixels = np.random.default_rng(0).integers(0, 256, (h, w, 3), dtype=np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def _recorded_poll_interval(profiles):
+    """取录制时同一任务相邻两次轮询间隔的中位数"""
+    gaps = []
+    for profile in profiles.values():
+        offsets = [offset for offset, _, _ in profile["timeline"]]
+        gaps.extend(b - a for a, b in zip(offsets, offsets[1:]))
+    if not gaps:
+        return config['MIDJOURNEY_API'].getfloat('poll_interval', 10)
+    return statistics.median(gaps)
+
+
+def _replay_jobs(events):
+    """从 cassette 中提取顶层作业：imagine/blend 提交 与 放大/变体调用"""
+    jobs = []
+    for event in events:
+        if event["type"] == "submit" and event.get("route") in ("imagine", "blend"):
+            jobs.append(event)
+        elif event["type"] == "call":
+            jobs.append(event)
+    return jobs
+
+
+async def replay_cassette(path, speed=1.0, scale=1, concurrency=None, api_key="replay-key"):
+    """按 cassette 回放作业，返回与 benchmark 一致的统计结构"""
+    events = load_cassette(path)
+    profiles = build_task_profiles(events)
+    jobs = _replay_jobs(events)
+    if not jobs:
+        raise ValueError(f"No replayable jobs in cassette: {path}")
+
+    relay = ReplayRelay(profiles, speed=speed)
+    async with relay:
+        client = MJClient(api_key=api_key, api_url=relay.url)
+        client.proxy_url = None
+        client.poll_interval = _recorded_poll_interval(profiles) / max(speed, 1e-6)
+
+        semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        blend_images = {}
+        latencies = defaultdict(list)
+        errors = []
+        t0 = jobs[0]["t"]
+
+        async def run_job(index, event):
+            await asyncio.sleep((event["t"] - t0) / speed)
+            kind = event.get("call") or event.get("route")
+            start = time.perf_counter()
+            try:
+                if kind == "imagine":
+                    task_id = await client.imagine(f"replay {index}")
+                    await client.sync_mj_status(task_id)
+                elif kind == "blend":
+                    upload = event.get("upload_bytes", 0) // max(event.get("images", 2), 1)
+                    if upload not in blend_images:
+                        blend_images[upload] = _data_url(upload * 3 // 4)
+                    task_id = await client.blend([blend_images[upload]] * event.get("images", 2),
+                                                 state=str(index))
+                    await client.sync_mj_status(task_id)
+                elif kind == "upscale_or_vary":
+                    await client.upscale_or_vary(f"replay-parent-{index}", event.get("action", "U1"))
+                elif kind == "batch_upscale_or_vary":
+                    await client.batch_upscale_or_vary(f"replay-parent-{index}", event.get("actions"))
+                else:
+                    return
+                latencies[kind].append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(f"{kind}: {e}")
+
+        async def guarded(index, event):
+            if semaphore is None:
+                return await run_job(index, event)
+            async with semaphore:
+                return await run_job(index, event)
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        await asyncio.gather(*(
+            guarded(copy * len(jobs) + i, event)
+            for copy in range(scale)
+            for i, event in enumerate(jobs)
+        ))
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+    stats = dict(relay.stats)
+    total_requests = stats.pop("total", 0)
+    completed = sum(len(v) for v in latencies.values())
+    return {
+        "cassette": path,
+        "speed": speed,
+        "scale": scale,
+        "jobs": len(jobs) * scale,
+        "succeeded": completed,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "wall_s": round(wall, 4),
+        "throughput_jobs_per_s": round(completed / wall, 4) if wall else None,
+        "latency_s": {
+            kind: {
+                "count": len(values),
+                "p50": _percentile(values, 50),
+                "p95": _percentile(values, 95),
+                "p99": _percentile(values, 99),
+            }
+            for kind, values in latencies.items()
+        },
+        "requests_per_job": round(total_requests / (len(jobs) * scale), 2),
+        "requests_by_route": stats,
+        "cpu_s": round(cpu, 4),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded relay cassette against a local stand-in")
+    parser.add_argument("cassette")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression factor")
+    parser.add_argument("--scale", type=int, default=1, help="replay every job N times concurrently")
+    parser.add_argument("--concurrency", type=int, default=None, help="cap on in-flight jobs")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+
+    print(f"[replay] {args.cassette} speed={args.speed} scale={args.scale}", file=sys.stderr)
+    report = asyncio.run(replay_cassette(args.cassette, speed=args.speed, scale=args.scale,
+                                         concurrency=args.concurrency))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
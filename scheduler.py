@@ -0,0 +1,228 @@
+""" 客户端作业调度：按优先级放行提交，并按队列深度为每个任务选择 fast / relax / turbo 模式
+
+在 config.ini 中配置后启用（未配置时行为不变：不限制并发、不指定模式，使用账户默认模式）：
+
+    [MIDJOURNEY_SCHEDULER]
+      max_in_flight: 10        # 同时在跑的远端任务上限，0 表示不限制
+      bulk_max_in_flight: 6    # 其中 bulk 作业最多占用的名额，给交互作业留出余量
+      latency_target: 60       # 交互作业可接受的排队时间（秒）
+      modes: fast, relax       # 账户可用的模式，有 turbo 额度时加上 turbo
+
+优先级：
+    interactive  ComfyUI 中等待出图的作业，优先放行；fast 排队超过 latency_target 时升级 turbo
+    normal       默认 fast；在跑任务过多或 fast 排队超过 latency_target 时改用 relax
+    bulk         批量作业（batch_runner 默认），使用 relax
+
+排队时间 = 提交到第一次看到 IN_PROGRESS 的时间，按模式做指数滑动平均。
+"""
+import asyncio
+import itertools
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("interactive", "normal", "bulk")
+
+# 提示词中用户显式指定的模式，调度器不覆盖
+_MODE_FLAG = re.compile(r"--(fast|relax|turbo)\b", re.IGNORECASE)
+
+
+def prompt_mode(prompt):
+    """返回提示词中显式指定的模式，没有时返回 None"""
+    match = _MODE_FLAG.search(prompt or "")
+    return match.group(1).lower() if match else None
+
+
+class Ticket:
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.mode = None
+        self.task_id = None
+        self.submitted_at = None
+        self.started = False
+
+    def __lt__(self, other):
+        return (PRIORITIES.index(self.priority), self.seq) < (PRIORITIES.index(other.priority), other.seq)
+
+
+class JobScheduler:
+    """进程内共享，内部状态由 threading.Lock 保护（与 EndpointPool 一样，锁内不 await）"""
+
+    def __init__(self, max_in_flight=0, bulk_max_in_flight=0, latency_target=60, modes=("fast", "relax"),
+                 normal_fast_share=0.5, ewma_alpha=0.3, stale_after=300, wait_interval=0.5):
+        self.max_in_flight = max_in_flight
+        self.bulk_max_in_flight = bulk_max_in_flight
+        self.latency_target = latency_target
+        self.modes = [m.lower() for m in modes]
+        self.normal_fast_share = normal_fast_share
+        self.ewma_alpha = ewma_alpha
+        self.stale_after = stale_after
+        self.wait_interval = wait_interval
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._waiting = []
+        self._running = {}
+        self._bulk_in_flight = 0
+        self._queue_wait = {}
+        self.admitted = {p: 0 for p in PRIORITIES}
+        self.mode_counts = {}
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.has_section('MIDJOURNEY_SCHEDULER'):
+            return None
+        section = config['MIDJOURNEY_SCHEDULER']
+        modes = [m.strip() for m in section.get('modes', 'fast, relax').split(',') if m.strip()]
+        return cls(
+            max_in_flight=section.getint('max_in_flight', 0),
+            bulk_max_in_flight=section.getint('bulk_max_in_flight', 0),
+            latency_target=section.getfloat('latency_target', 60),
+            modes=modes,
+            normal_fast_share=section.getfloat('normal_fast_share', 0.5),
+        )
+
+    @property
+    def in_flight(self):
+        return len(self._running)
+
+    # ---------- 放行 ----------
+    def _eligible(self, ticket):
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return False
+        if ticket.priority == "bulk" and self.bulk_max_in_flight:
+            return self._bulk_in_flight < self.bulk_max_in_flight
+        return True
+
+    def _try_admit(self, ticket):
+        with self._lock:
+            # 按 (优先级, 到达顺序) 找第一个可以放行的作业；被 bulk 名额卡住的不会挡住交互作业
+            for candidate in sorted(self._waiting):
+                if not self._eligible(candidate):
+                    continue
+                if candidate is not ticket:
+                    return False
+                self._waiting.remove(ticket)
+                ticket.mode = self._choose_mode(ticket.priority)
+                self._running[id(ticket)] = ticket
+                if ticket.priority == "bulk":
+                    self._bulk_in_flight += 1
+                self.admitted[ticket.priority] += 1
+                return True
+            return False
+
+    async def acquire(self, priority="normal"):
+        """排队直到放行，返回带有所选模式的 Ticket（mode 为 None 表示使用账户默认模式）"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        with self._lock:
+            ticket = Ticket(priority, next(self._seq))
+            self._waiting.append(ticket)
+        try:
+            while not self._try_admit(ticket):
+                await asyncio.sleep(self.wait_interval)
+        except BaseException:
+            with self._lock:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+            raise
+        return ticket
+
+    def bind(self, ticket, task_id, mode=None):
+        """提交成功：记录 task_id 与实际使用的模式（提示词中显式指定的模式优先）"""
+        with self._lock:
+            ticket.task_id = task_id
+            ticket.mode = mode or ticket.mode
+            ticket.submitted_at = time.monotonic()
+            key = ticket.mode or "default"
+            self.mode_counts[key] = self.mode_counts.get(key, 0) + 1
+
+    def _find(self, task_id):
+        for ticket in self._running.values():
+            if ticket.task_id == task_id:
+                return ticket
+        return None
+
+    def started(self, task_id):
+        """任务第一次进入 IN_PROGRESS：记录该模式的排队时间"""
+        with self._lock:
+            ticket = self._find(task_id)
+            if ticket is None or ticket.started or ticket.submitted_at is None:
+                return
+            ticket.started = True
+            wait = time.monotonic() - ticket.submitted_at
+            key = ticket.mode or "default"
+            previous = self._queue_wait.get(key)
+            if previous is not None:
+                wait = previous[0] + self.ewma_alpha * (wait - previous[0])
+            self._queue_wait[key] = (wait, time.monotonic())
+
+    def release(self, ticket=None, task_id=None):
+        """任务结束、提交失败或被取消时归还名额"""
+        with self._lock:
+            if ticket is None:
+                ticket = self._find(task_id)
+            if ticket is None or self._running.pop(id(ticket), None) is None:
+                return
+            if ticket.priority == "bulk":
+                self._bulk_in_flight -= 1
+
+    # ---------- 模式选择 ----------
+    def _pick(self, *preferred):
+        for mode in preferred:
+            if mode in self.modes:
+                return mode
+        return self.modes[0] if self.modes else None
+
+    def _queue_wait_estimate(self, mode, now):
+        """
+        该模式当前的排队时间估计：近期样本的滑动平均，与仍在排队的同模式任务已等待的时间取大者。
+        样本超过 stale_after 秒即失效，升级 turbo / 降级 relax 一段时间后会重新尝试 fast
+        """
+        estimate = 0.0
+        sample = self._queue_wait.get(mode)
+        if sample is not None and now - sample[1] <= self.stale_after:
+            estimate = sample[0]
+        for ticket in self._running.values():
+            if ticket.mode == mode and not ticket.started and ticket.submitted_at is not None:
+                estimate = max(estimate, now - ticket.submitted_at)
+        return estimate
+
+    def _choose_mode(self, priority):
+        if not self.modes:
+            return None
+        fast_congested = self._queue_wait_estimate("fast", time.monotonic()) > self.latency_target
+        if priority == "interactive":
+            return self._pick("turbo", "fast") if fast_congested else self._pick("fast")
+        if priority == "bulk":
+            return self._pick("relax", "fast")
+        busy = self.max_in_flight and self.in_flight >= self.max_in_flight * self.normal_fast_share
+        return self._pick("relax", "fast") if busy or fast_congested else self._pick("fast")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": len(self._waiting),
+                "admitted": dict(self.admitted),
+                "modes": dict(self.mode_counts),
+                "queue_wait_s": {k: round(v[0], 3) for k, v in self._queue_wait.items()},
+            }
+
+
+_scheduler = None
+_scheduler_loaded = False
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(config):
+    """进程内共享的调度器，未配置 [MIDJOURNEY_SCHEDULER] 时返回 None"""
+    global _scheduler, _scheduler_loaded
+    with _scheduler_lock:
+        if not _scheduler_loaded:
+            _scheduler = JobScheduler.from_config(config)
+            _scheduler_loaded = True
+        return _scheduler
@@ -0,0 +1,14 @@
+""" 把仓库目录注册为包 mjhub（ComfyUI 自定义节点目录名不固定、可能含连字符，不能直接 import）
+
+只注册包路径、不执行 __init__.py（不注册节点、不启动预热），测试按需导入各模块。
+"""
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "mjhub" not in sys.modules:
+    package = types.ModuleType("mjhub")
+    package.__path__ = [ROOT]
+    sys.modules["mjhub"] = package
@@ -0,0 +1,75 @@
+import asyncio
+import os
+
+import pytest
+
+from mjhub.coordination import HostCoordinator
+
+
+@pytest.fixture
+def coordinators(tmp_path):
+    # 同一目录上的两个协调器代表同一主机上的两个进程
+    created = []
+
+    def make(**kwargs):
+        coord = HostCoordinator(str(tmp_path), **kwargs)
+        created.append(coord)
+        return coord
+
+    yield make
+    for coord in created:
+        coord.close()
+
+
+def test_held_slot_survives_longer_than_lease(coordinators):
+    first, second = coordinators(lease=0.6), coordinators(lease=0.6)
+
+    async def run():
+        slot = await first.acquire_slot("key", limit=1)
+        await first.bind_slot(slot, "task-1")
+        # 没有任何其他事务（如长时间上传）也不会被其他进程当作过期回收
+        await asyncio.sleep(1.5)
+        assert await second._call(second._try_slot, "key", 1) is None
+        await first.release_slot(task_id="task-1")
+        assert await second._call(second._try_slot, "key", 1) is not None
+
+    asyncio.run(run())
+
+
+def test_slot_of_exited_process_is_reclaimed(coordinators):
+    first, second = coordinators(lease=0.6), coordinators(lease=0.6)
+
+    async def run():
+        await first.acquire_slot("key", limit=1)
+        first._stop.set()  # 模拟进程卡死：不再刷新心跳
+        await asyncio.sleep(1.0)
+        assert await second._call(second._try_slot, "key", 1) is not None
+
+    asyncio.run(run())
+
+
+def test_image_cache_shared_and_evicted(coordinators):
+    first = coordinators(image_cache_mb=1)
+    second = coordinators(image_cache_mb=1)
+    first.image_cache_bytes = second.image_cache_bytes = 250
+    downloads = []
+
+    def download(data):
+        async def run():
+            downloads.append(data)
+            return data
+        return run
+
+    async def run():
+        assert await first.fetch_image("a|0", download(b"a" * 100)) == b"a" * 100
+        # 另一个进程命中缓存，不再下载
+        assert await second.fetch_image("a|0", download(b"never")) == b"a" * 100
+        await first.fetch_image("b|0", download(b"b" * 100))
+        await first.fetch_image("c|0", download(b"c" * 100))
+        # 超出上限时淘汰最久未使用的 a
+        assert await second.fetch_image("a|0", download(b"A" * 100)) == b"A" * 100
+
+    asyncio.run(run())
+    assert downloads == [b"a" * 100, b"b" * 100, b"c" * 100, b"A" * 100]
+    assert not [name for name in os.listdir(first.image_dir) if name.endswith(".tmp")]
+    assert len(os.listdir(first.image_dir)) == 2
@@ -0,0 +1,55 @@
+import numpy as np
+
+from mjhub.encode_cache import EncodeCache, tensor_digest
+
+
+def test_tensor_digest_covers_content_shape_and_dtype():
+    base = np.zeros((2, 3), dtype=np.float32)
+    assert tensor_digest(base) == tensor_digest(base.copy())
+    assert tensor_digest(base) != tensor_digest(base.reshape(3, 2))
+    assert tensor_digest(base) != tensor_digest(base.astype(np.float64))
+    changed = base.copy()
+    changed[0, 0] = 1
+    assert tensor_digest(base) != tensor_digest(changed)
+
+
+def test_encode_cache_key_includes_kind_and_options():
+    cache = EncodeCache(max_bytes=1024)
+    calls = []
+
+    def encode(value):
+        def run():
+            calls.append(value)
+            return value
+        return run
+
+    tensor = np.ones((4, 4), dtype=np.float32)
+    assert cache.get_or_encode(tensor, "png", encode(b"a"), compress_level=1) == b"a"
+    assert cache.get_or_encode(tensor, "png", encode(b"x"), compress_level=1) == b"a"
+    assert cache.get_or_encode(tensor, "png", encode(b"b"), compress_level=6) == b"b"
+    assert cache.get_or_encode(tensor, "mask-png", encode(b"c"), compress_level=1) == b"c"
+    assert calls == [b"a", b"b", b"c"]
+    assert cache.hits == 1 and cache.misses == 3
+
+
+def test_encode_cache_evicts_by_bytes_in_lru_order():
+    cache = EncodeCache(max_bytes=10)
+    tensors = [np.full((2,), i, dtype=np.uint8) for i in range(3)]
+    cache.get_or_encode(tensors[0], "png", lambda: b"0000")
+    cache.get_or_encode(tensors[1], "png", lambda: b"1111")
+    # 命中 0 后写入 2，淘汰 1
+    cache.get_or_encode(tensors[0], "png", lambda: b"never")
+    cache.get_or_encode(tensors[2], "png", lambda: b"2222")
+    assert cache.evictions == 1 and cache.size == 8
+    assert cache.get_or_encode(tensors[0], "png", lambda: b"miss") == b"0000"
+    assert cache.get_or_encode(tensors[1], "png", lambda: b"miss") == b"miss"
+
+
+def test_encode_cache_skips_oversized_and_disabled():
+    cache = EncodeCache(max_bytes=4)
+    tensor = np.zeros((1,), dtype=np.uint8)
+    cache.get_or_encode(tensor, "png", lambda: b"too large")
+    assert cache.size == 0
+    disabled = EncodeCache(max_bytes=0)
+    assert disabled.get_or_encode(tensor, "png", lambda: b"x") == b"x"
+    assert disabled.misses == 0
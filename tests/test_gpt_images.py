@@ -0,0 +1,87 @@
+import sys
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from mjhub.gpt_images import call_with_format  # noqa: E402
+
+
+class BadRequestError(Exception):
+    """与 openai.BadRequestError 一致，带 param 字段"""
+
+    def __init__(self, message, param=None):
+        super().__init__(message)
+        self.param = param
+
+
+@pytest.fixture(autouse=True)
+def fake_openai(monkeypatch):
+    # 只需要异常类型，不依赖 openai SDK 是否安装
+    monkeypatch.setitem(sys.modules, "openai", SimpleNamespace(BadRequestError=BadRequestError))
+
+
+def _api(error):
+    calls = []
+
+    def api_call(**kwargs):
+        calls.append(kwargs)
+        if "response_format" in kwargs and error is not None:
+            kwargs["image"].read()
+            raise error
+        return "ok"
+
+    return api_call, calls
+
+
+def test_falls_back_when_response_format_is_rejected():
+    for error in (BadRequestError("Unknown parameter", param="response_format"),
+                  BadRequestError("Error code: 400 - unsupported value for 'response_format'")):
+        api_call, calls = _api(error)
+        upload = BytesIO(b"png")
+        assert call_with_format(api_call, {"prompt": "a cat", "image": upload}, "url") == "ok"
+        assert [c.get("response_format") for c in calls] == ["url", None]
+        # 重试前复位已读取的上传文件
+        assert upload.tell() == 0
+
+
+def test_other_bad_requests_are_not_retried():
+    api_call, calls = _api(BadRequestError("Your request was rejected by the safety system", param="prompt"))
+    with pytest.raises(BadRequestError):
+        call_with_format(api_call, {"prompt": "a cat", "image": BytesIO(b"png")}, "url")
+    assert len(calls) == 1
+
+
+def test_b64_json_is_requested_directly():
+    api_call, calls = _api(BadRequestError("response_format", param="response_format"))
+    assert call_with_format(api_call, {"prompt": "a cat", "image": BytesIO()}, "b64_json") == "ok"
+    assert calls == [{"prompt": "a cat", "image": calls[0]["image"]}]
+
+
+def test_url_results_download_with_verified_tls(monkeypatch):
+    from mjhub import gpt_images
+    from mjhub.connections import run_sync
+    from mjhub.mock_relay import MockRelay
+
+    kinds = []
+    client_session = gpt_images.client_session
+
+    def recording_session(kind="api", **kwargs):
+        kinds.append(kind)
+        return client_session(kind, **kwargs)
+
+    monkeypatch.setattr(gpt_images, "client_session", recording_session)
+    relay = MockRelay(gpt_image_size=(40, 30))
+    run_sync(relay.start())
+    try:
+        items = [SimpleNamespace(url=f"{relay.url}/gpt-images/{i}.png", b64_json=None) for i in range(3)]
+        saved = []
+        images = gpt_images.decode_items(items, on_bytes=lambda index, data: saved.append(index))
+    finally:
+        run_sync(relay.stop())
+    assert [image.shape for image in images] == [(30, 40, 3)] * 3
+    assert sorted(saved) == [0, 1, 2]
+    # 中转返回的图片 URL 不走不校验证书的 cdn 连接池
+    assert kinds == ["api"]
@@ -0,0 +1,79 @@
+""" GPT 流式中间图预览：用本地模拟中转（MockRelay）的 SSE 接口代替真实中转 """
+import asyncio
+import json
+import threading
+import urllib.request
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from mjhub.gpt_images import collect_stream  # noqa: E402
+from mjhub.mock_relay import MockRelay  # noqa: E402
+
+
+@pytest.fixture
+def relay():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    relay = MockRelay(gpt_latency=0.05, gpt_image_size=(48, 32), preview_size=(24, 16))
+    asyncio.run_coroutine_threadsafe(relay.start(), loop).result()
+    yield relay
+    asyncio.run_coroutine_threadsafe(relay.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+class SSEStream:
+    """按行解析 SSE 的最小读取器，事件转为属性对象（与 openai SDK 的流式事件字段一致）"""
+
+    def __init__(self, response):
+        self.response = response
+        self.closed = False
+
+    def __iter__(self):
+        for line in self.response:
+            line = line.decode("utf-8").strip()
+            if line.startswith("data:"):
+                yield SimpleNamespace(**json.loads(line[len("data:"):]))
+
+    def close(self):
+        self.closed = True
+        self.response.close()
+
+
+def _open_stream(relay, n, partial_images):
+    body = json.dumps({"model": "gpt-image-1", "prompt": "a cat", "n": n, "stream": True,
+                       "partial_images": partial_images}).encode()
+    request = urllib.request.Request(f"{relay.url}/v1/images/generations", data=body,
+                                     headers={"Content-Type": "application/json"})
+    return SSEStream(urllib.request.urlopen(request, timeout=10))
+
+
+def test_partial_previews_and_final_images(relay):
+    progress = []
+    saved = []
+    stream = _open_stream(relay, n=2, partial_images=3)
+    images = collect_stream(stream, 3, on_progress=lambda *args: progress.append(args),
+                            on_bytes=lambda index, data: saved.append((index, data[:8])))
+
+    previews = [(p, preview) for _, p, preview in progress if preview is not None]
+    assert [p for p, _ in previews] == [25, 50, 75]
+    assert all(preview.size == (24, 16) and preview.mode == "RGB" for _, preview in previews)
+    assert [p for _, p, preview in progress if preview is None] == [100, 100]
+
+    assert len(images) == 2
+    assert all(image.shape == (32, 48, 3) and image.dtype == np.uint8 for image in images)
+    assert saved == [(0, b"\x89PNG\r\n\x1a\n"), (1, b"\x89PNG\r\n\x1a\n")]
+    assert stream.closed
+    assert relay.counters["partial_images"] == 3
+
+
+def test_stream_without_completed_image_raises(relay):
+    stream = _open_stream(relay, n=0, partial_images=1)
+    with pytest.raises(RuntimeError):
+        collect_stream(stream, 1)
+    assert stream.closed
@@ -0,0 +1,71 @@
+""" 惰性 / 预取的结果图下载在共享循环（connections.io_loop）上运行，复用节点作业的连接池 """
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from mjhub import api_client  # noqa: E402
+from mjhub.connections import io_loop, run_sync  # noqa: E402
+from mjhub.image_ref import MJImageRef  # noqa: E402
+from mjhub.mock_relay import MockRelay  # noqa: E402
+
+
+@pytest.fixture
+def relay():
+    relay = MockRelay(queue_delay=0.01, run_time=0.05, image_size=(64, 48))
+    run_sync(relay.start())
+    yield relay
+    run_sync(relay.stop())
+
+
+@pytest.fixture
+def client(relay):
+    client = api_client.MJClient(api_key="test-key", api_url=relay.url)
+    client.poll_interval = 0.02
+    client.pool = client.scheduler = client.coord = client.sink = client.pixels = None
+    threads = []
+    download = client.download_task_image
+
+    async def recording_download(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return await download(*args, **kwargs)
+
+    client.download_task_image = recording_download
+    client.download_threads = threads
+    return client
+
+
+def _finished_task(client):
+    async def job():
+        task_id = await client.imagine("a cat")
+        return task_id, (await client.wait_for_task(task_id))["imageUrl"]
+
+    return run_sync(job())
+
+
+def test_lazy_and_prefetch_download_on_shared_loop(client):
+    task_id, url = _finished_task(client)
+    lazy = MJImageRef(client, task_id, url)
+    assert lazy.image is None
+    assert lazy.load().shape == (48, 64, 3)
+
+    prefetched = MJImageRef(client, task_id, url).prefetch()
+    data = asyncio.run(prefetched.load_bytes_async())
+    assert data.startswith(b"\x89PNG")
+    # 多次调用只下载一次
+    assert prefetched.load_bytes() is data
+    assert client.download_threads == ["mj-io", "mj-io"]
+
+
+def test_sync_load_inside_shared_loop_raises(client):
+    task_id, url = _finished_task(client)
+    ref = MJImageRef(client, task_id, url)
+
+    async def load_on_io_loop():
+        with pytest.raises(RuntimeError):
+            ref.load_bytes()
+        return await ref.load_bytes_async()
+
+    assert asyncio.run_coroutine_threadsafe(load_on_io_loop(), io_loop()).result(10).startswith(b"\x89PNG")
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from mjhub.gpt_image_edit_node import GPTImageEditNode as Node
+
+
+def _mask(height, width, ys, xs):
+    mask = np.zeros((height, width), dtype=np.float32)
+    mask[ys[0]:ys[1], xs[0]:xs[1]] = 1
+    return mask
+
+
+def _check_box(mask, padding, result):
+    (left, top, right, bottom), (target_w, target_h) = result
+    height, width = mask.shape
+    ys, xs = np.nonzero(mask)
+    # 在原图内，包含外扩后的蒙版包围盒
+    assert 0 <= left < right <= width and 0 <= top < bottom <= height
+    assert left <= max(xs.min() - padding, 0) and right >= min(xs.max() + 1 + padding, width)
+    assert top <= max(ys.min() - padding, 0) and bottom >= min(ys.max() + 1 + padding, height)
+    # 宽高比与目标尺寸一致（补齐时向上取整，误差不超过 1 像素）
+    crop_w, crop_h = right - left, bottom - top
+    assert abs(crop_w - crop_h * target_w / target_h) <= 1 or abs(crop_h - crop_w * target_h / target_w) <= 1
+
+
+def test_box_is_padded_and_aligned_to_aspect():
+    mask = _mask(2000, 3000, (900, 1000), (1200, 1500))
+    result = Node._mask_crop_box(mask, 32, "gpt-image-1")
+    _check_box(mask, 32, result)
+    assert result[1] == (1536, 1024)
+    # 以包围盒中心为中心
+    (left, top, right, bottom), _ = result
+    assert abs((left + right) / 2 - 1350) <= 1 and abs((top + bottom) / 2 - 950) <= 1
+
+
+@pytest.mark.parametrize("ys, xs", [
+    ((10, 200), (0, 50)),            # 贴左边
+    ((0, 40), (1000, 1100)),         # 贴上边
+    ((800, 1000), (2900, 3000)),     # 右下角
+    ((0, 1000), (100, 200)),         # 高度与原图相同
+    ((450, 550), (0, 3000)),         # 宽度与原图相同
+])
+def test_boxes_touching_edges_keep_aspect(ys, xs):
+    mask = _mask(1000, 3000, ys, xs)
+    for padding in (0, 64):
+        result = Node._mask_crop_box(mask, padding, "gpt-image-1")
+        if result is not None:
+            _check_box(mask, padding, result)
+
+
+def test_falls_back_to_an_aspect_that_fits():
+    # 260x200 的包围盒最接近 3:2，补齐到 300 宽超出 280 宽的原图，退到 1:1
+    mask = _mask(1000, 280, (400, 600), (10, 270))
+    result = Node._mask_crop_box(mask, 0, "gpt-image-1")
+    _check_box(mask, 0, result)
+    assert result[1] == (1024, 1024)
+
+
+def test_no_box_when_empty_unfittable_or_nearly_whole():
+    assert Node._mask_crop_box(np.zeros((100, 100)), 8, "gpt-image-1") is None
+    # dall-e-2 只有 1:1，整个高度的横条放不进宽高比为 1:1 的框
+    assert Node._mask_crop_box(_mask(100, 400, (0, 100), (0, 400)), 0, "dall-e-2") is None
+    assert Node._mask_crop_box(_mask(1000, 1000, (0, 1000), (0, 10)), 0, "gpt-image-1") is None
+    # 上下都贴边，按任何支持的宽高比补齐都超出原图高度：整图上传，而不是截断成其他宽高比
+    assert Node._mask_crop_box(_mask(150, 3000, (5, 145), (1000, 1260)), 0, "gpt-image-1") is None
+
+
+def test_crop_skipped_for_mismatched_mask_and_rejects_batches():
+    torch = pytest.importorskip("torch")
+    image = torch.zeros((1, 1000, 3000, 3))
+    mask = torch.from_numpy(_mask(1000, 3000, (10, 200), (0, 50)))[None]
+    assert Node._crop_for(image, mask, 0, "gpt-image-1") is not None
+    assert Node._crop_for(image, mask[:, ::2, ::2], 0, "gpt-image-1") is None
+    with pytest.raises(ValueError):
+        Node._crop_for(torch.zeros((2, 1000, 3000, 3)), mask, 0, "gpt-image-1")
+
+
+def test_feather_alpha_expands_and_softens():
+    mask = _mask(64, 64, (24, 40), (24, 40))
+    hard = Node._feather_alpha(mask, 0)
+    assert hard.shape == (64, 64, 1) and np.array_equal(hard[..., 0], mask)
+    soft = Node._feather_alpha(mask, 8)[..., 0]
+    assert soft[32, 32] == pytest.approx(1.0) and 0 < soft[24, 21] < 1
+    assert soft[0, 0] == 0 and soft.max() <= 1
+
+
+def test_composite_only_changes_pixels_under_alpha():
+    rng = np.random.default_rng(0)
+    frame = rng.random((100, 200, 3), dtype=np.float32)
+    box = (150, 20, 200, 100)  # 贴右边的 50x80 区域
+    alpha = np.zeros((80, 50, 1), dtype=np.float32)
+    alpha[20:60, 10:40] = 1.0
+    alpha[10, 10] = 0.5
+    edited = np.full((120, 75, 3), 255, dtype=np.uint8)  # 返回尺寸与裁剪框不同，贴回时缩放
+
+    result = Node._composite(frame, edited, box, alpha)
+    assert result.shape == frame.shape
+    inside = np.zeros((100, 200), dtype=bool)
+    inside[20:100, 150:200] = alpha[..., 0] > 0
+    assert np.array_equal(result[~inside], frame[~inside])
+    assert np.allclose(result[40:80, 160:190], 1.0)
+    assert np.allclose(result[30, 160], 0.5 * frame[30, 160] + 0.5)
@@ -0,0 +1,72 @@
+""" 延迟分析结果用于选路：用本地模拟中转（MockRelay）代替真实的中转端点与 CDN """
+import asyncio
+import socket
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from mjhub import api_client  # noqa: E402
+from mjhub.endpoint_pool import Endpoint, EndpointPool  # noqa: E402
+from mjhub.mock_relay import MockRelay  # noqa: E402
+from mjhub.warmup import ConnectionWarmer  # noqa: E402
+
+
+def _closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture
+def shared_routes():
+    api_client.cdn_routes.clear()
+    yield api_client.cdn_routes
+    api_client.cdn_routes.clear()
+
+
+def test_profile_applies_to_pool_and_routes():
+    dead = _closed_port_url()
+
+    async def run():
+        async with MockRelay(gpt_image_size=(256, 256)) as relay:
+            warmer = ConnectionWarmer([(relay.url, "api"), (dead, "api"),
+                                       (f"{relay.url}/gpt-images/0.png", "cdn")], profile_rounds=2)
+            pool = EndpointPool([Endpoint(relay.url), Endpoint(dead)])
+            routes = {}
+            report = await warmer.profile_routes(pool, routes)
+            return warmer, pool, routes, report
+
+    warmer, pool, routes, report = asyncio.run(run())
+    live, down = pool.endpoints
+    assert live.latency_ewma is not None and live.errors == 0 and pool.stats()[0]["healthy"]
+    assert down.errors == 1 and not pool.stats()[1]["healthy"]
+    # 各 CDN 主机记录最快的可用路由（这里只有直连）
+    assert routes == {"127.0.0.1": ""}
+    assert report["best_routes"] == {"127.0.0.1": "direct"}
+    assert warmer.status()["profile"]["unreachable"] == [dead]
+
+
+def test_warmup_run_applies_profile_to_all_clients(shared_routes):
+    async def run():
+        async with MockRelay() as relay:
+            warmer = ConnectionWarmer([(relay.url, "api"), (f"{relay.url}/gpt-images/0.png", "cdn")],
+                                      refresh=60, profile_rounds=1)
+            task = asyncio.ensure_future(warmer.run())
+            try:
+                for _ in range(200):
+                    if warmer.status()["profile"] is not None:
+                        break
+                    await asyncio.sleep(0.05)
+            finally:
+                task.cancel()
+            client = api_client.MJClient(api_key="test-key", api_url=relay.url)
+            # 实测直连最快时即使检测到系统代理也直连下载
+            client.proxy_url = "http://127.0.0.1:1"
+            return warmer.status(), client._download_proxy(f"{relay.url}/images/1.png")
+
+    status, proxy = asyncio.run(run())
+    assert status["ready"] and status["profile"]["best_routes"] == {"127.0.0.1": "direct"}
+    assert shared_routes == {"127.0.0.1": ""}
+    assert proxy is None
@@ -0,0 +1,33 @@
+import asyncio
+import json
+
+import pytest
+
+from mjhub.output_sink import OutputSink
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+
+
+def test_asubmit_writes_image_and_metadata(tmp_path):
+    sink = OutputSink(str(tmp_path), max_backlog=1, fsync=False)
+
+    async def run():
+        for index in range(3):
+            await sink.asubmit(PNG, f"img-{index}", {"task_id": str(index)})
+
+    asyncio.run(run())
+    sink.close()
+    assert sorted(p.name for p in tmp_path.glob("*.png")) == ["img-0.png", "img-1.png", "img-2.png"]
+    records = [json.loads(line) for line in (tmp_path / "metadata.jsonl").read_text().splitlines()]
+    assert [r["task_id"] for r in records] == ["0", "1", "2"]
+    assert sink.stats()["submitted"] == sink.stats()["written"] == 3
+
+
+def test_submit_after_close_raises(tmp_path):
+    sink = OutputSink(str(tmp_path), fsync=False)
+    sink.close()
+    with pytest.raises(RuntimeError):
+        sink.submit(PNG, "late")
+    with pytest.raises(RuntimeError):
+        asyncio.run(sink.asubmit(PNG, "late"))
+    assert not list(tmp_path.glob("late*"))
@@ -0,0 +1,87 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from mjhub.pixel_cache import PixelCache
+
+
+def _pixels(value, side=16):
+    return np.full((side, side, 3), value, dtype=np.uint8)
+
+
+def test_pixel_cache_promotes_after_repeated_decodes(tmp_path):
+    cache = PixelCache(str(tmp_path), promote_after=2)
+    key = "https://cdn/a.png|0"
+    assert cache.lookup(key) is None
+    assert not cache.store_if_hot(key, _pixels(1))
+    assert cache.lookup(key) is None
+    assert cache.store_if_hot(key, _pixels(1))
+
+    hit = cache.lookup(key)
+    assert isinstance(hit, np.memmap) or isinstance(hit.base, np.memmap)
+    assert np.array_equal(hit, _pixels(1))
+    assert cache.stats()["hits"] == 1 and cache.stats()["promotions"] == 1
+
+
+def test_pixel_cache_key_includes_max_side(tmp_path):
+    cache = PixelCache(str(tmp_path), promote_after=1)
+    cache.lookup("u|0")
+    cache.store_if_hot("u|0", _pixels(1))
+    assert cache.lookup("u|512") is None
+    assert cache.lookup("u|0") is not None
+
+
+def test_pixel_cache_evicts_least_recently_used(tmp_path):
+    cache = PixelCache(str(tmp_path), promote_after=1)
+    cache.max_bytes = int(2.5 * (_pixels(0).nbytes + 128))
+    for key in ("a", "b"):
+        cache.lookup(key)
+        cache.store_if_hot(key, _pixels(1))
+    # 访问 a 后写入 c，淘汰最久未使用的 b
+    assert cache.lookup("a") is not None
+    cache.lookup("c")
+    cache.store_if_hot("c", _pixels(2))
+
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") is not None and cache.lookup("c") is not None
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".npy")]) == 2
+
+
+def test_pixel_cache_restores_index_from_directory(tmp_path):
+    cache = PixelCache(str(tmp_path), promote_after=1)
+    cache.lookup("a")
+    cache.store_if_hot("a", _pixels(3))
+    reopened = PixelCache(str(tmp_path))
+    assert reopened.stats()["entries"] == 1
+    assert np.array_equal(reopened.lookup("a"), _pixels(3))
+
+
+def test_process_decode_pool_promotes_in_parent(tmp_path):
+    pytest.importorskip("aiohttp")
+    from mjhub import api_client
+    from mjhub.decode_pool import DecodePool
+    from mjhub.mock_relay import MockRelay
+
+    async def run():
+        async with MockRelay(queue_delay=0.05, run_time=0.1, image_size=(64, 32)) as relay:
+            client = api_client.MJClient(api_key="test-key", api_url=relay.url)
+            client.poll_interval = 0.05
+            client.pool = client.scheduler = client.coord = client.sink = None
+            client.decode_pool = DecodePool(executor="process", max_workers=1)
+            client.pixels = PixelCache(str(tmp_path), promote_after=2)
+            task_id = await client.imagine("a cat")
+            data = await client.wait_for_task(task_id)
+            try:
+                images = [await client.download_task_image(task_id, data["imageUrl"], max_side=0)
+                          for _ in range(3)]
+            finally:
+                client.decode_pool._executor.shutdown()
+            return client.pixels, images
+
+    pixels, images = asyncio.run(run())
+    assert all(image.shape == (32, 64, 3) for image in images)
+    # 第二次解码后写入缓存，第三次直接命中
+    assert pixels.stats()["promotions"] == 1 and pixels.stats()["hits"] == 1
+    assert isinstance(images[2].base, np.memmap) or isinstance(images[2], np.memmap)
@@ -0,0 +1,93 @@
+""" 截止时间取消 / 轮询出错后，任务占用的各类名额都要归还（未配置 cancel_path 时也一样） """
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from mjhub import api_client  # noqa: E402
+from mjhub.coordination import HostCoordinator  # noqa: E402
+from mjhub.endpoint_pool import Endpoint, EndpointPool  # noqa: E402
+from mjhub.mock_relay import MockRelay  # noqa: E402
+from mjhub.scheduler import JobScheduler  # noqa: E402
+
+
+def _client(relay):
+    client = api_client.MJClient(api_key="test-key", api_url=relay.url)
+    client.poll_interval = 0.05
+    client.cancel_path = ""
+    client.pool = client.scheduler = client.coord = None
+    return client
+
+
+async def _timed_out_job(client):
+    async def job():
+        task_id = await client.imagine("a cat")
+        await client.wait_for_task(task_id)
+
+    with pytest.raises(TimeoutError):
+        await client.run_job(job(), deadline=0.3, check_interval=0.05)
+
+
+async def _submit(client):
+    async def job():
+        return await client.imagine("a dog")
+
+    return await asyncio.wait_for(client.run_job(job()), 5)
+
+
+def test_scheduler_ticket_released_after_deadline():
+    async def run():
+        async with MockRelay(queue_delay=0.05, run_time=30) as relay:
+            client = _client(relay)
+            client.scheduler = JobScheduler(max_in_flight=1, wait_interval=0.05)
+            await _timed_out_job(client)
+            assert client.scheduler.stats()["in_flight"] == 0
+            # 名额已归还，下一个任务立即提交
+            assert await _submit(client)
+
+    asyncio.run(run())
+
+
+def test_scheduler_ticket_released_after_poll_error():
+    async def run():
+        async with MockRelay(queue_delay=0.05, run_time=30) as relay:
+            client = _client(relay)
+            client.scheduler = JobScheduler(max_in_flight=1, wait_interval=0.05)
+
+            async def job():
+                task_id = await client.imagine("a cat")
+                relay.tasks.clear()
+                await client.wait_for_task(task_id)
+
+            with pytest.raises(Exception):
+                await client.run_job(job())
+            assert client.scheduler.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_endpoint_slot_released_after_deadline():
+    async def run():
+        async with MockRelay(queue_delay=0.05, run_time=30) as relay:
+            client = _client(relay)
+            client.pool = EndpointPool([Endpoint(relay.url, "test-key", 1)], wait_interval=0.05)
+            await _timed_out_job(client)
+            assert client.pool.endpoints[0].in_flight == 0
+            assert await _submit(client)
+
+    asyncio.run(run())
+
+
+def test_coordinator_slot_released_after_deadline(tmp_path):
+    async def run():
+        async with MockRelay(queue_delay=0.05, run_time=30) as relay:
+            client = _client(relay)
+            client.coord = HostCoordinator(str(tmp_path), max_in_flight_per_key=1)
+            try:
+                await _timed_out_job(client)
+                assert await _submit(client)
+            finally:
+                client.coord.close()
+
+    asyncio.run(run())
@@ -0,0 +1,82 @@
+import asyncio
+import base64
+import json
+
+from mjhub.upload_body import CHUNK_BYTES, StreamingJSONBody
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 700
+JPEG = b"\xff\xd8\xff" + b"\x01" * (CHUNK_BYTES + 1)
+
+
+def _collect(body):
+    async def run():
+        length, chunks = body.open()
+        return length, b"".join([chunk async for chunk in chunks])
+    return asyncio.run(run())
+
+
+def _expected(payload, key, values):
+    items = []
+    for value in values:
+        if isinstance(value, bytes):
+            mime = "image/png" if value.startswith(b"\x89PNG") else "image/jpeg"
+            value = f"data:{mime};base64,{base64.b64encode(value).decode()}"
+        items.append(value)
+    return dict(payload, **{key: items})
+
+
+def test_matches_json_dumps():
+    payload = {"botType": "MID_JOURNEY", "dimensions": "SQUARE", "note": "中文 \"quoted\""}
+    values = [PNG, "data:image/png;base64,AAAA", JPEG]
+    length, data = _collect(StreamingJSONBody(payload, "base64Array", values))
+    assert json.loads(data) == _expected(payload, "base64Array", values)
+    assert length == len(data)
+
+
+def test_payload_without_other_fields():
+    length, data = _collect(StreamingJSONBody({}, "base64Array", [PNG]))
+    assert json.loads(data) == {"base64Array": [_expected({}, "k", [PNG])["k"][0]]}
+    assert length == len(data)
+
+
+def test_upload_bytes_matches_data_url_length():
+    body = StreamingJSONBody({}, "base64Array", [PNG, JPEG])
+    _, data = _collect(body)
+    assert body.upload_bytes == sum(len(url) for url in json.loads(data)["base64Array"])
+
+
+def test_pending_inputs_use_chunked_and_can_reopen():
+    async def run():
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        body = StreamingJSONBody({"a": 1}, "base64Array", [PNG, future])
+        length, chunks = body.open()
+        assert length is None
+        loop.call_later(0.01, future.set_result, JPEG)
+        first = b"".join([chunk async for chunk in chunks])
+        # 重试时重新生成，输入已就绪，带 Content-Length
+        length, chunks = body.open()
+        second = b"".join([chunk async for chunk in chunks])
+        return first, second, length
+
+    first, second, length = asyncio.run(run())
+    assert first == second
+    assert length == len(second)
+    assert json.loads(first) == _expected({"a": 1}, "base64Array", [PNG, JPEG])
+
+
+def test_failed_input_is_recorded():
+    async def run():
+        future = asyncio.get_running_loop().create_future()
+        future.set_exception(ValueError("encode failed"))
+        body = StreamingJSONBody({}, "base64Array", [PNG, future])
+        length, chunks = body.open()
+        assert length is None
+        try:
+            async for _ in chunks:
+                pass
+        except ValueError:
+            pass
+        return body.error
+
+    assert isinstance(asyncio.run(run()), ValueError)
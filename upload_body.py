@@ -0,0 +1,107 @@
+""" 流式 JSON 请求体：Blend 上传时 base64 按块边编码边发送，不拼出完整的 JSON 字符串
+
+json.dumps 整个 Blend 参数需要同时持有：原始压缩字节、base64 字符串、data URL 字符串、JSON 字符串和
+编码后的请求体，两张 4MB 的 PNG 峰值就超过 50MB。这里把请求体拆成 JSON 框架 + 每张图的
+"data:image/png;base64," 前缀 + 按 48KB 切片编码的 base64 块，只在发送时逐块生成：
+
+- 各输入图按顺序发送，第一张准备好就开始上传，后面的图（Tensor 的 PNG 编码、结果图下载）同时进行
+- 所有输入在发送前已就绪时带 Content-Length；否则使用 chunked 传输
+- 端点切换重试时重新生成请求体，输入只准备一次
+"""
+import asyncio
+import base64
+import json
+
+from .output_sink import image_extension
+
+# 每次编码的原始字节数，必须是 3 的倍数，块与块直接拼接才是合法的 base64
+CHUNK_BYTES = 48 * 1024
+
+_MIME = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp", "gif": "image/gif"}
+
+
+def data_url_prefix(data):
+    """原始压缩字节对应的 data URL 前缀（按文件头判断格式，未知格式按 png）"""
+    return f"data:{_MIME.get(image_extension(data), 'image/png')};base64,"
+
+
+def _b64_length(size):
+    return (size + 2) // 3 * 4
+
+
+class StreamingJSONBody:
+    """
+    Args:
+        payload (dict): 其余参数，发送时才序列化（调度器在提交前写入的 accountFilter 也会带上）
+        key (str): 流式数组字段名，如 "base64Array"
+        items (list): 数组各项，可以是 str（原样作为 JSON 字符串）、bytes（编码为 data URL），
+            或结果为二者之一的 asyncio.Future / Task
+    """
+
+    def __init__(self, payload, key, items):
+        self.payload = payload
+        self.key = key
+        self.items = list(items)
+        # 输入准备失败时记录异常：发送中断在 aiohttp 中表现为连接错误，提交方据此区分，不切换端点
+        self.error = None
+        # 数组各项的字符数（与 data URL 字符串长度一致，供记录 upload_bytes）
+        self.upload_bytes = 0
+
+    def _ready(self):
+        return all(not isinstance(item, asyncio.Future) or (item.done() and not item.cancelled()
+                                                            and item.exception() is None)
+                   for item in self.items)
+
+    @staticmethod
+    def _item_length(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return len(data_url_prefix(value)) + _b64_length(len(value)) + 2
+        return len(json.dumps(value).encode("utf-8"))
+
+    def _framing(self):
+        fields = {k: v for k, v in self.payload.items() if k != self.key}
+        tail = json.dumps(fields)[1:-1]
+        head = f'{{{json.dumps(self.key)}: ['.encode("utf-8")
+        end = ((f"], {tail}}}" if tail else "]}").encode("utf-8"))
+        return head, end
+
+    def open(self):
+        """
+        生成一次请求体（每次提交 / 重试调用一次）
+        return: (content_length, 异步字节迭代器)，有输入尚未就绪时 content_length 为 None
+        """
+        head, end = self._framing()
+        length = None
+        if self._ready():
+            values = [item.result() if isinstance(item, asyncio.Future) else item for item in self.items]
+            length = (len(head) + len(end) + 2 * max(len(values) - 1, 0)
+                      + sum(self._item_length(value) for value in values))
+        return length, self._chunks(head, end)
+
+    async def _chunks(self, head, end):
+        self.upload_bytes = 0
+        yield head
+        for index, item in enumerate(self.items):
+            if index:
+                yield b", "
+            if isinstance(item, asyncio.Future):
+                try:
+                    value = await item
+                except Exception as e:
+                    self.error = e
+                    raise
+            else:
+                value = item
+            if not isinstance(value, (bytes, bytearray, memoryview)):
+                encoded = json.dumps(value).encode("utf-8")
+                self.upload_bytes += len(encoded) - 2
+                yield encoded
+                continue
+            prefix = data_url_prefix(value)
+            self.upload_bytes += len(prefix) + _b64_length(len(value))
+            yield f'"{prefix}'.encode("ascii")
+            view = memoryview(value)
+            for offset in range(0, len(view), CHUNK_BYTES):
+                yield base64.b64encode(view[offset:offset + CHUNK_BYTES])
+            yield b'"'
+        yield end
@@ -11,6 +11,11 @@ def load_config():
 # 创建一个 init logger，日志按文件大小切割日志，最多保存5个日志文件，日志级别为 DEBUG
 def init_logger():
     logger = logging.getLogger()
+    log_file = os.path.join(os.path.dirname(__file__), 'logs', 'midjourney.log')
+    # 每个 GPT 节点实例化时都会调用，同一个文件只挂一个 handler
+    for handler in logger.handlers:
+        if isinstance(handler, logging.FileHandler) and handler.baseFilename == os.path.abspath(log_file):
+            return logger
     logger.setLevel(logging.DEBUG)
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(lineno)d - %(funcName)s - %(message)s')
 
@@ -18,7 +23,6 @@ def init_logger():
     log_dir = os.path.join(os.path.dirname(__file__), 'logs')
     if not os.path.exists(log_dir): # 如果日志文件夹不存在，则创建
         os.makedirs(log_dir)
-    log_file = os.path.join(log_dir, 'midjourney.log')
     file_handler = logging.FileHandler(log_file)
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
@@ -0,0 +1,203 @@
+""" 连接预热：在后台提前解析并连接中转端点与 CDN，空闲超时前刷新，并发布就绪状态与延迟
+
+ComfyUI 启动后（或长时间空闲后）的第一个作业要付出 DNS 解析、TCP / TLS 握手、系统代理探测，
+以及首次执行时加载 aiohttp / numpy / PIL 的开销。在 config.ini 中开启后，注册节点时启动一个后台线程：
+
+    [WARMUP]
+      enabled: true
+      hosts: https://cdn.discordapp.com    # 额外预热的主机（逗号分隔），中转端点（api_url 与 [MIDJOURNEY_POOL]）自动包含
+      refresh: 10                          # 刷新间隔（秒），应小于 connections.KEEPALIVE_TIMEOUT
+      delay: 5                             # 注册节点后等待多久开始（避免与 ComfyUI 加载其他节点争抢）
+      profile: false                       # 首轮预热后运行一次延迟分析（net_profiler），结果用于选路
+      profile_rounds: 3                    # 延迟分析的探测轮数
+
+后台线程完成：加载客户端依赖、探测系统代理，然后在共享循环（connections.io_loop，ComfyUI 节点的作业
+也在这个循环上运行）上把各主机的 DNS 结果写入共享缓存、建立并定期刷新 keep-alive 连接，并测量
+dns_ms（解析）、connect_ms（新连接上的第一个请求，含 TCP / TLS 握手）、rtt_ms（keep-alive 连接上的请求）。
+第一个作业直接复用预热好的连接；batch_runner 在自己的循环上运行同一个预热任务，效果相同。
+开启 profile 时，首轮预热后对同一组目标（直连与系统代理）做一次延迟分析：进程内共享的端点池按实测 TTFB
+初始化延迟估计并摘除不可达端点，各 CDN 主机的最快路由写入 api_client.cdn_routes，所有客户端下载时使用。
+"""
+import asyncio
+import logging
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+from .endpoint_pool import EndpointPool
+from .utils import load_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOSTS = "https://cdn.discordapp.com"
+
+
+def config_targets(config):
+    """配置中的中转端点（api_url 与 [MIDJOURNEY_POOL]）和 CDN 主机（[WARMUP] hosts），返回 [(url, kind)]"""
+    urls = [config['MIDJOURNEY_API']['api_url']] if config.has_section('MIDJOURNEY_API') else []
+    pool = EndpointPool.from_config(config)
+    if pool is not None:
+        urls += [endpoint.url for endpoint in pool.endpoints]
+    targets = [(url.rstrip("/"), "api") for url in dict.fromkeys(urls)]
+    hosts = config.get('WARMUP', 'hosts', fallback=DEFAULT_HOSTS)
+    targets += [(url.strip().rstrip("/"), "cdn") for url in hosts.split(",") if url.strip()]
+    return targets
+
+
+class ConnectionWarmer:
+    """
+    Args:
+        targets (list): [(url, kind)]，kind 为 connections.KINDS 之一
+        refresh (float): 刷新间隔（秒）
+        profile_rounds (int): 首轮预热后延迟分析的探测轮数，0 表示不分析
+    """
+
+    def __init__(self, targets, refresh=10, delay=0, profile_rounds=0):
+        self.targets = list(targets)
+        self.refresh = refresh
+        self.delay = delay
+        self.profile_rounds = profile_rounds
+        self._status = {}
+        self._profile = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.has_section('WARMUP') or not config['WARMUP'].getboolean('enabled', False):
+            return None
+        section = config['WARMUP']
+        profile_rounds = section.getint('profile_rounds', 3) if section.getboolean('profile', False) else 0
+        return cls(config_targets(config), refresh=section.getfloat('refresh', 10), delay=section.getfloat('delay', 5),
+                   profile_rounds=profile_rounds)
+
+    async def _warm(self, session_factory, resolver, url, kind):
+        import aiohttp
+
+        parsed = urlparse(url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        entry = {"url": url, "kind": kind, "ready": False}
+        with self._lock:
+            previous = self._status.get((url, kind))
+        # 首次预热测量新连接与 keep-alive 连接两个请求，之后的刷新只需一个请求保持连接不过期
+        keys = ("rtt_ms",) if previous is not None and previous["ready"] else ("connect_ms", "rtt_ms")
+        if previous is not None and "connect_ms" in previous:
+            entry["connect_ms"] = previous["connect_ms"]
+        try:
+            started = time.perf_counter()
+            # 与 TCPConnector 的默认 family 一致，写入的缓存项才会被后续请求命中
+            await resolver.resolve(parsed.hostname, port, socket.AF_UNSPEC)
+            entry["dns_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+            timeout = aiohttp.ClientTimeout(total=15, connect=10)
+            async with session_factory(kind, timeout=timeout) as session:
+                for key in keys:
+                    # 只需要拿到响应头：状态码无关紧要，能响应即说明连接可用
+                    started = time.perf_counter()
+                    async with session.head(url + "/", allow_redirects=False) as response:
+                        entry["http_status"] = response.status
+                    entry[key] = round((time.perf_counter() - started) * 1000, 1)
+            entry["ready"] = True
+        except Exception as e:
+            entry["error"] = str(e) or type(e).__name__
+        entry["warmed_at"] = time.time()
+        with self._lock:
+            self._status[(url, kind)] = entry
+        if previous is None or previous["ready"] != entry["ready"]:
+            logger.info(f"Warm-up {url}: {entry}")
+
+    async def warm_once(self):
+        from .connections import client_session, get_resolver
+
+        await asyncio.gather(*(self._warm(client_session, get_resolver(), url, kind) for url, kind in self.targets))
+
+    async def profile_routes(self, pool=None, routes=None):
+        """
+        对预热目标（直连与系统代理）运行一次延迟分析，并用于选路：pool 按实测 TTFB 初始化延迟估计、
+        摘除不可达端点，routes 记录各 CDN 主机的最快路由（见 net_profiler.apply）
+        return: 分析结果
+        """
+        from .api_client import system_proxy
+        from .net_profiler import LatencyProfiler, apply
+
+        profiler = LatencyProfiler(self.targets, routes=[None, system_proxy()], rounds=self.profile_rounds)
+        report = apply(await profiler.run(), pool=pool, routes=routes)
+        with self._lock:
+            self._profile = {"best_routes": dict(report["best_routes"]), "duration_s": report["duration_s"],
+                             "unreachable": sorted({e["url"] for e in report["targets"] if not e["ok"]})}
+        logger.info(f"Latency profile applied: {self._profile}")
+        return report
+
+    async def run(self):
+        """在当前循环上持续预热：登记循环，每 refresh 秒刷新一次（先于 keep-alive 空闲超时）；首轮后按需做延迟分析"""
+        from .connections import register_loop
+
+        register_loop()
+        await self.warm_once()
+        if self.profile_rounds:
+            from .api_client import cdn_routes, config
+            from .endpoint_pool import get_endpoint_pool
+
+            try:
+                await self.profile_routes(get_endpoint_pool(config), cdn_routes)
+            except Exception as e:
+                logger.warning(f"Latency profile failed: {e}")
+        while True:
+            await asyncio.sleep(self.refresh)
+            await self.warm_once()
+
+    def _thread_main(self):
+        time.sleep(self.delay)
+        try:
+            # 提前加载客户端依赖并探测系统代理，第一个作业不再付出这部分开销
+            from .api_client import system_proxy
+
+            from .connections import io_loop
+
+            system_proxy()
+            # 与节点作业共用同一个循环上的连接池，预热的连接才能被作业复用
+            asyncio.run_coroutine_threadsafe(self.run(), io_loop()).result()
+        except Exception as e:
+            logger.warning(f"Connection warm-up stopped: {e}")
+
+    def start(self):
+        """启动后台预热线程（守护线程，随进程退出）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._thread_main, name="mj-warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def status(self):
+        """
+        整体是否就绪，每个目标的 {url, kind, ready, dns_ms, connect_ms, rtt_ms, http_status, error, warmed_at}，
+        以及延迟分析应用的结果 {best_routes, duration_s, unreachable}（未开启或尚未完成时为 None）
+        """
+        with self._lock:
+            targets = [dict(entry) for entry in self._status.values()]
+            profile = self._profile
+        ready = len(targets) == len(self.targets) and all(entry["ready"] for entry in targets)
+        return {"ready": ready, "targets": targets, "profile": profile}
+
+
+_warmer = None
+_warmer_loaded = False
+_warmer_lock = threading.Lock()
+
+
+def get_warmer():
+    """进程内共享的预热器，未开启 [WARMUP] 时返回 None"""
+    global _warmer, _warmer_loaded
+    with _warmer_lock:
+        if not _warmer_loaded:
+            _warmer = ConnectionWarmer.from_config(load_config())
+            _warmer_loaded = True
+        return _warmer
+
+
+def start_warmup():
+    """开启 [WARMUP] 时启动后台预热线程，返回预热器（未开启时返回 None）"""
+    warmer = get_warmer()
+    if warmer is not None:
+        warmer.start()
+    return warmer